@@ -1,10 +1,12 @@
 
 # agent_completo.py - Super limpio sin referencias JSON problemáticas
 
+import os
 import re
 import json
 import logging
 import traceback
+from threading import Lock
 from time import sleep
 from langchain.agents import (
     AgentExecutor,
@@ -13,23 +15,57 @@ from langchain.agents import (
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import Tool
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage
 
 from dotenv import load_dotenv
 load_dotenv()
 
 from tools_completo import PathTools
+from services.deadline import LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT
+from services.history_compactor import history_compactor
+from services.logging_config import log_ref
+from services.metrics import llm_metrics_callback
+from services.tracing import traced
 
-# Configurar logging detallado
-logging.basicConfig(level=logging.DEBUG)
+# El logging se configura en app.py (services.logging_config)
 logger = logging.getLogger(__name__)
 
+# Trazas detalladas del AgentExecutor (muy verbosas, solo para depuración)
+AGENT_VERBOSE = os.getenv('AGENT_VERBOSE', 'False').lower() == 'true'
+
+# Tope de ejecución del AgentExecutor (se revisa entre iteraciones)
+AGENT_MAX_EXECUTION_SECONDS = float(os.getenv('AGENT_MAX_EXECUTION_SECONDS', '90'))
+
+# Campos del registro que el agente necesita; la evaluación interna nunca entra al prompt
+CANDIDATE_CONTEXT_FIELDS = ('id', 'nombre_completo', 'cv_recibido', 'cv_link', 'puesto_solicitado', 'fase_proceso')
+
+def build_agent_input(user_phone, message, candidate=None):
+    """
+    Arma el input del agente con el teléfono y, si ya se consultó, el estado del candidato
+    Con ESTADO_CANDIDATO el agente no necesita llamar a get_candidate
+    """
+    if candidate is None:
+        return f"TELEFONO_USUARIO: {user_phone} | MENSAJE: {message}"
+
+    estado = {'status': candidate.get('status')}
+    if candidate.get('status') == 'found':
+        estado.update({field: candidate.get(field, '') for field in CANDIDATE_CONTEXT_FIELDS})
+    return f"TELEFONO_USUARIO: {user_phone} | ESTADO_CANDIDATO: {json.dumps(estado, ensure_ascii=False)} | MENSAJE: {message}"
+
 class AgentPath:
     def __init__(self):
         try:
             logger.info("🤖 Inicializando AgentPath...")
-            self.llm = ChatOpenAI(model='gpt-4o-mini')
+            # ✅ Un solo cliente LLM por instancia: reutiliza el pool HTTP hacia OpenAI
+            self.llm = ChatOpenAI(
+                model='gpt-4o-mini',
+                temperature=0,
+                timeout=LLM_REQUEST_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                callbacks=[llm_metrics_callback]
+            )
             self.tool = PathTools()
+            self._executors = {}
+            self._executors_lock = Lock()
             logger.info("✅ AgentPath inicializado correctamente")
         except Exception as e:
             logger.error(f"❌ Error inicializando AgentPath: {e}")
@@ -47,7 +83,7 @@ class AgentPath:
             ]
             logger.info(f"📦 {len(tools)} herramientas cargadas")
 
-            llm = ChatOpenAI(model='gpt-4o-mini', temperature=0)
+            llm = self.llm
             logger.info("🧠 LLM inicializado")
 
             # ✅ PROMPT CORREGIDO - Sin revelar perfil + respuesta estándar entrevistas
@@ -73,7 +109,7 @@ class AgentPath:
                     - Ayuda y facilita la postulación
 
                     FLUJO INTELIGENTE DE CV:
-                    1. SIEMPRE verifica primero si el usuario ya está registrado usando ejecutar_spreadsheet_manager
+                    1. SIEMPRE verifica primero si el usuario ya está registrado: usa ESTADO_CANDIDATO del input si viene; si no viene, usa ejecutar_spreadsheet_manager
                     2. Si el usuario YA TIENE CV procesado (cv_link no vacío O cv_recibido = "Sí"):
                     - NO menciones el CV nuevamente
                     - NO pidas CV
@@ -110,8 +146,9 @@ class AgentPath:
                     ⚠️ REGLAS CRÍTICAS:
 
                     1. VERIFICACIÓN OBLIGATORIA:
-                    - SIEMPRE usa ejecutar_spreadsheet_manager con get_candidate al inicio
-                    - Revisa cv_link Y cv_recibido para determinar estado del CV
+                    - Si el input trae ESTADO_CANDIDATO, ese es el registro actual del candidato: NO llames a get_candidate
+                    - Si el input NO trae ESTADO_CANDIDATO, usa ejecutar_spreadsheet_manager con get_candidate al inicio
+                    - Revisa cv_link Y cv_recibido para determinar estado del CV (status "not_found" = candidato nuevo)
 
                     2. PROCESAMIENTO DE CV:
                     - SOLO usa ejecutar_analyzer_cv si el mensaje ACTUAL contiene exactamente "PROCESO_CV:"
@@ -130,7 +167,7 @@ class AgentPath:
                     INSTRUCCIONES ESPECÍFICAS DE HERRAMIENTAS:
 
                     🔧 Para ejecutar_spreadsheet_manager:
-                    - SIEMPRE verificar estado del candidato primero
+                    - Verificar estado del candidato primero solo si el input no trae ESTADO_CANDIDATO
                     - action="get_candidate", phone="numero_telefono"
                     - Usar resultado para determinar flujo de conversación
 
@@ -174,6 +211,29 @@ class AgentPath:
             logger.error(f"❌ Traceback: {traceback.format_exc()}")
             raise
     
+    def _get_executor(self, agente, tools):
+        """Devuelve un AgentExecutor reutilizable para el agente dado"""
+        key = id(agente)
+        executor = self._executors.get(key)
+        if executor is not None:
+            return executor
+
+        with self._executors_lock:
+            executor = self._executors.get(key)
+            if executor is None:
+                executor = AgentExecutor.from_agent_and_tools(
+                    agent=agente,
+                    tools=tools,
+                    verbose=AGENT_VERBOSE,
+                    handle_parsing_errors=True,
+                    max_iterations=3,
+                    # Tope absoluto de la respuesta tardía (el turno envía antes un mensaje de espera)
+                    max_execution_time=AGENT_MAX_EXECUTION_SECONDS,
+                )
+                self._executors[key] = executor
+                logger.info("🔧 AgentExecutor creado")
+        return executor
+
     def _extract_cv_info_from_input(self, input_message):
         """Extrae información del CV desde el mensaje de entrada"""
         try:
@@ -184,7 +244,7 @@ class AgentPath:
                 file_path = match.group(1).strip()
                 phone = match.group(2).strip()
                 user_message = match.group(3).strip()
-                logger.info(f"📎 CV detectado: {file_path}, teléfono: {phone}")
+                logger.info(f"📎 CV detectado (archivo {log_ref(file_path)}), teléfono: {phone}")
                 return {
                     'is_cv': True,
                     'file_path': file_path,
@@ -199,7 +259,7 @@ class AgentPath:
     def _extract_phone_from_input(self, input_message):
         """Extrae el número de teléfono del mensaje de entrada"""
         try:
-            phone_pattern = r"TELEFONO_USUARIO:\s*([^|]+)\s*\|\s*MENSAJE:\s*(.*)"
+            phone_pattern = r"TELEFONO_USUARIO:\s*([^|]+)\s*\|\s*(?:ESTADO_CANDIDATO:\s*[^|]*\|\s*)?MENSAJE:\s*(.*)"
             match = re.search(phone_pattern, input_message)
             
             if match:
@@ -215,38 +275,17 @@ class AgentPath:
             logger.error(f"❌ Error extrayendo teléfono: {e}")
             return {'phone': None, 'message': input_message}
     
-    def _format_chat_history(self, history_messages):
-        """Convierte el historial en objetos de mensaje de LangChain"""
+    def _format_chat_history(self, history_messages, phone=None):
+        """
+        Convierte el historial en objetos de mensaje de LangChain
+        Los mensajes recientes van literales dentro del presupuesto de tokens y los anteriores
+        se pliegan en el resumen de la sesión (ver services/history_compactor.py)
+        """
         try:
-            formatted_messages = []
-            
             if not history_messages:
                 return []
-            
-            # Procesar solo los últimos 5 mensajes para no sobrecargar
-            recent_messages = history_messages[-5:] if len(history_messages) > 5 else history_messages
-            
-            for message in recent_messages:
-                if not message.get('body'):
-                    continue
-                    
-                body = message.get('body', '').strip()
-                if not body:
-                    continue
-                
-                # ✅ FILTRAR nombres de archivos del historial para evitar confusión
-                if body.endswith('.pdf') or body.endswith('.docx') or body.endswith('.doc'):
-                    logger.info(f"🚫 Filtrando nombre de archivo del historial: {body}")
-                    continue
-                
-                # Determinar si es del usuario o del asistente
-                if message.get('fromMe', False):
-                    # Mensaje del bot (asistente)
-                    formatted_messages.append(AIMessage(content=body))
-                else:
-                    # Mensaje del usuario
-                    formatted_messages.append(HumanMessage(content=body))
-            
+
+            formatted_messages = history_compactor.build(history_messages, phone)
             logger.info(f"📋 Historial formateado: {len(formatted_messages)} mensajes válidos")
             return formatted_messages
             
@@ -254,6 +293,7 @@ class AgentPath:
             logger.warning(f"⚠️ Error formateando historial: {e}")
             return []
 
+    @traced('agent.procesar_cv_con_evaluacion')
     def procesar_cv_con_evaluacion(self, cv_result, user_phone):
         """Procesa el resultado del CV y registra/actualiza al candidato con todos los campos"""
         try:
@@ -335,10 +375,7 @@ class AgentPath:
                 result_data = json.loads(add_result)
                 
                 if result_data.get('status') == 'success':
-                    # Extraer ID del candidato del mensaje de éxito
-                    success_message = result_data.get('message', '')
-                    id_match = re.search(r'ID: (CAND_\w+)', success_message)
-                    candidate_id = id_match.group(1) if id_match else 'ID_NO_ENCONTRADO'
+                    candidate_id = result_data.get('candidate_id') or 'ID_NO_ENCONTRADO'
                     
                     logger.info(f"✅ Candidato registrado exitosamente: {candidate_id}")
                     return {
@@ -355,10 +392,11 @@ class AgentPath:
             logger.error(f"❌ Error en procesamiento completo: {str(e)}")
             return None
     
+    @traced('agent.procesar_mensaje')
     def procesar_mensaje(self, msg, agente, tools, history_messages=None):
         """Procesa el mensaje recibido vía WhatsApp y llama a la herramienta correcta."""
         try:
-            logger.info(f"📝 Iniciando procesamiento del mensaje: {msg}")
+            logger.debug("📝 Iniciando procesamiento del mensaje: %s", msg)
             
             # ✅ VERIFICACIÓN MEJORADA - Solo procesar CV si está en el mensaje ACTUAL
             if "PROCESO_CV:" in msg:
@@ -373,7 +411,7 @@ class AgentPath:
                 user_phone = cv_info['phone']
                 user_name = cv_info.get('message', '').split('.')[0]
                 
-                logger.info(f"📋 Procesando CV: {file_path} para {user_phone}")
+                logger.info(f"📋 Procesando CV (archivo {log_ref(file_path)}) para {user_phone}")
                 
                 # Paso 1: Procesar CV con analyzer
                 cv_result = self.tool.run_def_analyzer_cv(
@@ -402,14 +440,7 @@ class AgentPath:
             # ✅ PARA MENSAJES NORMALES - Procesar con agente normal
             logger.info("💬 Procesando mensaje normal (no es CV)")
             
-            agent_executor = AgentExecutor.from_agent_and_tools(
-                agent=agente,
-                tools=tools,
-                verbose=True,
-                handle_parsing_errors=True,
-                max_iterations=3,
-            )
-            logger.info("🔧 AgentExecutor creado")
+            agent_executor = self._get_executor(agente, tools)
 
             # Preparar el input para el agente
             executor_prompt = {
@@ -419,7 +450,10 @@ class AgentPath:
             # Formatear historial correctamente
             if history_messages:
                 try:
-                    formatted_history = self._format_chat_history(history_messages)
+                    formatted_history = self._format_chat_history(
+                        history_messages,
+                        phone=self._extract_phone_from_input(msg)['phone']
+                    )
                     executor_prompt["chat_history"] = formatted_history
                     logger.info(f"📋 Historial formateado correctamente: {len(formatted_history)} mensajes")
                 except Exception as e:
@@ -430,7 +464,8 @@ class AgentPath:
 
             logger.info("🚀 Ejecutando agente...")
             resultado = agent_executor.invoke(executor_prompt)
-            logger.info(f"✅ Agente ejecutado. Output: {resultado.get('output', 'Sin output')}")
+            logger.info("✅ Agente ejecutado")
+            logger.debug("✅ Output del agente: %s", resultado.get('output', 'Sin output'))
             
             return resultado
             
@@ -454,4 +489,36 @@ class AgentPath:
             
             return {
                 "output": error_msg
-            }
\ No newline at end of file
+            }
+
+
+class AgentRegistry:
+    """
+    Registro de componentes del agente construidos una sola vez por proceso
+    AgentPath, cliente LLM, herramientas y AgentExecutor se reutilizan entre
+    hilos: ninguno guarda estado de la conversación entre invocaciones
+    """
+
+    _instance = None
+    _lock = Lock()
+
+    def __init__(self):
+        logger.info("🏗️ Construyendo registro de componentes del agente...")
+        self.agent_path = AgentPath()
+        self.agente, self.tools = self.agent_path.crear_agente()
+        self.executor = self.agent_path._get_executor(self.agente, self.tools)
+        PathTools.warm_up()
+        logger.info("✅ Registro de componentes listo")
+
+    @classmethod
+    def get(cls) -> 'AgentRegistry':
+        """Devuelve el registro del proceso, construyéndolo en el primer uso"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def procesar_mensaje(self, msg, history_messages=None):
+        """Procesa un mensaje con los componentes compartidos"""
+        return self.agent_path.procesar_mensaje(msg, self.agente, self.tools, history_messages)
@@ -1,58 +1,125 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
+import asyncio
 import tempfile
 import requests
 from pathlib import Path
 import time
+import hashlib
 import logging
 import traceback
-from threading import Lock
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from services.waha import Waha
-from agent_completo import AgentPath
+from services.waha_async import async_runner
+from services.history_store import history_store
+from services.worker_pool import WorkerPool
+from services.chat_scheduler import ChatScheduler
+from services.dedup import MessageDeduplicator
+from services.outbox import Outbox
+from services.waha_health import waha_breaker, waha_health
+from services.session_store import session_store
+from services.intent_router import intent_router
+from services.deadline import DeadlineExceeded, stage_timeout, start_deadline, submit
+from services.metrics import TURN_FALLBACKS, WEBHOOK_EVENTS, register_gauge, render_metrics, track_stage
+from services.tracing import span, start_trace, trace_headers
+from services.logging_config import log_ref, setup_logging
+from agent_completo import AgentRegistry, build_agent_input
+from tools_completo import PathTools
+from utils.cv_analyser import get_incoming_path
 
-# Configurar logging más detallado
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 # Configuración global
-UPLOAD_FOLDER = 'temp_uploads'
+# ✅ Las descargas van a la carpeta de entrada del storage de CVs (se mueven sin copiar)
+UPLOAD_FOLDER = str(get_incoming_path())
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx'}
 
-# ✅ NUEVO: Control de mensajes duplicados
-processed_messages = set()
-processing_lock = Lock()
+# ✅ NUEVO: Límites de descarga de archivos multimedia
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(10 * 1024 * 1024)))
+MEDIA_DOWNLOAD_DEADLINE = float(os.getenv('MEDIA_DOWNLOAD_DEADLINE', '60'))
+MEDIA_CHUNK_SIZE = 64 * 1024
 
-# Crear directorio de uploads temporales si no existe
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# ✅ NUEVO: Modo asíncrono - el webhook encola y un pool de workers procesa el turno
+WEBHOOK_ASYNC_MODE = os.getenv('WEBHOOK_ASYNC_MODE', 'False').lower() == 'true'
+turn_pool = WorkerPool()
+
+# ✅ NUEVO: Un turno por chat a la vez y agrupación de ráfagas (0 desactiva el debounce)
+CHAT_DEBOUNCE_SECONDS = float(os.getenv('CHAT_DEBOUNCE_SECONDS', '1.5'))
+
+# ✅ NUEVO: Control de mensajes duplicados con TTL (memoria o SQLite compartido)
+message_dedup = MessageDeduplicator()
+
+# ✅ NUEVO: Outbox persistente - las respuestas se guardan en SQLite y un hilo las entrega con reintentos
+OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'True').lower() == 'true'
+outbox = Outbox() if OUTBOX_ENABLED else None
+
+# ✅ NUEVO: Respuestas directas para saludos, entrevistas y estado de la postulación
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'True').lower() == 'true'
+
+# ✅ NUEVO: Deadline por turno - si el agente no responde a tiempo se envía un mensaje de espera
+TURN_INTERIM_REPLY = os.getenv('TURN_INTERIM_REPLY', 'Estoy revisando tu consulta, te respondo en un momento. ⏳')
+CV_INTERIM_REPLY = '¡Recibí tu CV! 📄 Lo estoy procesando, te respondo en un momento. ⏳'
+LATE_REPLY_FAILED = '❌ No pude completar tu consulta a tiempo. Por favor, intenta de nuevo.'
+AGENT_LATE_REPLY_SECONDS = float(os.getenv('AGENT_LATE_REPLY_SECONDS', '120'))
+
+# ✅ NUEVO: En modo asíncrono, los turnos que no pueden ejecutarse con WAHA caído se reintentan tras esta espera
+TURN_DEFER_SECONDS = float(os.getenv('TURN_DEFER_SECONDS', '15'))
+
+def start_services():
+    """
+    Arranca logging, hilos en segundo plano y gauges del proceso web
+
+    No se ejecuta al importar el módulo como __mp_main__: los procesos de extracción de PDF (spawn)
+    reimportan app.py y no deben abrir otro consumidor del outbox ni otro poller de WAHA
+    """
+    # ✅ Logging no bloqueante: cola + listener, con enmascarado, truncado, muestreo y niveles por módulo
+    setup_logging()
+
+    if outbox:
+        # Entregar lo que quedó pendiente antes de un reinicio
+        outbox.start()
+        register_gauge('chatbot_outbox_pending', 'Mensajes del outbox pendientes de entrega', lambda: outbox.stats()['pending'])
+
+    # ✅ NUEVO: Escrituras a Sheets que fallaron se reintentan desde el store de sesiones
+    session_store.start_sync(PathTools.sync_write)
+
+    # ✅ NUEVO: Estado de la sesión de WAHA consultado en segundo plano + circuit breaker compartido
+    waha_health.start()
+    register_gauge('chatbot_waha_available', 'WAHA disponible para entregar respuestas (1) o no (0)', lambda: int(waha_health.is_available()))
+    register_gauge('chatbot_waha_circuit_open', 'Circuit breaker de WAHA abierto (1) o no (0)', lambda: int(waha_breaker.state == waha_breaker.OPEN))
+
+    # ✅ NUEVO: Gauges del pool de workers para /metrics
+    register_gauge('chatbot_worker_queue_depth', 'Turnos en cola esperando un worker', lambda: turn_pool.stats()['queue_depth'])
+    register_gauge('chatbot_worker_in_flight', 'Turnos en ejecución', lambda: turn_pool.stats()['in_flight'])
+    register_gauge('chatbot_worker_wait_last_seconds', 'Espera en cola del último turno iniciado', lambda: turn_pool.stats()['wait_last_seconds'])
+
+
+# python app.py (__main__) y servidores WSGI / flask run (app) arrancan los servicios; los workers spawn no
+if __name__ != '__mp_main__':
+    start_services()
 
 def is_duplicate_message(message_id, chat_id, timestamp):
     """Verifica si el mensaje ya fue procesado"""
     message_key = f"{chat_id}_{message_id}_{timestamp}"
     
-    with processing_lock:
-        if message_key in processed_messages:
-            logger.info(f"🚫 Mensaje duplicado detectado: {message_key}")
-            return True
-        
-        # Agregar a la lista de procesados
-        processed_messages.add(message_key)
-        
-        # ✅ LIMPIEZA: Mantener solo los últimos 1000 mensajes para evitar memory leak
-        if len(processed_messages) > 1000:
-            # Convertir a lista, ordenar y mantener los últimos 500
-            messages_list = list(processed_messages)
-            processed_messages.clear()
-            processed_messages.update(messages_list[-500:])
-        
-        logger.info(f"✅ Nuevo mensaje agregado: {message_key}")
-        return False
+    with track_stage('dedup_check'):
+        duplicate = message_dedup.is_duplicate(message_key)
+    
+    if duplicate:
+        logger.info(f"🚫 Mensaje duplicado detectado (clave {log_ref(message_key)})")
+        return True
+    
+    logger.debug(f"✅ Nuevo mensaje agregado (clave {log_ref(message_key)})")
+    return False
+
+def forget_message(message_id, chat_id, timestamp):
+    """Elimina un mensaje del control de duplicados para permitir su reintento"""
+    message_key = f"{chat_id}_{message_id}_{timestamp}"
+    message_dedup.forget(message_key)
 
 def allowed_file(filename):
     """Verifica si el archivo tiene una extensión permitida"""
@@ -102,7 +169,8 @@ def is_cv_file(media_url, mime_type, filename):
     return False
 
 def download_media_file(media_url, chat_id):
-    """Descarga archivo multimedia desde WAHA"""
+    """Descarga archivo multimedia desde WAHA en streaming, con límite de tamaño y tiempo"""
+    part_path = None
     try:
         logger.info(f"📥 Descargando archivo desde: {media_url}")
         # ✅ CORRECCIÓN: Reemplazar localhost con waha en la URL
@@ -110,9 +178,6 @@ def download_media_file(media_url, chat_id):
             media_url = media_url.replace('localhost:3000', 'waha:3000')
             logger.info(f"🔄 URL corregida para Docker: {media_url}")
         
-        response = requests.get(media_url, timeout=30)
-        response.raise_for_status()
-        
         # Determinar extensión del archivo
         file_extension = 'pdf'  # Por defecto PDF
         
@@ -123,31 +188,321 @@ def download_media_file(media_url, chat_id):
             if potential_ext in ['pdf', 'doc', 'docx']:
                 file_extension = potential_ext
         
-        # Crear nombre de archivo temporal
+        deadline = time.monotonic() + MEDIA_DOWNLOAD_DEADLINE
+        sha256 = hashlib.sha256()
+        size = 0
+        
+        with requests.get(media_url, stream=True, timeout=(5, 30), headers=trace_headers()) as response:
+            response.raise_for_status()
+            
+            # Rechazar antes de descargar si el servidor informa un tamaño excesivo
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > MEDIA_MAX_BYTES:
+                raise ValueError(f"Archivo demasiado grande ({content_length} bytes, máximo {MEDIA_MAX_BYTES})")
+            
+            # Escribir por bloques a un archivo parcial: memoria constante
+            fd, part_path = tempfile.mkstemp(prefix=f"cv_{chat_id}_", suffix='.part', dir=UPLOAD_FOLDER)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > MEDIA_MAX_BYTES:
+                        raise ValueError(f"Archivo supera el máximo de {MEDIA_MAX_BYTES} bytes")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Descarga excedió {MEDIA_DOWNLOAD_DEADLINE}s")
+                    sha256.update(chunk)
+                    f.write(chunk)
+        
+        # Crear nombre de archivo final (rename atómico dentro de la misma carpeta)
         temp_filename = f"cv_{chat_id}_{int(time.time())}.{file_extension}"
         temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
+        os.replace(part_path, temp_path)
+        part_path = None
         
-        # Guardar archivo
-        with open(temp_path, 'wb') as f:
-            f.write(response.content)
-        
-        logger.info(f"✅ Archivo descargado: {temp_path} ({len(response.content)} bytes)")
+        logger.info(f"✅ Archivo descargado: .{file_extension} ({size} bytes, sha256: {sha256.hexdigest()[:16]})")
         return temp_path
         
     except Exception as e:
         logger.error(f"❌ Error descargando archivo: {e}")
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
         return None
+    finally:
+        # Eliminar descargas incompletas
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
 
 def extract_phone_from_chat_id(chat_id):
     """Extrae el número de teléfono del chat_id"""
     # El chat_id generalmente viene en formato: "1234567890@c.us"
     return chat_id.split('@')[0]
 
+def process_turn(payload):
+    """
+    Ejecuta un turno completo del agente y envía la respuesta por WAHA
+
+    Returns:
+        bool: False si el turno no se ejecutó porque WAHA no está disponible
+    """
+    # El deadline empieza cuando el worker toma el turno: la espera en el planificador no lo consume
+    with start_deadline(), span('turn', chat_id=payload.get('from', '')), track_stage('turn_total'):
+        return _process_turn(payload)
+
+def prefetch_candidate(user_phone):
+    """Estado del candidato (caché o Sheets) para el contexto del turno; None si no se pudo obtener"""
+    try:
+        return PathTools.get_candidate_state(user_phone)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo precargar el candidato: {e}")
+        return None
+
+def start_turn_io(chat_id, user_phone):
+    """
+    Lanza en paralelo 'escribiendo...', el historial (si el buffer local no basta)
+    y el registro del candidato en Sheets
+    """
+    async_waha = async_runner.waha()
+    cached_history = history_store.get(chat_id, limit=10)
+
+    async def fetch_history():
+        if cached_history is not None:
+            return cached_history
+        history = await async_waha.get_history_messages(chat_id=chat_id, limit=10)
+        # Lista vacía = error de WAHA o chat nuevo: no marcar el buffer como sincronizado
+        if history:
+            history_store.seed(chat_id, history)
+            return history
+        # WAHA no respondió a tiempo: usar lo que haya en el buffer local aunque esté incompleto
+        stale = history_store.peek(chat_id, limit=10)
+        if stale:
+            TURN_FALLBACKS.labels(fallback='cached_history').inc()
+            return stale
+        return history
+
+    async def run():
+        _, history, candidate = await asyncio.gather(
+            async_waha.start_typing(chat_id=chat_id),
+            fetch_history(),
+            # gspread es síncrono: corre en un hilo del executor del loop
+            asyncio.to_thread(prefetch_candidate, user_phone)
+        )
+        return history, candidate
+
+    return async_runner.run(run())
+
+def run_agent(registry, waha, chat_id, message, history_messages, interim_reply):
+    """
+    Ejecuta el agente dentro del presupuesto del turno
+    Si no termina a tiempo se envía un mensaje de espera y la respuesta sale cuando el agente termine
+    """
+    future = submit(registry.procesar_mensaje, message, history_messages)
+    try:
+        return future.result(timeout=stage_timeout('agent'))
+    except (DeadlineExceeded, FutureTimeoutError):
+        logger.warning(f"⏱️ El agente no respondió a tiempo para {chat_id}, se envía mensaje de espera")
+        TURN_FALLBACKS.labels(fallback='interim_reply').inc()
+        deliver_message(waha, chat_id, interim_reply)
+
+    try:
+        return future.result(timeout=AGENT_LATE_REPLY_SECONDS)
+    except FutureTimeoutError:
+        logger.error(f"❌ El agente no terminó tras {AGENT_LATE_REPLY_SECONDS}s para {chat_id}")
+        TURN_FALLBACKS.labels(fallback='late_reply_failed').inc()
+        return {"output": LATE_REPLY_FAILED}
+
+def _process_turn(payload):
+    chat_id = payload.get('from')
+    received_message = payload.get('body', '')
+
+    # Inicializar servicios
+    logger.info("🔧 Inicializando servicios...")
+    waha = Waha()
+    
+    # Extraer número de teléfono
+    user_phone = extract_phone_from_chat_id(chat_id)
+    logger.info(f"📞 Teléfono extraído: {user_phone}")
+
+    # ✅ NUEVO: No gastar tokens en una respuesta que WAHA no podrá entregar
+    if not waha_health.is_available():
+        WEBHOOK_EVENTS.labels(outcome='waha_unavailable').inc()
+        if WEBHOOK_ASYNC_MODE:
+            # El webhook ya respondió 200 y WAHA no lo reenviará: el planificador lo reintenta
+            logger.warning(f"⛔ WAHA no disponible, turno de {chat_id} diferido {TURN_DEFER_SECONDS}s")
+        else:
+            # Modo síncrono: el webhook responde 503 y WAHA reintenta la entrega
+            logger.warning(f"⛔ WAHA no disponible, turno de {chat_id} rechazado para reintento")
+            forget_message(payload.get('id', ''), chat_id, payload.get('timestamp', 0))
+        return False
+
+    # ✅ Indicar que estamos escribiendo y traer historial y candidato en paralelo
+    with track_stage('turn_prefetch'):
+        history_messages, candidate_state = start_turn_io(chat_id, user_phone)
+
+    try:
+        # ✅ Reutilizar componentes del agente ya construidos en el proceso
+        registry = AgentRegistry.get()
+        logger.info(f"✅ Agente listo con {len(registry.tools)} herramientas")
+
+        # Verificar si el mensaje contiene un archivo multimedia
+        if payload.get('hasMedia', False) and 'mediaUrl' in payload:
+            media_url = payload['mediaUrl']
+            mime_type = payload.get('media', {}).get('mimetype', '') or payload.get('mimetype', '')
+            filename = payload.get('media', {}).get('filename', '') or payload.get('filename', '') or payload.get('body', '')
+            
+            logger.info(f"📎 Archivo recibido:")
+            logger.info(f"   URL: {media_url}")
+            logger.info(f"   MIME: {mime_type}")
+            logger.info(f"   Filename: {filename}")
+            
+            # ✅ CORRECCIÓN: Usar función mejorada de detección
+            if is_cv_file(media_url, mime_type, filename):
+                logger.info("📄 ¡CV detectado! Iniciando procesamiento...")
+                
+                # Descargar el archivo
+                with track_stage('media_download') as stage:
+                    temp_file_path = download_media_file(media_url, user_phone)
+                    if not temp_file_path:
+                        stage.mark_error()
+                
+                if temp_file_path:
+                    # Construir mensaje especial para procesamiento de CV
+                    cv_message = f"PROCESO_CV: {temp_file_path} | TELEFONO: {user_phone} | MENSAJE: {received_message or filename}"
+                    
+                    logger.info(f"📋 Procesando CV (archivo {log_ref(temp_file_path)})")
+                    
+                    # Procesar con el agente (con mensaje de espera si excede el tiempo del turno)
+                    with track_stage('agent_execution'):
+                        resultado = run_agent(registry, waha, chat_id, cv_message, history_messages, CV_INTERIM_REPLY)
+                    
+                    response_message = resultado.get("output", "✅ CV procesado correctamente. Te contactaremos pronto.")
+                    remember_turn(user_phone, 'cv_upload')
+                    
+                    # Limpiar archivo temporal (si no fue movido al storage)
+                    try:
+                        if os.path.exists(temp_file_path):
+                            os.remove(temp_file_path)
+                            logger.info(f"🗑️ Archivo temporal eliminado ({log_ref(temp_file_path)})")
+                    except:
+                        pass
+                else:
+                    response_message = "❌ Hubo un problema al descargar tu CV. Por favor, intenta enviarlo nuevamente."
+            else:
+                # No es un CV válido
+                logger.warning("❌ Archivo no reconocido como CV")
+                response_message = "📄 Por favor, envía tu CV en formato PDF o Word (.docx). El archivo que enviaste no pudo ser procesado como CV."
+        
+        else:
+            # Mensaje de texto normal
+            logger.info(f"💬 Procesando mensaje de texto: {received_message}")
+            
+            logger.info(f"📋 Historial obtenido: {len(history_messages)} mensajes")
+            
+            # ✅ NUEVO: Intenciones frecuentes se responden sin el agente (estado del candidato en caché)
+            intent, routed_reply = None, None
+            if INTENT_ROUTER_ENABLED:
+                with track_stage('intent_router'):
+                    intent, routed_reply = intent_router.route(received_message, candidate_state)
+
+            if routed_reply:
+                response_message = routed_reply
+            else:
+                # Agregar teléfono y estado del candidato (ya consultado) al mensaje para el agente
+                message_with_context = build_agent_input(user_phone, received_message, candidate_state)
+                
+                logger.info(f"📝 Procesando con contexto: {message_with_context}")
+                
+                # Procesar mensaje con el agente (con mensaje de espera si excede el tiempo del turno)
+                with track_stage('agent_execution'):
+                    resultado = run_agent(registry, waha, chat_id, message_with_context, history_messages, TURN_INTERIM_REPLY)
+                
+                response_message = resultado.get("output", "No pude procesar tu mensaje correctamente. ¿Podrías repetirlo?")
+                logger.info(f"✅ Respuesta del agente: {response_message}")
+
+            remember_turn(user_phone, intent or 'agent')
+
+    except Exception as e:
+        logger.error(f"❌ Error procesando mensaje: {e}")
+        logger.error(f"❌ Traceback completo: {traceback.format_exc()}")
+        response_message = f"❌ Error técnico: {str(e)}. Por favor, intenta de nuevo."
+
+    # Enviar respuesta
+    logger.info(f"📤 Enviando respuesta: {response_message}")
+    deliver_message(waha, chat_id, response_message)
+
+    # Detener indicador de escritura
+    waha.stop_typing(chat_id=chat_id)
+    return True
+
+def remember_turn(user_phone, intent):
+    """Guarda la última intención en el store de sesiones (el resumen lo mantiene history_compactor)"""
+    try:
+        session_store.update(user_phone, last_intent=intent)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo actualizar la sesión: {e}")
+
+def deliver_message(waha, chat_id, message):
+    """Entrega una respuesta por el outbox (con reintentos) o directamente si está desactivado"""
+    if outbox:
+        with track_stage('outbox_enqueue'):
+            outbox.enqueue(chat_id, message)
+        return
+
+    with track_stage('send_message') as stage:
+        if not waha.send_message(chat_id=chat_id, message=message):
+            stage.mark_error()
+
+def process_chat_batch(chat_id, payloads):
+    """
+    Procesa en orden los mensajes agrupados de un chat
+    Si WAHA no está disponible, el turno y los siguientes vuelven al planificador para más tarde
+    """
+    # Los archivos se procesan como turnos independientes; los textos seguidos se unen
+    turns = []
+    for payload in payloads:
+        if payload.get('hasMedia', False) or not turns or turns[-1][-1].get('hasMedia', False):
+            turns.append([payload])
+        else:
+            turns[-1].append(payload)
+
+    for index, turn in enumerate(turns):
+        if turn[0].get('hasMedia', False):
+            turn_payload = turn[0]
+        else:
+            # Unir los textos de la ráfaga en una sola entrada para el agente
+            turn_payload = dict(turn[-1])
+            turn_payload['body'] = '\n'.join(p.get('body', '') for p in turn if p.get('body'))
+
+        if not process_turn(turn_payload):
+            chat_scheduler.defer(chat_id, [p for pending in turns[index:] for p in pending], TURN_DEFER_SECONDS)
+            WEBHOOK_EVENTS.labels(outcome='deferred').inc()
+            return
+
+chat_scheduler = ChatScheduler(turn_pool, process_chat_batch, debounce_seconds=CHAT_DEBOUNCE_SECONDS)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de verificación de salud"""
-    return jsonify({'status': 'healthy', 'service': 'WhatsApp Chatbot'}), 200
+    response = {'status': 'healthy', 'service': 'WhatsApp Chatbot'}
+    response['waha'] = waha_health.stats()
+    if not response['waha']['available']:
+        response['status'] = 'degraded'
+    response['dedup'] = message_dedup.stats()
+    response['history'] = history_store.stats()
+    if outbox:
+        response['outbox'] = outbox.stats()
+    response['sessions'] = session_store.stats()
+    if INTENT_ROUTER_ENABLED:
+        response['intent_router'] = intent_router.stats()
+    if WEBHOOK_ASYNC_MODE:
+        response['worker_pool'] = turn_pool.stats()
+        response['chat_scheduler'] = chat_scheduler.stats()
+    return jsonify(response), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint de métricas en formato Prometheus"""
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
 
 @app.route('/test-agent', methods=['GET'])
 def test_agent():
@@ -155,9 +510,8 @@ def test_agent():
     try:
         logger.info("🧪 Iniciando test del agente...")
         
-        # Inicializar agente
-        agent_path = AgentPath()
-        agente, tools = agent_path.crear_agente()
+        # Obtener agente del registro compartido
+        registry = AgentRegistry.get()
         
         # Mensaje de prueba
         test_message = "TELEFONO_USUARIO: 51987654321 | MENSAJE: Hola, me interesa el puesto de asesor de ventas"
@@ -165,7 +519,7 @@ def test_agent():
         logger.info(f"📝 Procesando mensaje: {test_message}")
         
         # Procesar mensaje
-        resultado = agent_path.procesar_mensaje(test_message, agente, tools, [])
+        resultado = registry.procesar_mensaje(test_message, [])
         
         response_message = resultado.get("output", "Sin respuesta del agente")
         
@@ -175,7 +529,7 @@ def test_agent():
             'status': 'success',
             'message': 'Test del agente completado',
             'agent_response': response_message,
-            'tools_count': len(tools)
+            'tools_count': len(registry.tools)
         }), 200
         
     except Exception as e:
@@ -190,13 +544,21 @@ def test_agent():
 @app.route('/chatbot/webhook/', methods=['POST'])
 def webhook():
     """Webhook principal para recibir mensajes de WhatsApp"""
+    # ✅ NUEVO: Cada webhook abre una traza que siguen el turno, las herramientas y las llamadas HTTP
+    # El deadline que acota WAHA, Sheets, Chroma y el agente lo abre process_turn al empezar el turno
+    with start_trace('webhook'):
+        return _handle_webhook()
+
+def _handle_webhook():
     try:
         data = request.json
-        logger.info(f"📨 Evento recibido: {data}")
+        logger.info("📨 Evento recibido: %s", (data or {}).get('event', 'desconocido'))
+        logger.debug("📨 Payload del evento: %s", data)
 
         # Validar que tenemos los datos necesarios
         if not data or 'payload' not in data:
             logger.error("❌ Datos inválidos en webhook")
+            WEBHOOK_EVENTS.labels(outcome='invalid').inc()
             return jsonify({'status': 'error', 'message': 'Datos inválidos'}), 400
 
         payload = data['payload']
@@ -207,141 +569,57 @@ def webhook():
         
         if not chat_id:
             logger.error("❌ Chat ID no encontrado")
+            WEBHOOK_EVENTS.labels(outcome='invalid').inc()
             return jsonify({'status': 'error', 'message': 'Chat ID no encontrado'}), 400
 
         # ✅ NUEVO: Verificar si es mensaje duplicado
         if is_duplicate_message(message_id, chat_id, timestamp):
             logger.info("🚫 Mensaje duplicado - ignorando")
+            WEBHOOK_EVENTS.labels(outcome='duplicate').inc()
             return jsonify({'status': 'success', 'message': 'Mensaje duplicado ignorado'}), 200
 
         # Ignorar mensajes de grupos
         is_group = '@g.us' in chat_id
         if is_group:
             logger.info(f"📱 Mensaje de grupo ignorado: {chat_id}")
+            WEBHOOK_EVENTS.labels(outcome='group').inc()
             return jsonify({'status': 'success', 'message': 'Mensaje de grupo ignorado'}), 200
 
+        # ✅ NUEVO: Alimentar el historial local (incluye mensajes propios enviados desde el teléfono)
+        # En los mensajes propios el chat es el destinatario
+        history_chat_id = (payload.get('to') or chat_id) if payload.get('fromMe', False) else chat_id
+        history_store.record(history_chat_id, payload)
+
         # Ignorar mensajes propios (enviados por el bot)
         if payload.get('fromMe', False):
             logger.info("🤖 Mensaje propio ignorado")
+            WEBHOOK_EVENTS.labels(outcome='own_message').inc()
             return jsonify({'status': 'success', 'message': 'Mensaje propio ignorado'}), 200
 
-        # Inicializar servicios
-        logger.info("🔧 Inicializando servicios...")
-        waha = Waha()
-        
-        # Extraer número de teléfono
-        user_phone = extract_phone_from_chat_id(chat_id)
-        logger.info(f"📞 Teléfono extraído: {user_phone}")
-
-        # Indicar que estamos escribiendo
-        waha.start_typing(chat_id=chat_id)
-
-        try:
-            # Inicializar agente
-            logger.info("🤖 Inicializando agente...")
-            agent_path = AgentPath()
-            agente, tools = agent_path.crear_agente()
-            logger.info(f"✅ Agente inicializado con {len(tools)} herramientas")
-
-            # Verificar si el mensaje contiene un archivo multimedia
-            if payload.get('hasMedia', False) and 'mediaUrl' in payload:
-                media_url = payload['mediaUrl']
-                mime_type = payload.get('media', {}).get('mimetype', '') or payload.get('mimetype', '')
-                filename = payload.get('media', {}).get('filename', '') or payload.get('filename', '') or payload.get('body', '')
-                
-                logger.info(f"📎 Archivo recibido:")
-                logger.info(f"   URL: {media_url}")
-                logger.info(f"   MIME: {mime_type}")
-                logger.info(f"   Filename: {filename}")
-                
-                # ✅ CORRECCIÓN: Usar función mejorada de detección
-                if is_cv_file(media_url, mime_type, filename):
-                    logger.info("📄 ¡CV detectado! Iniciando procesamiento...")
-                    
-                    # Descargar el archivo
-                    temp_file_path = download_media_file(media_url, user_phone)
-                    
-                    if temp_file_path:
-                        # Construir mensaje especial para procesamiento de CV
-                        cv_message = f"PROCESO_CV: {temp_file_path} | TELEFONO: {user_phone} | MENSAJE: {received_message or filename}"
-                        
-                        # Obtener historial de mensajes
-                        history_messages = waha.get_history_messages(
-                            chat_id=chat_id,
-                            limit=10
-                        )
-                        
-                        logger.info(f"📋 Procesando CV con mensaje: {cv_message}")
-                        
-                        # Procesar con el agente
-                        resultado = agent_path.procesar_mensaje(
-                            cv_message, 
-                            agente, 
-                            tools, 
-                            history_messages
-                        )
-                        
-                        response_message = resultado.get("output", "✅ CV procesado correctamente. Te contactaremos pronto.")
-                        
-                        # Limpiar archivo temporal
-                        try:
-                            os.remove(temp_file_path)
-                            logger.info(f"🗑️ Archivo temporal eliminado: {temp_file_path}")
-                        except:
-                            pass
-                    else:
-                        response_message = "❌ Hubo un problema al descargar tu CV. Por favor, intenta enviarlo nuevamente."
-                else:
-                    # No es un CV válido
-                    logger.warning("❌ Archivo no reconocido como CV")
-                    response_message = "📄 Por favor, envía tu CV en formato PDF o Word (.docx). El archivo que enviaste no pudo ser procesado como CV."
-            
-            else:
-                # Mensaje de texto normal
-                logger.info(f"💬 Procesando mensaje de texto: {received_message}")
-                
-                # Obtener historial de mensajes para contexto
-                history_messages = waha.get_history_messages(
-                    chat_id=chat_id,
-                    limit=10
-                )
-                logger.info(f"📋 Historial obtenido: {len(history_messages)} mensajes")
-                
-                # Agregar información del teléfono al mensaje para el agente
-                message_with_context = f"TELEFONO_USUARIO: {user_phone} | MENSAJE: {received_message}"
-                
-                logger.info(f"📝 Procesando con contexto: {message_with_context}")
-                
-                # Procesar mensaje con el agente
-                resultado = agent_path.procesar_mensaje(
-                    message_with_context,
-                    agente,
-                    tools,
-                    history_messages
-                )
-                
-                response_message = resultado.get("output", "No pude procesar tu mensaje correctamente. ¿Podrías repetirlo?")
-                logger.info(f"✅ Respuesta del agente: {response_message}")
-
-        except Exception as e:
-            logger.error(f"❌ Error procesando mensaje: {e}")
-            logger.error(f"❌ Traceback completo: {traceback.format_exc()}")
-            response_message = f"❌ Error técnico: {str(e)}. Por favor, intenta de nuevo."
-
-        # Enviar respuesta
-        logger.info(f"📤 Enviando respuesta: {response_message}")
-        waha.send_message(
-            chat_id=chat_id,
-            message=response_message
-        )
-
-        # Detener indicador de escritura
-        waha.stop_typing(chat_id=chat_id)
+        # ✅ NUEVO: Con WAHA caído, pedir a WAHA que reintente la entrega del webhook más tarde
+        if not waha_health.is_available():
+            logger.warning("⛔ WAHA no disponible, webhook diferido")
+            forget_message(message_id, chat_id, timestamp)
+            WEBHOOK_EVENTS.labels(outcome='waha_unavailable').inc()
+            return jsonify({'status': 'error', 'message': 'WAHA no disponible, reintente más tarde'}), 503
+
+        # ✅ NUEVO: Modo asíncrono - encolar y responder de inmediato
+        # Siempre por el planificador (también con debounce 0): un turno por chat a la vez
+        if WEBHOOK_ASYNC_MODE:
+            chat_scheduler.add(chat_id, payload)
+            WEBHOOK_EVENTS.labels(outcome='queued').inc()
+            logger.info(f"📥 Mensaje programado para {chat_id}")
+            return jsonify({'status': 'success', 'message': 'Mensaje encolado'}), 200
+
+        if not process_turn(payload):
+            return jsonify({'status': 'error', 'message': 'WAHA no disponible, reintente más tarde'}), 503
+        WEBHOOK_EVENTS.labels(outcome='processed').inc()
 
         return jsonify({'status': 'success', 'message': 'Mensaje procesado'}), 200
 
     except Exception as e:
         logger.error(f"❌ Error crítico en webhook: {e}")
+        WEBHOOK_EVENTS.labels(outcome='error').inc()
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
         return jsonify({'status': 'error', 'message': f'Error interno: {str(e)}'}), 500
 
@@ -356,8 +634,7 @@ def send_manual_message():
         if not chat_id or not message:
             return jsonify({'status': 'error', 'message': 'chat_id y message son requeridos'}), 400
         
-        waha = Waha()
-        waha.send_message(chat_id, message)
+        deliver_message(Waha(), chat_id, message)
         
         return jsonify({'status': 'success', 'message': 'Mensaje enviado'}), 200
         
@@ -379,4 +656,11 @@ if __name__ == '__main__':
     debug_mode = os.environ.get('DEBUG', 'False').lower() == 'true'
     
     logger.info(f"🚀 Iniciando aplicación en puerto {port}")
+
+    # ✅ NUEVO: Construir agente, LLM y herramientas antes del primer mensaje
+    try:
+        AgentRegistry.get()
+    except Exception as e:
+        logger.error(f"❌ Error precargando el agente: {e}")
+
     app.run(host='0.0.0.0', port=port, debug=debug_mode)
\ No newline at end of file
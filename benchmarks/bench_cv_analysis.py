@@ -0,0 +1,96 @@
+# bench_cv_analysis.py - Análisis de CV: secuencial vs. paralelo vs. una sola llamada (fused)
+#
+# Uso (desde la raíz del proyecto, requiere OPENAI_API_KEY):
+#   python -m benchmarks.bench_cv_analysis --runs 3
+#   python -m benchmarks.bench_cv_analysis --files utils/curriculumVitae-jose.pdf --modes sequential,fused
+#
+# Realiza llamadas reales a OpenAI. El texto de cada CV se extrae una vez y se
+# analiza con cada modo sin pasar por la caché de resultados; se comparan el tiempo
+# total y los tokens/costo consumidos, además de la coincidencia de cumple_perfil.
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from langchain_core.callbacks import get_usage_metadata_callback
+
+from services.llm_usage import estimate_cost
+from utils.cv_analyser import CV_ANALYSIS_MODES, CVProcessor
+
+
+def default_files():
+    """CVs de ejemplo incluidos en utils/"""
+    utils_dir = ROOT / 'utils'
+    return sorted(str(path) for pattern in ('*.pdf', '*.docx', 'cv_storage/*.pdf', 'cv_storage/*.docx') for path in utils_dir.glob(pattern))
+
+
+def usage_totals(usage_by_model):
+    """(prompt, completion, costo USD) sumando todos los modelos usados"""
+    prompt = completion = 0
+    cost = 0.0
+    for model, usage in usage_by_model.items():
+        cached = (usage.get('input_token_details') or {}).get('cache_read') or 0
+        prompt += usage.get('input_tokens', 0)
+        completion += usage.get('output_tokens', 0)
+        cost += estimate_cost(model, usage.get('input_tokens', 0), usage.get('output_tokens', 0), cached)
+    return prompt, completion, cost
+
+
+def run_mode(processor, cv_text, mode):
+    with get_usage_metadata_callback() as callback:
+        start = time.perf_counter()
+        _, evaluation = processor._analyze_cv(cv_text, mode)
+        elapsed = time.perf_counter() - start
+    return elapsed, usage_totals(callback.usage_metadata), evaluation['cumple_perfil']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de los modos de análisis de CV')
+    parser.add_argument('--files', nargs='*', default=None, help='CVs a analizar (por defecto los de utils/)')
+    parser.add_argument('--modes', default=','.join(CV_ANALYSIS_MODES))
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    files = args.files or default_files()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    processor = CVProcessor()
+
+    texts = {}
+    for file_path in files:
+        extract = processor._extract_text_from_pdf if file_path.lower().endswith('.pdf') else processor._extract_text_from_docx
+        texts[file_path] = extract(file_path)
+        print(f"{Path(file_path).name}: {len(texts[file_path])} caracteres")
+
+    results = {mode: {'times': [], 'prompt': 0, 'completion': 0, 'cost': 0.0, 'verdicts': []} for mode in modes}
+    for run in range(args.runs):
+        for file_path, cv_text in texts.items():
+            for mode in modes:
+                elapsed, (prompt, completion, cost), verdict = run_mode(processor, cv_text, mode)
+                totals = results[mode]
+                totals['times'].append(elapsed)
+                totals['prompt'] += prompt
+                totals['completion'] += completion
+                totals['cost'] += cost
+                totals['verdicts'].append(verdict)
+
+    analyses = len(texts) * args.runs
+    baseline = results.get('sequential')
+    print(f"\n{analyses} análisis por modo")
+    for mode, totals in results.items():
+        times = sorted(totals['times'])
+        p95 = times[int(len(times) * 0.95) - 1] if len(times) > 1 else times[0]
+        line = (f"{mode:<11} media={statistics.mean(times):6.2f} s  p50={statistics.median(times):6.2f} s  p95={p95:6.2f} s  "
+                f"tokens/CV={(totals['prompt'] + totals['completion']) / analyses:7.0f} "
+                f"(prompt {totals['prompt'] / analyses:.0f}, completion {totals['completion'] / analyses:.0f})  "
+                f"USD/CV={totals['cost'] / analyses:.5f}")
+        if baseline and mode != 'sequential':
+            agreement = sum(a == b for a, b in zip(totals['verdicts'], baseline['verdicts'])) / analyses
+            line += f"  cumple_perfil igual a sequential: {agreement:.0%}"
+        print(line)
@@ -0,0 +1,139 @@
+# bench_cv_preextraction.py - Pre-extracción local y selección de secciones vs. CV completo al LLM
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_cv_preextraction
+#   python -m benchmarks.bench_cv_preextraction --llm --mode sequential   (requiere OPENAI_API_KEY)
+#
+# Usa los CVs etiquetados de benchmarks/fixtures/cvs (texto ya extraído + labels.json).
+# Sin --llm no hay llamadas a OpenAI: se mide la precisión de las reglas (email, teléfono, nombre,
+# secciones detectadas) y los tokens de entrada de los prompts con y sin pre-extracción.
+# Con --llm se analiza cada CV de las dos formas y se comparan los tokens reales y los campos
+# devueltos contra las etiquetas.
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from services.tokens import count_tokens
+from utils.cv_analyser import (CV_EXTRACTION_PROMPT, CV_FIELDS, CV_SECTIONS_EXTRACTION_PROMPT,
+                               PROFILE_EVALUATION_PROMPT, CVProcessor)
+from utils.cv_sections import extract_contact, split_sections
+
+FIXTURES = ROOT / 'benchmarks' / 'fixtures' / 'cvs'
+CONTACT_FIELDS = ('nombre_completo', 'email', 'telefono')
+
+
+def load_fixtures():
+    labels = json.loads((FIXTURES / 'labels.json').read_text(encoding='utf-8'))
+    return [(name, (FIXTURES / name).read_text(encoding='utf-8'), label) for name, label in labels.items()]
+
+
+def same_value(field, value, expected):
+    """Teléfonos por dígitos, el resto sin mayúsculas"""
+    if not value or value in ('No extraído', 'No especificado'):
+        return expected is None
+    if expected is None:
+        return False
+    if field == 'telefono':
+        return re.sub(r'\D', '', value)[-9:] == re.sub(r'\D', '', expected)[-9:]
+    return str(value).strip().lower() == expected.lower()
+
+
+def prompt_tokens(processor, cv_text, preextraction):
+    """Tokens de entrada de extracción, evaluación (sin el JSON de cv_info, igual en ambos casos) y solo del texto del CV"""
+    contact, extraction_text, evaluation_text = processor._prepare_cv_text(cv_text, preextraction)
+    if contact is None:
+        extraction = CV_EXTRACTION_PROMPT.format(cv_text=extraction_text)
+    else:
+        fields = {field: description for field, description in CV_FIELDS.items() if not contact.get(field)}
+        extraction = CV_SECTIONS_EXTRACTION_PROMPT.format(cv_text=extraction_text, fields=json.dumps(fields, ensure_ascii=False))
+    evaluation = PROFILE_EVALUATION_PROMPT.format(cv_info='', cv_text=evaluation_text)
+    return count_tokens(extraction), count_tokens(evaluation), count_tokens(extraction_text) + count_tokens(evaluation_text)
+
+
+def offline_report(processor, fixtures):
+    hits = {field: 0 for field in CONTACT_FIELDS}
+    found = {field: 0 for field in CONTACT_FIELDS}
+    sections_ok = 0
+    totals = {False: [0, 0, 0], True: [0, 0, 0]}
+
+    print(f"{'CV':<32} {'tokens antes':>13} {'tokens después':>15}  reglas")
+    for name, cv_text, label in fixtures:
+        contact = extract_contact(cv_text)
+        misses = []
+        for field in CONTACT_FIELDS:
+            found[field] += contact[field] is not None
+            if same_value(field, contact[field], label[field]):
+                hits[field] += 1
+            else:
+                misses.append(f'{field}={contact[field]!r}')
+        if sorted(split_sections(cv_text)) == sorted(label['secciones']):
+            sections_ok += 1
+        else:
+            misses.append(f'secciones={sorted(split_sections(cv_text))}')
+
+        before = prompt_tokens(processor, cv_text, False)
+        after = prompt_tokens(processor, cv_text, True)
+        for flag, counts in ((False, before), (True, after)):
+            for index, value in enumerate(counts):
+                totals[flag][index] += value
+        print(f"{name:<32} {before[0] + before[1]:>13} {after[0] + after[1]:>15}  {'ok' if not misses else ', '.join(misses)}")
+
+    count = len(fixtures)
+    print(f"\nReglas locales sobre {count} CVs etiquetados")
+    for field in CONTACT_FIELDS:
+        print(f"  {field:<16} aciertos={hits[field] / count:6.1%}  encontrados={found[field]}/{count}")
+    print(f"  {'secciones':<16} aciertos={sections_ok / count:6.1%}")
+
+    print("\nTokens de entrada (prompt completo; 'texto del CV' cuenta solo el CV enviado en ambas llamadas)")
+    for label, index in (('extracción', 0), ('evaluación', 1), ('texto del CV', 2)):
+        before, after = totals[False][index], totals[True][index]
+        print(f"  {label:<13} antes={before:7d}  después={after:7d}  reducción={1 - after / before:6.1%}")
+
+
+def llm_report(processor, fixtures, mode):
+    from langchain_core.callbacks import get_usage_metadata_callback
+    from benchmarks.bench_cv_analysis import usage_totals
+
+    print(f"\nAnálisis con LLM (modo {mode})")
+    for preextraction in (False, True):
+        prompt = completion = 0
+        cost = 0.0
+        hits = {field: 0 for field in CONTACT_FIELDS + ('educacion', 'idiomas', 'cumple_perfil')}
+        for _, cv_text, label in fixtures:
+            with get_usage_metadata_callback() as callback:
+                cv_info, evaluation = processor._analyze_cv(cv_text, mode, preextraction)
+            usage = usage_totals(callback.usage_metadata)
+            prompt, completion, cost = prompt + usage[0], completion + usage[1], cost + usage[2]
+
+            for field in CONTACT_FIELDS:
+                hits[field] += same_value(field, cv_info.get(field), label[field])
+            hits['educacion'] += label['educacion'] in str(cv_info.get('educacion', '')).lower()
+            languages = ' '.join(cv_info.get('idiomas') or []).lower()
+            hits['idiomas'] += all(language in languages for language in label['idiomas'])
+            hits['cumple_perfil'] += evaluation['cumple_perfil'] == label['cumple_perfil']
+
+        count = len(fixtures)
+        accuracy = '  '.join(f"{field}={value / count:.0%}" for field, value in hits.items())
+        print(f"  {'con pre-extracción' if preextraction else 'CV completo':<19} prompt/CV={prompt / count:6.0f}  "
+              f"completion/CV={completion / count:4.0f}  USD/CV={cost / count:.5f}\n    {accuracy}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de la pre-extracción local de CVs')
+    parser.add_argument('--llm', action='store_true', help='Analiza los CVs con OpenAI en ambos modos')
+    parser.add_argument('--mode', default='sequential', help='CV_ANALYSIS_MODE para --llm')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    processor = CVProcessor()
+    offline_report(processor, fixtures)
+    if args.llm:
+        llm_report(processor, fixtures, args.mode)
@@ -0,0 +1,188 @@
+# bench_docx_extraction.py - Extracción de texto de Word: python-docx vs. lector en streaming
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_docx_extraction --iterations 5
+#   python -m benchmarks.bench_docx_extraction --blocks 50 500 5000
+#
+# Genera .docx sintéticos con el formato habitual de un CV en plantilla: datos de contacto en el
+# encabezado, experiencia en tablas, habilidades en un cuadro de texto y párrafos sueltos.
+# Para cada backend se mide el tiempo, el pico de memoria (tracemalloc) y cuánto del texto
+# esperado aparece en la salida (python-docx solo lee los párrafos del cuerpo; la variante
+# "python-docx + tablas" agrega las filas de tabla como referencia).
+import os
+import sys
+import time
+import zipfile
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from utils import cv_text
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+NAMESPACES = (f'xmlns:w="{W_NS}" '
+              'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+              'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+              'xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape" '
+              'xmlns:v="urn:schemas-microsoft-com:vml" mc:Ignorable="wps"')
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/header1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml"/>'
+    '</Types>'
+)
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/header" '
+    'Target="header1.xml"/>'
+    '</Relationships>'
+)
+
+
+# Formato que Word agrega a cada párrafo y run (fuente, tamaño, idioma, revisiones)
+PARAGRAPH_PROPERTIES = '<w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/><w:jc w:val="both"/></w:pPr>'
+RUN_PROPERTIES = ('<w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Arial"/>'
+                  '<w:sz w:val="22"/><w:szCs w:val="22"/><w:lang w:val="es-PE"/></w:rPr>')
+
+
+def paragraph(text):
+    return (f'<w:p w:rsidR="00A1B2C3" w:rsidRDefault="00A1B2C3">{PARAGRAPH_PROPERTIES}'
+            f'<w:r w:rsidRPr="00D4E5F6">{RUN_PROPERTIES}<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>')
+
+
+def table(rows):
+    cells = ''.join('<w:tr>' + ''.join(f'<w:tc>{paragraph(cell)}</w:tc>' for cell in row) + '</w:tr>' for row in rows)
+    return f'<w:tbl>{cells}</w:tbl>'
+
+
+def text_box(lines):
+    content = '<w:txbxContent>' + ''.join(paragraph(line) for line in lines) + '</w:txbxContent>'
+    # Word guarda el cuadro de texto dos veces: DrawingML (Choice) y VML (Fallback)
+    return ('<w:p><w:r><mc:AlternateContent>'
+            f'<mc:Choice Requires="wps"><w:drawing><wps:txbx>{content}</wps:txbx></w:drawing></mc:Choice>'
+            f'<mc:Fallback><w:pict><v:textbox>{content}</v:textbox></w:pict></mc:Fallback>'
+            '</mc:AlternateContent></w:r></w:p>')
+
+
+def write_synthetic_docx(path, blocks):
+    """DOCX con un encabezado de contacto y `blocks` bloques de experiencia; devuelve las líneas esperadas"""
+    header_lines = ['María Pérez Gómez', 'maria.perez@example.com | +57 300 123 4567']
+    expected = list(header_lines)
+    body = [paragraph('Perfil profesional'), paragraph('Asesora comercial con experiencia en call center.')]
+    expected += ['Perfil profesional', 'Asesora comercial con experiencia en call center.']
+
+    skills = ['Habilidades: negociación, manejo de objeciones, CRM']
+    body.append(text_box(skills))
+    expected += skills
+
+    for block in range(blocks):
+        rows = [
+            [f'Empresa {block + 1}', f'20{block % 20:02d} - 20{(block + 1) % 20:02d}'],
+            ['Cargo', 'Asesor de ventas call center'],
+            ['Logros', f'Cumplimiento de meta {90 + block % 10}% en ventas de seguros'],
+        ]
+        body.append(table(rows))
+        expected += [' | '.join(row) for row in rows]
+        body.append(paragraph(f'Funciones {block + 1}: atención al cliente, cierre de ventas y seguimiento.'))
+        expected.append(f'Funciones {block + 1}: atención al cliente, cierre de ventas y seguimiento.')
+
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {NAMESPACES}><w:body>'
+                + ''.join(body)
+                + '<w:sectPr><w:headerReference w:type="default" r:id="rId1"/></w:sectPr></w:body></w:document>')
+    header = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:hdr {NAMESPACES}>'
+              + ''.join(paragraph(line) for line in header_lines) + '</w:hdr>')
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', PACKAGE_RELS)
+        archive.writestr('word/_rels/document.xml.rels', DOCUMENT_RELS)
+        archive.writestr('word/document.xml', document)
+        archive.writestr('word/header1.xml', header)
+    return expected
+
+
+def extract_python_docx_tables(file_path):
+    """python-docx recorriendo también las tablas (lo mínimo para no perder la experiencia)"""
+    from docx import Document
+    document = Document(file_path)
+    lines = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            lines.append(' | '.join(cell.text for cell in row.cells))
+    return '\n'.join(lines).strip()
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def peak_memory_kb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def coverage(text, expected):
+    lines = set(text.splitlines())
+    return sum(line in lines for line in expected) / len(expected)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de la extracción de texto de Word')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--blocks', type=int, nargs='*', default=[5, 50, 500, 5000])
+    parser.add_argument('--backends', default=','.join(cv_text.DOCX_BACKENDS))
+    args = parser.parse_args()
+
+    extractors = [(backend.strip(), lambda path, backend=backend.strip(): cv_text.extract_docx_text(path, backend=backend))
+                  for backend in args.backends.split(',') if backend.strip()]
+    extractors.append(('python-docx + tablas', extract_python_docx_tables))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for blocks in args.blocks:
+            path = os.path.join(tmp, f'sintetico_{blocks}.docx')
+            expected = write_synthetic_docx(path, blocks)
+            print(f"sintético {blocks} bloques ({os.path.getsize(path) / 1024:.0f} KB, {len(expected)} líneas esperadas)")
+
+            for label, extractor in extractors:
+                extract = lambda: extractor(path)
+                try:
+                    text = extract()
+                except ImportError as e:
+                    print(f"  {label:<20} no disponible: {e}")
+                    continue
+                samples = measure(extract, args.iterations)
+                print(f"  {label:<20} media={statistics.mean(samples):9.2f} ms  p50={statistics.median(samples):9.2f} ms  "
+                      f"pico={peak_memory_kb(extract):9.0f} KB  caracteres={len(text):8d}  "
+                      f"líneas esperadas={coverage(text, expected):6.1%}")
@@ -0,0 +1,127 @@
+# bench_pdf_extraction.py - Extracción de texto de PDF: flujo anterior vs. capa de extracción
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_pdf_extraction --iterations 5
+#   python -m benchmarks.bench_pdf_extraction --pages 2 20 60 --workers 4
+#
+# Compara, sobre utils/curriculumVitae-jose.pdf y PDFs sintéticos de N páginas:
+#   - antes: PyPDF2 con text += page.extract_text() + '\n' sobre todas las páginas
+#   - pypdf: join de páginas en el hilo actual (con límite de páginas)
+#   - pypdf + pool: páginas repartidas en el pool de procesos (requiere más de un CPU)
+#   - caché: hash del archivo + lectura del texto ya extraído (CV reenviado o reanálisis)
+# No realiza llamadas a OpenAI.
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from utils import cv_text
+from utils.cv_cache import CVResultCache, file_sha256
+
+SAMPLE_CV = ROOT / 'utils' / 'curriculumVitae-jose.pdf'
+LINES_PER_PAGE = 45
+
+
+def write_synthetic_pdf(path, pages):
+    """PDF de texto con N páginas (Helvetica, ~45 líneas por página) sin dependencias"""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # Pages, se completa al conocer los hijos
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [f'Experiencia {page + 1}.{line + 1}: Asesor de ventas call center, atencion al cliente y cierre de ventas.'
+                 for line in range(LINES_PER_PAGE)]
+        body = 'BT /F1 10 Tf 12 TL 40 800 Td ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+        stream = body.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_id)
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % kid for kid in kids), pages)
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    Path(path).write_bytes(bytes(output))
+
+
+def extract_before(file_path):
+    """Flujo anterior de CVProcessor._extract_text_from_pdf"""
+    import PyPDF2
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        text = ''
+        for page in pdf_reader.pages:
+            text += page.extract_text() + '\n'
+        return text.strip()
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) > 1 else ordered[0]
+    print(f"  {label:<16} media={statistics.mean(samples):9.2f} ms  p50={statistics.median(samples):9.2f} ms  p95={p95:9.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de la extracción de texto de PDF')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--pages', type=int, nargs='*', default=[2, 10, 30, 100])
+    parser.add_argument('--workers', type=int, default=cv_text.PDF_WORKERS)
+    parser.add_argument('--max-pages', type=int, default=cv_text.PDF_MAX_PAGES)
+    args = parser.parse_args()
+
+    cv_text.PDF_WORKERS = args.workers
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [(SAMPLE_CV.name, str(SAMPLE_CV))] if SAMPLE_CV.exists() else []
+        for pages in args.pages:
+            path = os.path.join(tmp, f'sintetico_{pages}p.pdf')
+            write_synthetic_pdf(path, pages)
+            files.append((f'sintético {pages} páginas', path))
+
+        # Arranque del pool (spawn) fuera de la medición: se paga una vez por proceso
+        if args.workers > 1 and len(files) > 1:
+            cv_text.extract_pdf_text(files[-1][1], max_pages=args.max_pages, parallel_min_pages=1)
+
+        cache = CVResultCache(os.path.join(tmp, 'cache'))
+        cache.enabled = True
+
+        def cached_text(path):
+            entry = cache.get('text', file_sha256(path), cv_text.TEXT_EXTRACTION_VERSION)
+            return entry['cv_text']
+
+        for label, path in files:
+            print(f"{label} ({os.path.getsize(path) / 1024:.0f} KB)")
+            report('Antes (PyPDF2)', measure(lambda: extract_before(path), args.iterations))
+            report('pypdf', measure(lambda: cv_text.extract_pdf_text(path, max_pages=args.max_pages, parallel_min_pages=0), args.iterations))
+            if args.workers > 1:
+                report('pypdf + pool', measure(lambda: cv_text.extract_pdf_text(path, max_pages=args.max_pages, parallel_min_pages=1), args.iterations))
+            cache.set('text', file_sha256(path), cv_text.TEXT_EXTRACTION_VERSION, {'cv_text': cv_text.extract_pdf_text(path, max_pages=args.max_pages)})
+            report('caché', measure(lambda: cached_text(path), args.iterations))
@@ -0,0 +1,74 @@
+# bench_registry.py - Costo fijo por turno: agente construido por mensaje vs registro compartido
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_registry --iterations 50
+#
+# No realiza llamadas a OpenAI: solo mide la construcción de AgentPath,
+# ChatOpenAI, prompt, agente y AgentExecutor que antes se pagaba en cada webhook.
+import os
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+
+import logging
+logging.disable(logging.CRITICAL)
+
+from langchain.agents import AgentExecutor
+from agent_completo import AgentPath, AgentRegistry
+
+
+def build_per_message():
+    """Flujo anterior: todo se construye en cada mensaje"""
+    agent_path = AgentPath()
+    agente, tools = agent_path.crear_agente()
+    AgentExecutor.from_agent_and_tools(
+        agent=agente,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=3,
+    )
+
+
+def build_from_registry():
+    """Flujo nuevo: el registro devuelve componentes ya construidos"""
+    registry = AgentRegistry.get()
+    registry.agent_path._get_executor(registry.agente, registry.tools)
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) > 1 else ordered[0]
+    print(f"{label:<22} media={statistics.mean(samples):9.3f} ms  p50={statistics.median(samples):9.3f} ms  p95={p95:9.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark del registro de componentes del agente')
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    # Primera construcción del registro (costo único por worker)
+    start = time.perf_counter()
+    AgentRegistry.get()
+    print(f"Arranque del registro: {(time.perf_counter() - start) * 1000:.1f} ms (una vez por proceso)")
+
+    before = measure(build_per_message, args.iterations)
+    after = measure(build_from_registry, args.iterations)
+
+    report('Antes (por mensaje)', before)
+    report('Después (registro)', after)
+    print(f"Ahorro por turno: {statistics.mean(before) - statistics.mean(after):.3f} ms")
@@ -0,0 +1,162 @@
+import os
+import time
+import contextvars
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from services.worker_pool import WorkerPool
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class _ChatState:
+    """Estado interno de un chat: mensajes pendientes, turno en curso y temporizador"""
+
+    def __init__(self):
+        self.pending: List[Dict[str, Any]] = []
+        self.first_pending_at: Optional[float] = None
+        self.running = False
+        self.timer: Optional[threading.Timer] = None
+        self.context: Optional[contextvars.Context] = None
+        # Turno diferido (ej. WAHA caído): no despachar antes de este instante (time.monotonic)
+        self.not_before = 0.0
+
+
+class ChatScheduler:
+    """
+    Planificador por chat_id sobre el pool de workers
+    Garantiza un solo turno en curso por chat y agrupa los mensajes que llegan
+    dentro de la ventana de debounce en un único turno del agente (debounce 0: sin espera,
+    pero igual un turno por chat a la vez)
+    """
+
+    def __init__(self, pool: WorkerPool, handler: Callable[[str, List[Dict[str, Any]]], None],
+                 debounce_seconds: Optional[float] = None, max_delay_seconds: Optional[float] = None):
+        self.__pool = pool
+        self.__handler = handler
+        self.__debounce = debounce_seconds if debounce_seconds is not None else float(os.getenv('CHAT_DEBOUNCE_SECONDS', '1.5'))
+        self.__max_delay = max_delay_seconds if max_delay_seconds is not None else float(os.getenv('CHAT_DEBOUNCE_MAX_SECONDS', '6'))
+        # Espera antes de reintentar cuando el pool está lleno (con debounce 0 no hay otra pausa)
+        self.__retry = float(os.getenv('CHAT_RETRY_SECONDS', '1'))
+        self.__states: Dict[str, _ChatState] = {}
+        self.__lock = threading.Lock()
+
+        # Métricas de agrupación
+        self.__messages = 0
+        self.__turns = 0
+        self.__deferred = 0
+
+    def add(self, chat_id: str, payload: Dict[str, Any]) -> None:
+        """
+        Registra un mensaje entrante para el chat
+
+        Args:
+            chat_id (str): ID del chat
+            payload (Dict): Payload del webhook de WAHA
+        """
+        with self.__lock:
+            state = self.__states.setdefault(chat_id, _ChatState())
+            state.pending.append(payload)
+            # El turno continúa la traza del último mensaje recibido
+            state.context = contextvars.copy_context()
+            self.__messages += 1
+            if state.first_pending_at is None:
+                state.first_pending_at = time.monotonic()
+
+            # Si hay un turno en curso, los mensajes esperan a que termine
+            if not state.running:
+                self.__arm_timer(chat_id, state)
+
+    def defer(self, chat_id: str, payloads: List[Dict[str, Any]], delay_seconds: float) -> None:
+        """
+        Devuelve mensajes que no se pudieron procesar para reintentarlos más tarde
+        Se pueden llamar desde el propio turno: quedan delante de los que llegaron mientras tanto
+
+        Args:
+            chat_id (str): ID del chat
+            payloads (List[Dict]): Mensajes pendientes, en orden
+            delay_seconds (float): Espera mínima antes del siguiente turno del chat
+        """
+        with self.__lock:
+            state = self.__states.setdefault(chat_id, _ChatState())
+            state.pending = list(payloads) + state.pending
+            state.context = state.context or contextvars.copy_context()
+            if state.first_pending_at is None:
+                state.first_pending_at = time.monotonic()
+            state.not_before = time.monotonic() + delay_seconds
+            self.__deferred += 1
+            if not state.running:
+                self.__arm_timer(chat_id, state)
+
+    def __arm_timer(self, chat_id: str, state: _ChatState, min_delay: float = 0.0) -> None:
+        # Debe llamarse con el lock tomado
+        if state.timer is not None:
+            state.timer.cancel()
+
+        now = time.monotonic()
+        waited = now - (state.first_pending_at or now)
+        delay = max(min_delay, min(self.__debounce, self.__max_delay - waited), state.not_before - now)
+
+        state.timer = threading.Timer(delay, self.__dispatch, args=(chat_id,))
+        state.timer.daemon = True
+        state.timer.start()
+
+    def __dispatch(self, chat_id: str) -> None:
+        with self.__lock:
+            state = self.__states.get(chat_id)
+            if state is None:
+                return
+            state.timer = None
+            if state.running or not state.pending:
+                return
+
+            batch = state.pending
+            context = state.context or contextvars.copy_context()
+            state.pending = []
+            state.first_pending_at = None
+            state.running = True
+
+        if not context.run(self.__pool.submit, self.__run, chat_id, batch):
+            # Pool saturado: devolver los mensajes y reintentar tras otra ventana
+            with self.__lock:
+                state.running = False
+                state.pending = batch + state.pending
+                state.first_pending_at = time.monotonic()
+                self.__arm_timer(chat_id, state, min_delay=self.__retry)
+            return
+
+        if len(batch) > 1:
+            logger.info(f"🧩 {len(batch)} mensajes agrupados en un turno para {chat_id}")
+
+    def __run(self, chat_id: str, batch: List[Dict[str, Any]]) -> None:
+        try:
+            self.__handler(chat_id, batch)
+        finally:
+            with self.__lock:
+                self.__turns += 1
+                state = self.__states[chat_id]
+                state.running = False
+                if state.pending:
+                    self.__arm_timer(chat_id, state)
+                elif state.timer is None:
+                    del self.__states[chat_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas del planificador
+
+        Returns:
+            Dict: Chats activos, mensajes recibidos, turnos ejecutados y factor de agrupación
+        """
+        with self.__lock:
+            return {
+                'debounce_seconds': self.__debounce,
+                'active_chats': len(self.__states),
+                'running_chats': sum(1 for state in self.__states.values() if state.running),
+                'messages': self.__messages,
+                'turns': self.__turns,
+                'deferred': self.__deferred,
+                'coalescing_factor': round(self.__messages / self.__turns, 2) if self.__turns else 0.0,
+            }
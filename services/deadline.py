@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from services.metrics import DEADLINE_EXCEEDED
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+TURN_DEADLINE_SECONDS = float(os.getenv('TURN_DEADLINE_SECONDS', '25'))
+
+# Presupuesto máximo por etapa dentro del turno (TURN_BUDGET_<ETAPA> los sobrescribe)
+DEFAULT_STAGE_BUDGETS = {
+    'waha': 5.0,        # lecturas a WAHA durante el turno (historial, typing, chat)
+    'sheets': 4.0,      # lectura del candidato en Google Sheets
+    'rag': 4.0,         # búsqueda en Chroma (incluye el embedding de la pregunta)
+    'summary': 3.0,     # resumen del historial con LLM
+    'agent': 20.0,      # ejecución del agente antes de enviar el mensaje de espera
+}
+STAGE_BUDGETS = {
+    stage: float(os.getenv(f'TURN_BUDGET_{stage.upper()}', str(default)))
+    for stage, default in DEFAULT_STAGE_BUDGETS.items()
+}
+
+# Timeout por petición de los clientes de OpenAI (antes sin límite)
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '30'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '1'))
+
+# Deadline del turno en curso (se copia a los workers y al event loop junto con la traza)
+_current_deadline: ContextVar[Optional['Deadline']] = ContextVar('current_deadline', default=None)
+
+# Hilos para esperar llamadas bloqueantes sin timeout propio (gspread, Chroma, LangChain)
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DEADLINE_POOL_SIZE', '16')), thread_name_prefix='deadline')
+
+
+class DeadlineExceeded(TimeoutError):
+    """La etapa no terminó dentro del presupuesto del turno"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Etapa '{stage}' excedió el tiempo disponible del turno")
+        self.stage = stage
+
+
+class Deadline:
+    """Instante límite de un turno, medido con reloj monotónico"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline del turno activo, o None fuera de un turno (outbox, health, /test-agent)"""
+    return _current_deadline.get()
+
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]):
+    """Activa un deadline existente (ej. al continuar el turno en otro hilo o event loop)"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def start_deadline(seconds: Optional[float] = None):
+    """Crea el deadline de un turno nuevo (TURN_DEADLINE_SECONDS por defecto) y lo activa"""
+    return use_deadline(Deadline(seconds if seconds is not None else TURN_DEADLINE_SECONDS))
+
+
+def stage_timeout(stage: str, default: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout para una llamada de la etapa: el menor entre su valor propio, el presupuesto
+    de la etapa y lo que queda del turno. Fuera de un turno devuelve el valor propio
+
+    Raises:
+        DeadlineExceeded: Si el turno ya no tiene tiempo disponible
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        DEADLINE_EXCEEDED.labels(stage=stage).inc()
+        raise DeadlineExceeded(stage)
+    limits = [value for value in (default, STAGE_BUDGETS.get(stage), remaining) if value is not None]
+    return min(limits)
+
+
+def submit(func: Callable[..., Any], *args, **kwargs) -> Future:
+    """Ejecuta la llamada en un hilo auxiliar conservando la traza y el deadline del llamador"""
+    context = contextvars.copy_context()
+    return _executor.submit(context.run, func, *args, **kwargs)
+
+
+def run_bounded(stage: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una llamada bloqueante esperando como mucho el tiempo de la etapa
+    La llamada no se interrumpe: si vence, termina en segundo plano y su resultado se descarta
+
+    Raises:
+        DeadlineExceeded: Si no terminó a tiempo
+    """
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        return func(*args, **kwargs)
+
+    future = submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        DEADLINE_EXCEEDED.labels(stage=stage).inc()
+        logger.warning(f"⏱️ Etapa '{stage}' sin respuesta tras {timeout:.1f}s")
+        raise DeadlineExceeded(stage) from None
+
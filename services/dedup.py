@@ -0,0 +1,223 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class MemoryDedupBackend:
+    """
+    Ventana de deduplicación en memoria
+    OrderedDict en orden de inserción: las claves más antiguas (y las expiradas)
+    siempre están al inicio, por lo que la expulsión es O(1)
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.__ttl = ttl_seconds
+        self.__max_entries = max_entries
+        self.__entries: 'OrderedDict[str, float]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def check_and_add(self, key: str) -> bool:
+        """
+        Registra la clave de forma atómica
+
+        Returns:
+            bool: True si la clave ya estaba dentro de la ventana (duplicado)
+        """
+        now = time.time()
+        cutoff = now - self.__ttl
+
+        with self.__lock:
+            # Expulsar expiradas desde el inicio
+            while self.__entries:
+                _, seen_at = next(iter(self.__entries.items()))
+                if seen_at >= cutoff:
+                    break
+                self.__entries.popitem(last=False)
+
+            if key in self.__entries:
+                return True
+
+            self.__entries[key] = now
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+            return False
+
+    def discard(self, key: str) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def size(self) -> int:
+        with self.__lock:
+            return len(self.__entries)
+
+
+class SQLiteDedupBackend:
+    """
+    Ventana de deduplicación persistente en SQLite (modo WAL)
+    Compartida entre workers de Gunicorn y entre reinicios del contenedor
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.__path = path
+        self.__ttl = ttl_seconds
+        self.__max_entries = max_entries
+        self.__local = threading.local()
+        self.__inserts = 0
+        self.__inserts_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self.__connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS processed_messages ('
+            'key TEXT PRIMARY KEY, seen_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_messages_seen_at ON processed_messages(seen_at)')
+
+    def __connection(self) -> sqlite3.Connection:
+        # Una conexión por hilo: sqlite3 no comparte conexiones entre hilos
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self.__local.conn = conn
+        return conn
+
+    def check_and_add(self, key: str) -> bool:
+        """
+        Registra la clave de forma atómica entre procesos
+
+        Returns:
+            bool: True si la clave ya estaba dentro de la ventana (duplicado)
+        """
+        now = time.time()
+        conn = self.__connection()
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM processed_messages WHERE key = ? AND seen_at < ?', (key, now - self.__ttl))
+            cursor = conn.execute('INSERT OR IGNORE INTO processed_messages (key, seen_at) VALUES (?, ?)', (key, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        is_duplicate = cursor.rowcount == 0
+        if not is_duplicate:
+            self.__maybe_prune(now)
+        return is_duplicate
+
+    def __maybe_prune(self, now: float) -> None:
+        with self.__inserts_lock:
+            self.__inserts += 1
+            if self.__inserts % self.PRUNE_EVERY:
+                return
+
+        conn = self.__connection()
+        conn.execute('DELETE FROM processed_messages WHERE seen_at < ?', (now - self.__ttl,))
+        conn.execute(
+            'DELETE FROM processed_messages WHERE key IN ('
+            'SELECT key FROM processed_messages ORDER BY seen_at DESC LIMIT -1 OFFSET ?)',
+            (self.__max_entries,)
+        )
+
+    def discard(self, key: str) -> None:
+        self.__connection().execute('DELETE FROM processed_messages WHERE key = ?', (key,))
+
+    def size(self) -> int:
+        return self.__connection().execute('SELECT COUNT(*) FROM processed_messages').fetchone()[0]
+
+
+class MessageDeduplicator:
+    """
+    Control de mensajes duplicados con TTL y límite de tamaño
+    Usa SQLite si DEDUP_SQLITE_PATH está configurado; si no, memoria del proceso
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None, sqlite_path: Optional[str] = None):
+        ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv('DEDUP_TTL_SECONDS', '3600'))
+        max_entries = max_entries or int(os.getenv('DEDUP_MAX_ENTRIES', '10000'))
+        sqlite_path = sqlite_path if sqlite_path is not None else os.getenv('DEDUP_SQLITE_PATH', '')
+
+        if sqlite_path:
+            self.__backend = SQLiteDedupBackend(sqlite_path, ttl, max_entries)
+            self.__backend_name = 'sqlite'
+        else:
+            self.__backend = MemoryDedupBackend(ttl, max_entries)
+            self.__backend_name = 'memory'
+
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__hits = 0
+        self.__misses = 0
+        self.__errors = 0
+        self.__lock = threading.Lock()
+        logger.info(f"Deduplicador inicializado (backend: {self.__backend_name}, TTL: {ttl}s, máximo: {max_entries})")
+
+    def is_duplicate(self, key: str) -> bool:
+        """
+        Verifica y registra una clave de mensaje
+
+        Args:
+            key (str): Clave única del mensaje
+
+        Returns:
+            bool: True si el mensaje ya fue visto dentro del TTL
+        """
+        try:
+            duplicate = self.__backend.check_and_add(key)
+        except Exception as e:
+            # Ante un fallo del backend es preferible procesar que perder el mensaje
+            logger.error(f"Error en backend de deduplicación: {e}")
+            with self.__lock:
+                self.__errors += 1
+            return False
+
+        with self.__lock:
+            if duplicate:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+        return duplicate
+
+    def forget(self, key: str) -> None:
+        """Elimina una clave para permitir que el mensaje se reprocese"""
+        try:
+            self.__backend.discard(key)
+        except Exception as e:
+            logger.error(f"Error eliminando clave de deduplicación: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas del deduplicador
+
+        Returns:
+            Dict: Backend, tamaño de la ventana y contadores de aciertos/fallos
+        """
+        try:
+            size = self.__backend.size()
+        except Exception:
+            size = None
+        with self.__lock:
+            return {
+                'backend': self.__backend_name,
+                'ttl_seconds': self.__ttl,
+                'max_entries': self.__max_entries,
+                'size': size,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'errors': self.__errors,
+            }
@@ -0,0 +1,175 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from services.deadline import LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT, run_bounded
+from services.session_store import session_store
+from services.tokens import count_tokens, truncate_tokens
+from services.tracing import span
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '800'))
+HISTORY_RECENT_MESSAGES = int(os.getenv('HISTORY_RECENT_MESSAGES', '6'))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('HISTORY_SUMMARY_MAX_TOKENS', '300'))
+# extract: resumen por extracción (sin costo); llm: resumen incremental con un modelo barato
+HISTORY_SUMMARY_MODE = os.getenv('HISTORY_SUMMARY_MODE', 'extract').lower()
+HISTORY_SUMMARY_MODEL = os.getenv('HISTORY_SUMMARY_MODEL', 'gpt-4o-mini')
+
+FILE_NAME_PATTERN = re.compile(r'^[^\n]{1,200}\.(pdf|docx?|PDF|DOCX?)$')
+
+SUMMARY_PROMPT = """Actualiza el resumen de una conversación de WhatsApp entre un candidato y Clara, asistente de RRHH.
+Conserva solo datos útiles para continuar la conversación: lo que el candidato contó de sí mismo, sus preguntas y
+lo que se le respondió o prometió. Máximo {max_words} palabras, en español, sin saludos ni relleno.
+
+Resumen actual:
+{summary}
+
+Mensajes nuevos:
+{messages}
+
+Resumen actualizado:"""
+
+
+@lru_cache(maxsize=1)
+def _summary_model():
+    # Importación diferida: solo el modo llm necesita el cliente
+    from langchain_openai import ChatOpenAI
+    from services.metrics import llm_metrics_callback
+    return ChatOpenAI(model=HISTORY_SUMMARY_MODEL, temperature=0, timeout=LLM_REQUEST_TIMEOUT,
+                      max_retries=LLM_MAX_RETRIES, callbacks=[llm_metrics_callback])
+
+
+def normalize_message(message: Dict[str, Any]) -> Optional[Tuple[bool, str]]:
+    """
+    (es_del_bot, texto) de un mensaje de WAHA, o None si no aporta contexto
+    Los nombres de archivo se conservan como marcador en lugar de descartarse
+    """
+    body = (message.get('body') or '').strip()
+    if not body:
+        return None
+    if FILE_NAME_PATTERN.match(body):
+        body = f'[Archivo enviado: {body}]'
+    return bool(message.get('fromMe', False)), body
+
+
+class HistoryCompactor:
+    """
+    Historial con presupuesto de tokens
+    Los mensajes más recientes van literales hasta HISTORY_TOKEN_BUDGET (y como mucho
+    HISTORY_RECENT_MESSAGES); los anteriores se pliegan en un resumen incremental guardado
+    en el store de sesiones, de modo que el prompt no crece con la conversación
+    """
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, recent_messages: int = HISTORY_RECENT_MESSAGES,
+                 summary_max_tokens: int = HISTORY_SUMMARY_MAX_TOKENS, mode: str = HISTORY_SUMMARY_MODE):
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.summary_max_tokens = summary_max_tokens
+        self.mode = mode
+
+    def split(self, history_messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Separa el historial (orden cronológico) en (a_plegar, recientes)
+
+        Returns:
+            Tuple: Mensajes que exceden el presupuesto y mensajes que van literales
+        """
+        first_recent = len(history_messages)
+        kept = 0
+        used = 0
+        for index in range(len(history_messages) - 1, -1, -1):
+            normalized = normalize_message(history_messages[index])
+            if normalized is None:
+                continue
+            tokens = count_tokens(normalized[1])
+            if kept and (kept >= self.recent_messages or used + tokens > self.token_budget):
+                break
+            first_recent = index
+            kept += 1
+            used += tokens
+
+        recent = [message for message in history_messages[first_recent:] if normalize_message(message)]
+        older = [message for message in history_messages[:first_recent] if normalize_message(message)]
+        return older, recent
+
+    def _summarize_extract(self, summary: str, messages: List[Tuple[bool, str]]) -> str:
+        # Se conservan los mensajes del candidato (lo que aporta contexto) y la primera frase de Clara
+        lines = [line for line in summary.split('\n') if line]
+        for from_me, text in messages:
+            if from_me:
+                first_sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+                lines.append(f'Clara: {first_sentence[:160]}')
+            else:
+                lines.append(f'Candidato: {text[:240]}')
+
+        # Se descartan las líneas más antiguas hasta entrar en el presupuesto del resumen
+        while len(lines) > 1 and count_tokens('\n'.join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return truncate_tokens('\n'.join(lines), self.summary_max_tokens)
+
+    def _summarize_llm(self, summary: str, messages: List[Tuple[bool, str]]) -> str:
+        transcript = '\n'.join(f"{'Clara' if from_me else 'Candidato'}: {text}" for from_me, text in messages)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(self.summary_max_tokens * 0.7),
+            summary=summary or '(vacío)',
+            messages=transcript
+        )
+        with span('history.summarize', messages=len(messages)):
+            # Si no termina a tiempo se cae al resumen por extracción
+            response = run_bounded('summary', _summary_model().invoke, prompt)
+        return truncate_tokens(response.content.strip(), self.summary_max_tokens)
+
+    def fold(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        """Incorpora mensajes al resumen con el modo configurado (llm cae a extracción si falla)"""
+        normalized = [item for item in (normalize_message(message) for message in messages) if item]
+        if not normalized:
+            return summary
+        if self.mode == 'llm':
+            try:
+                return self._summarize_llm(summary, normalized)
+            except Exception as e:
+                logger.warning(f"⚠️ Resumen con LLM falló, se usa extracción: {e}")
+        return self._summarize_extract(summary, normalized)
+
+    def build(self, history_messages: List[Dict[str, Any]], phone: Optional[str] = None) -> List[BaseMessage]:
+        """
+        Construye el chat_history del agente: resumen (si hay) + mensajes recientes
+
+        Args:
+            history_messages (List[Dict]): Historial de WAHA o del buffer local (orden cronológico)
+            phone (str): Teléfono del candidato; sin él no se guarda ni usa resumen
+        """
+        older, recent = self.split(history_messages or [])
+
+        summary = ''
+        if phone:
+            session = session_store.get(phone) or {}
+            summary = session.get('summary') or ''
+            summarized_until = session.get('summary_until') or 0
+            # Solo se pliegan los mensajes que aún no entraron al resumen
+            pending = [message for message in older if (message.get('timestamp') or 0) > summarized_until]
+            if pending:
+                summary = self.fold(summary, pending)
+                session_store.set_summary(phone, summary, max(message.get('timestamp') or 0 for message in pending))
+
+        formatted: List[BaseMessage] = []
+        if summary:
+            formatted.append(SystemMessage(content=f'Resumen de la conversación anterior:\n{summary}'))
+
+        remaining = self.token_budget
+        for message in recent:
+            from_me, text = normalize_message(message)
+            # Un solo mensaje enorme no puede romper el presupuesto
+            text = truncate_tokens(text, max(remaining, 50))
+            remaining -= count_tokens(text)
+            formatted.append(AIMessage(content=text) if from_me else HumanMessage(content=text))
+        return formatted
+
+
+history_compactor = HistoryCompactor()
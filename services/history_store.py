@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from services.metrics import HISTORY_LOOKUPS
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class _ChatHistory:
+    """Buffer circular de un chat y su estado de sincronización con WAHA"""
+
+    def __init__(self, size: int):
+        self.messages: deque = deque(maxlen=size)
+        self.ids = set()
+        self.synced = False
+        self.synced_at = 0.0
+        self.last_timestamp = 0.0
+
+
+class ChatHistoryStore:
+    """
+    Historial local por chat alimentado por los webhooks entrantes y por nuestros envíos
+    Solo se consulta a WAHA en arranque en frío (chat sin sincronizar), cuando el
+    buffer lleva demasiado tiempo sin resincronizar o cuando se detecta un hueco
+    (mensajes fuera de orden)
+    """
+
+    def __init__(self, buffer_size: Optional[int] = None, max_chats: Optional[int] = None,
+                 resync_seconds: Optional[float] = None):
+        self.__buffer_size = buffer_size or int(os.getenv('HISTORY_BUFFER_SIZE', '20'))
+        self.__max_chats = max_chats or int(os.getenv('HISTORY_MAX_CHATS', '5000'))
+        self.__resync = resync_seconds if resync_seconds is not None else float(os.getenv('HISTORY_RESYNC_SECONDS', '3600'))
+        self.__chats: 'OrderedDict[str, _ChatHistory]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__gaps = 0
+
+    def __state(self, chat_id: str) -> _ChatHistory:
+        # Debe llamarse con el lock tomado; expulsa los chats menos usados
+        state = self.__chats.get(chat_id)
+        if state is None:
+            state = _ChatHistory(self.__buffer_size)
+            self.__chats[chat_id] = state
+            while len(self.__chats) > self.__max_chats:
+                self.__chats.popitem(last=False)
+        else:
+            self.__chats.move_to_end(chat_id)
+        return state
+
+    @staticmethod
+    def __normalize(message: Dict[str, Any]) -> Dict[str, Any]:
+        # Solo los campos que usa el agente para armar el historial
+        message_id = message.get('id')
+        if isinstance(message_id, dict):
+            message_id = message_id.get('_serialized')
+        return {
+            'id': message_id,
+            'body': message.get('body') or '',
+            'fromMe': bool(message.get('fromMe', False)),
+            'timestamp': message.get('timestamp') or time.time(),
+            'hasMedia': bool(message.get('hasMedia', False)),
+        }
+
+    def record(self, chat_id: str, message: Dict[str, Any]) -> None:
+        """
+        Agrega un mensaje al buffer del chat (payload de webhook o mensaje enviado)
+
+        Args:
+            chat_id (str): ID del chat
+            message (Dict): Mensaje con id, body, fromMe y timestamp
+        """
+        entry = self.__normalize(message)
+        with self.__lock:
+            state = self.__state(chat_id)
+            if entry['id'] and entry['id'] in state.ids:
+                return
+
+            # Un mensaje más antiguo que el último conocido indica que nos faltó algo
+            if state.synced and entry['timestamp'] < state.last_timestamp - 1:
+                logger.info(f"Hueco detectado en el historial de {chat_id}, se resincronizará")
+                state.synced = False
+                self.__gaps += 1
+
+            if len(state.messages) == state.messages.maxlen:
+                evicted = state.messages[0]
+                state.ids.discard(evicted['id'])
+            state.messages.append(entry)
+            if entry['id']:
+                state.ids.add(entry['id'])
+            state.last_timestamp = max(state.last_timestamp, entry['timestamp'])
+
+    def get(self, chat_id: str, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """
+        Devuelve los últimos mensajes del chat si el buffer es confiable
+
+        Returns:
+            Optional[List[Dict]]: Mensajes en orden cronológico, o None si hay que pedirlos a WAHA
+        """
+        with self.__lock:
+            state = self.__chats.get(chat_id)
+            fresh = state is not None and state.synced and time.monotonic() - state.synced_at < self.__resync
+            if not fresh:
+                self.__misses += 1
+                HISTORY_LOOKUPS.labels(source='waha').inc()
+                return None
+
+            self.__chats.move_to_end(chat_id)
+            self.__hits += 1
+            HISTORY_LOOKUPS.labels(source='buffer').inc()
+            return list(state.messages)[-limit:]
+
+    def peek(self, chat_id: str, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """
+        Mensajes del buffer aunque no esté sincronizado con WAHA
+        Respaldo cuando WAHA no responde a tiempo: mejor historial parcial que ninguno
+        """
+        with self.__lock:
+            state = self.__chats.get(chat_id)
+            if state is None or not state.messages:
+                return None
+            return list(state.messages)[-limit:]
+
+    def seed(self, chat_id: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        Reemplaza el buffer con el historial traído de WAHA
+        Conserva los mensajes registrados mientras la consulta estaba en curso
+
+        Args:
+            chat_id (str): ID del chat
+            messages (List[Dict]): Historial devuelto por WAHA (orden cronológico)
+        """
+        fetched = sorted((self.__normalize(message) for message in messages), key=lambda entry: entry['timestamp'])
+        with self.__lock:
+            state = self.__state(chat_id)
+            fetched_ids = {entry['id'] for entry in fetched if entry['id']}
+            newest = fetched[-1]['timestamp'] if fetched else 0.0
+            late = [entry for entry in state.messages if entry['id'] not in fetched_ids and entry['timestamp'] >= newest]
+
+            state.messages.clear()
+            state.messages.extend(fetched + late)
+            state.ids = {entry['id'] for entry in state.messages if entry['id']}
+            state.last_timestamp = max((entry['timestamp'] for entry in state.messages), default=0.0)
+            state.synced = True
+            state.synced_at = time.monotonic()
+
+    def invalidate(self, chat_id: str) -> None:
+        """Fuerza que la próxima lectura del chat vuelva a WAHA"""
+        with self.__lock:
+            state = self.__chats.get(chat_id)
+            if state is not None:
+                state.synced = False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas del historial local
+
+        Returns:
+            Dict: Chats en memoria, aciertos, consultas a WAHA y huecos detectados
+        """
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'buffer_size': self.__buffer_size,
+                'chats': len(self.__chats),
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'gaps': self.__gaps,
+                'hit_rate': round(self.__hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Instancia compartida por el webhook, los turnos y los clientes de WAHA
+history_store = ChatHistoryStore()
@@ -0,0 +1,134 @@
+import re
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import INTENT_ROUTES
+from services.session_store import cv_processed
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Respuestas fijas tomadas del prompt del agente (AgentPath.crear_agente)
+INTERVIEW_REPLY = "Se comunicarán contigo una vez que la líder de RRHH haya revisado tu CV para agendar una entrevista. 📅 Mientras tanto, si tienes más preguntas sobre el puesto, ¡estaré encantada de ayudarte! 😊"
+CV_REQUEST_REPLY = "¡Perfecto! Para procesar tu postulación, necesito que me envíes tu CV en formato PDF o Word (.docx). Una vez que lo reciba, extraeré automáticamente toda tu información y te confirmaré tu registro. 📄✨"
+CV_INVITE = "Si deseas postularte, puedes enviarme tu CV cuando gustes. 😊"
+NEW_CANDIDATE_GREETING = "¡Hola! 😊 Soy Clara, asistente de recursos humanos de Vego Comunicaciones. ¿Te gustaría recibir información sobre el puesto de Asesor de Ventas Call Center Movistar o postularte?"
+STATUS_RECEIVED_REPLY = "¡Tu CV ya está registrado en nuestro sistema! ✅ " + INTERVIEW_REPLY
+
+GREETING_PATTERN = re.compile(
+    r'^(hola+|holi|buen[oa]s?( dias| tardes| noches)?|saludos|hey|que tal|alo)'
+    r'( (clara|que tal|como estas|buen[oa]s?( dias| tardes| noches)?))*$'
+)
+INTERVIEW_PATTERN = re.compile(
+    r'\b(entrevista|cita|siguientes? pasos?|proximos? pasos?|cuando me (llaman|llamaran|contactan|contactaran|escriben)'
+    r'|me van a (llamar|contactar)|que sigue)\b'
+)
+STATUS_PATTERN = re.compile(
+    r'\b(estado de mi (postulacion|cv|proceso)|como va mi (postulacion|proceso|cv)'
+    r'|(recibieron|llego|les llego|tienen) mi (cv|curriculum|hoja de vida)|ya estoy registrad[oa])\b'
+)
+# Más largo que esto suele traer preguntas adicionales: mejor que responda el agente
+MAX_ROUTABLE_WORDS = 14
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _first_name(candidate: Dict[str, Any]) -> str:
+    parts = (candidate.get('nombre_completo') or '').split()
+    return parts[0].capitalize() if parts else ''
+
+
+class IntentRouter:
+    """
+    Router de intenciones previo al agente
+    Responde saludos, preguntas de entrevista/siguientes pasos y de estado de la
+    postulación con reglas de palabras clave y el estado cacheado del candidato.
+    Ante cualquier duda (sin estado del candidato, mensaje largo o ambiguo) devuelve
+    None y el turno sigue por el agente
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__fallbacks = 0
+
+    def classify(self, message: str) -> Optional[str]:
+        """
+        Clasifica el mensaje del usuario
+
+        Returns:
+            Optional[str]: greeting, interview, status o None si no hay una regla clara
+        """
+        text = _normalize(message or '')
+        if not text or len(text.split()) > MAX_ROUTABLE_WORDS:
+            return None
+        if GREETING_PATTERN.match(text):
+            return 'greeting'
+
+        # Un mensaje que coincide con más de una intención se deja al agente
+        matches = [intent for intent, pattern in (('status', STATUS_PATTERN), ('interview', INTERVIEW_PATTERN)) if pattern.search(text)]
+        return matches[0] if len(matches) == 1 else None
+
+    def __reply(self, intent: str, candidate: Dict[str, Any]) -> Optional[str]:
+        found = candidate.get('status') == 'found'
+        has_cv = cv_processed(candidate)
+
+        if intent == 'greeting':
+            if not found:
+                return NEW_CANDIDATE_GREETING
+            name = _first_name(candidate)
+            greeting = f"¡Hola {name}! 😊 ¿En qué puedo ayudarte hoy?" if name else "¡Hola! 😊 ¿En qué puedo ayudarte hoy?"
+            return greeting if has_cv else f"{greeting} {CV_INVITE}"
+
+        if intent == 'interview':
+            # Sin CV la respuesta estándar no aplica: pedir el CV lo decide el agente
+            return INTERVIEW_REPLY if has_cv else None
+
+        if intent == 'status':
+            return STATUS_RECEIVED_REPLY if has_cv else CV_REQUEST_REPLY
+
+        return None
+
+    def route(self, message: str, candidate: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Intenta responder sin invocar al agente
+
+        Args:
+            message (str): Texto del usuario
+            candidate (Dict): Estado del candidato (get_candidate) o None si no se pudo obtener
+
+        Returns:
+            Tuple: (intención, respuesta); la respuesta es None si el turno debe ir al agente
+        """
+        intent = self.classify(message)
+        reply = self.__reply(intent, candidate) if intent and candidate else None
+
+        with self.__lock:
+            if reply:
+                self.__hits += 1
+            else:
+                self.__fallbacks += 1
+        INTENT_ROUTES.labels(intent=intent or 'unknown', outcome='hit' if reply else 'fallback').inc()
+
+        if reply:
+            logger.info(f"⚡ Respuesta directa por intención: {intent}")
+        return intent, reply
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            total = self.__hits + self.__fallbacks
+            return {
+                'hits': self.__hits,
+                'fallbacks': self.__fallbacks,
+                'hit_rate': round(self.__hits / total, 4) if total else 0.0,
+            }
+
+
+intent_router = IntentRouter()
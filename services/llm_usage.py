@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# USD por millón de tokens: (entrada, entrada cacheada, salida). LLM_PRICES_JSON permite sobrescribirlos
+DEFAULT_PRICES = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+}
+
+
+def _load_prices() -> Dict[str, Tuple[float, float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    override = os.getenv('LLM_PRICES_JSON', '')
+    if override:
+        try:
+            prices.update({model: tuple(values) for model, values in json.loads(override).items()})
+        except (ValueError, TypeError) as e:
+            logger.warning(f"LLM_PRICES_JSON inválido, se usan los precios por defecto: {e}")
+    return prices
+
+
+PRICES = _load_prices()
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Costo estimado en USD de una llamada
+
+    El modelo se busca por prefijo más largo (gpt-4o-mini-2024-07-18 -> gpt-4o-mini)
+    """
+    candidates = [name for name in PRICES if model.startswith(name)]
+    if not candidates:
+        return 0.0
+    input_price, cached_price, output_price = PRICES[max(candidates, key=len)]
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+def extract_token_usage(response: Any) -> Tuple[int, int, int]:
+    """
+    Obtiene (prompt, completion, cached) de un LLMResult de LangChain
+
+    Usa llm_output['token_usage'] de langchain-openai y, si no está, el usage_metadata del mensaje
+    """
+    llm_output = getattr(response, 'llm_output', None) or {}
+    usage = llm_output.get('token_usage') or {}
+    if usage:
+        details = usage.get('prompt_tokens_details') or {}
+        return (int(usage.get('prompt_tokens') or 0), int(usage.get('completion_tokens') or 0),
+                int(details.get('cached_tokens') or 0))
+
+    prompt = completion = cached = 0
+    for generations in getattr(response, 'generations', None) or []:
+        for generation in generations:
+            metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+            prompt += int(metadata.get('input_tokens') or 0)
+            completion += int(metadata.get('output_tokens') or 0)
+            cached += int((metadata.get('input_token_details') or {}).get('cache_read') or 0)
+    return prompt, completion, cached
+
+
+class DailyUsageRollup:
+    """
+    Acumulado diario de uso de LLM por modelo y etapa en un archivo JSON por día
+    Las llamadas suman en memoria y un hilo las vuelca cada LLM_USAGE_FLUSH_SECONDS,
+    sumándolas a lo que ya tenga el archivo (varios workers pueden compartirlo)
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_seconds: Optional[float] = None):
+        self.__directory = directory if directory is not None else os.getenv('LLM_USAGE_DIR', 'data/llm_usage')
+        self.__flush_seconds = flush_seconds or float(os.getenv('LLM_USAGE_FLUSH_SECONDS', '60'))
+        self.__pending: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.__lock = threading.Lock()
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.__directory)
+
+    def record(self, model: str, stage: str, prompt_tokens: int, completion_tokens: int,
+               cached_tokens: int, cost: float, latency: float) -> None:
+        if not self.enabled:
+            return
+        day = date.today().isoformat()
+        key = f'{model}|{stage}'
+        with self.__lock:
+            totals = self.__pending.setdefault(day, {}).setdefault(key, {
+                'model': model, 'stage': stage, 'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'cached_tokens': 0, 'cost_usd': 0.0, 'latency_seconds': 0.0,
+            })
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            totals['cached_tokens'] += cached_tokens
+            totals['cost_usd'] += cost
+            totals['latency_seconds'] += latency
+        self.__ensure_thread()
+
+    def __ensure_thread(self) -> None:
+        if self.__thread is not None:
+            return
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='llm-usage-rollup', daemon=True)
+                self.__thread.start()
+                atexit.register(self.flush)
+
+    def __run(self) -> None:
+        while True:
+            time.sleep(self.__flush_seconds)
+            self.flush()
+
+    def flush(self) -> None:
+        """Suma lo acumulado en memoria al archivo de cada día"""
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+        if not pending:
+            return
+
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            for day, rows in pending.items():
+                self.__merge(day, rows)
+        except Exception as e:
+            logger.error(f"Error guardando el acumulado de uso de LLM: {e}")
+
+    def __merge(self, day: str, rows: Dict[str, Dict[str, float]]) -> None:
+        path = os.path.join(self.__directory, f'llm_usage_{day}.json')
+        with open(f'{path}.lock', 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path, 'r', encoding='utf-8') as existing:
+                    data = json.load(existing)
+            except (FileNotFoundError, ValueError):
+                data = {'date': day, 'by_model_stage': {}}
+
+            merged = data.setdefault('by_model_stage', {})
+            for key, totals in rows.items():
+                current = merged.setdefault(key, {field: 0 for field in totals})
+                for field, value in totals.items():
+                    current[field] = value if field in ('model', 'stage') else current.get(field, 0) + value
+
+            data['total_cost_usd'] = round(sum(row['cost_usd'] for row in merged.values()), 6)
+            data['total_tokens'] = sum(row['prompt_tokens'] + row['completion_tokens'] for row in merged.values())
+
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as tmp:
+                json.dump(data, tmp, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+
+
+usage_rollup = DailyUsageRollup()
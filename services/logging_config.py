@@ -0,0 +1,202 @@
+import os
+import re
+import copy
+import hashlib
+import queue
+import atexit
+import random
+import logging
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from services.tracing import TraceContextFilter
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s'
+
+# Celulares peruanos (9 dígitos empezando en 9, con o sin código de país) y números internacionales con '+'
+# Solo se exige que no haya otro dígito pegado: claves y rutas como cv_51987654321_... también se enmascaran
+PHONE_PATTERN = re.compile(r'(?<!\d)(?:\+?\d{2,3}[\s-]?)?9\d{2}[\s-]?\d{3}[\s-]?\d{3}(?!\d)|\+\d{10,15}(?!\d)')
+# El dominio se corta en '_' (ej. claves de dedup "...@c.us_false_...")
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)')
+# Dominios de WhatsApp en los chat_id (ej. 51987654321@c.us): no son correos
+WHATSAPP_DOMAINS = {'c.us', 'g.us', 's.whatsapp.net', 'lid'}
+
+
+def redact(text: str) -> str:
+    """Enmascara teléfonos y correos conservando lo mínimo para depurar"""
+    def mask_phone(match):
+        digits = re.sub(r'\D', '', match.group(0))
+        return f'{digits[:2]}{"*" * (len(digits) - 5)}{digits[-3:]}'
+
+    def mask_email(match):
+        if match.group(1).lower() in WHATSAPP_DOMAINS:
+            return match.group(0)
+        return f'{match.group(0)[0]}***@{match.group(1)}'
+
+    return EMAIL_PATTERN.sub(mask_email, PHONE_PATTERN.sub(mask_phone, text))
+
+
+def log_ref(value: str) -> str:
+    """Referencia corta y estable para loguear claves o rutas que contienen el teléfono"""
+    return hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:10]
+
+
+# Solo para el texto de las excepciones; el formato de la línea lo pone el handler del listener
+_exception_formatter = logging.Formatter()
+
+
+def _freeze(record: logging.LogRecord) -> None:
+    """Deja en el registro el mensaje y la traza de la excepción ya formateados (sin args ni exc_info)"""
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+        record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Enmascara datos personales en el mensaje, la excepción y el stack, y trunca el mensaje
+    Corre en el hilo del listener, fuera del hilo que atiende el request
+    """
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        _freeze(record)
+        message = redact(record.msg)
+        if self.max_chars and len(message) > self.max_chars:
+            message = f'{message[:self.max_chars]}… (+{len(message) - self.max_chars} caracteres)'
+        record.msg = message
+        # Los errores de gspread/WAHA suelen traer teléfonos o correos en la traza
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        if record.stack_info:
+            record.stack_info = redact(record.stack_info)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Muestreo de DEBUG/INFO a alto volumen
+    Por logger, los primeros `threshold` registros de cada segundo pasan siempre;
+    el excedente pasa con probabilidad `rate`. WARNING y superiores nunca se muestrean
+    """
+
+    def __init__(self, threshold: int, rate: float):
+        super().__init__()
+        self.threshold = threshold
+        self.rate = rate
+        self.__windows: Dict[str, list] = {}
+        self.__lock = threading.Lock()
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.threshold <= 0:
+            return True
+
+        second = int(time.monotonic())
+        with self.__lock:
+            window = self.__windows.get(record.name)
+            if window is None or window[0] != second:
+                window = [second, 0]
+                self.__windows[record.name] = window
+            window[1] += 1
+            if window[1] <= self.threshold:
+                return True
+
+        if random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler que nunca bloquea el hilo que loguea
+    Formatea el mensaje y la excepción en el hilo llamador, como QueueHandler.prepare (los args
+    pueden cambiar antes de que el listener los lea); enmascarar y truncar quedan para el listener.
+    Si la cola está llena descarta el registro
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Copia: otros handlers del mismo logger ven el registro original
+        record = copy.copy(record)
+        _freeze(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def _parse_module_levels(value: str) -> Dict[str, str]:
+    levels = {}
+    for item in value.split(','):
+        if '=' in item:
+            module, level = item.split('=', 1)
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging() -> None:
+    """
+    Configura el logging del proceso (idempotente)
+
+    Variables de entorno:
+        LOG_LEVEL: nivel raíz (INFO por defecto)
+        LOG_LEVELS: niveles por módulo, ej. "agent_completo=INFO,services.waha=WARNING"
+        LOG_MAX_CHARS: longitud máxima de cada mensaje (1000)
+        LOG_SAMPLE_THRESHOLD / LOG_SAMPLE_RATE: muestreo de DEBUG/INFO por logger y segundo (50 / 0.1)
+        LOG_QUEUE_SIZE: tamaño de la cola de logs (10000)
+    """
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+
+        # Hilo llamador: trace_id (depende del contexto), muestreo y el mensaje ya formateado (en prepare)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(TraceContextFilter())
+        queue_handler.addFilter(SamplingFilter(
+            threshold=int(os.getenv('LOG_SAMPLE_THRESHOLD', '50')),
+            rate=float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+        ))
+
+        # Hilo del listener: formato de la línea, enmascarado y truncado
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        stream_handler.addFilter(RedactingFilter(max_chars=int(os.getenv('LOG_MAX_CHARS', '1000'))))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+        # Librerías muy verbosas en DEBUG, configurables con LOG_LEVELS
+        module_levels = {'urllib3': 'WARNING', 'httpx': 'WARNING', 'httpcore': 'WARNING', 'openai': 'WARNING'}
+        module_levels.update(_parse_module_levels(os.getenv('LOG_LEVELS', '')))
+        for module, level in module_levels.items():
+            logging.getLogger(module).setLevel(level)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -0,0 +1,205 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+from uuid import UUID
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from langchain_core.callbacks import BaseCallbackHandler
+
+from services.llm_usage import estimate_cost, extract_token_usage, usage_rollup
+from services.tracing import begin_span, current_span, span
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Buckets pensados para etapas que van de milisegundos (dedup) a decenas de segundos (LLM + Sheets)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    'chatbot_stage_duration_seconds',
+    'Duración de cada etapa del pipeline del webhook',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    'chatbot_stage_errors_total',
+    'Errores por etapa del pipeline del webhook',
+    ['stage']
+)
+WEBHOOK_EVENTS = Counter(
+    'chatbot_webhook_events_total',
+    'Eventos recibidos por el webhook según resultado',
+    ['outcome']
+)
+LLM_LATENCY = Histogram(
+    'chatbot_llm_call_duration_seconds',
+    'Duración de cada llamada a OpenAI',
+    ['model'],
+    buckets=LATENCY_BUCKETS
+)
+LLM_ERRORS = Counter(
+    'chatbot_llm_call_errors_total',
+    'Errores en llamadas a OpenAI',
+    ['model']
+)
+LLM_TOKENS = Counter(
+    'chatbot_llm_tokens_total',
+    'Tokens consumidos en OpenAI por modelo, etapa que llama y tipo (prompt, completion, cached)',
+    ['model', 'stage', 'kind']
+)
+LLM_COST = Counter(
+    'chatbot_llm_cost_usd_total',
+    'Costo estimado en USD de las llamadas a OpenAI por modelo y etapa',
+    ['model', 'stage']
+)
+LLM_STAGE_LATENCY = Histogram(
+    'chatbot_llm_stage_call_duration_seconds',
+    'Duración de cada llamada a OpenAI por etapa que la origina',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+HISTORY_LOOKUPS = Counter(
+    'chatbot_history_lookups_total',
+    'Lecturas de historial por origen (buffer local o WAHA)',
+    ['source']
+)
+
+OUTBOX_DELIVERIES = Counter(
+    'chatbot_outbox_deliveries_total',
+    'Intentos de entrega del outbox según resultado (sent, retry, unknown, unavailable, failed)',
+    ['outcome']
+)
+OUTBOX_DELIVERY_LATENCY = Histogram(
+    'chatbot_outbox_delivery_seconds',
+    'Tiempo desde que la respuesta entra al outbox hasta que WAHA la acepta',
+    buckets=LATENCY_BUCKETS + (120, 300, 900)
+)
+
+INTENT_ROUTES = Counter(
+    'chatbot_intent_routes_total',
+    'Mensajes evaluados por el router de intenciones (hit = respondido sin el agente)',
+    ['intent', 'outcome']
+)
+
+DEADLINE_EXCEEDED = Counter(
+    'chatbot_deadline_exceeded_total',
+    'Etapas que agotaron su presupuesto de tiempo dentro del turno',
+    ['stage']
+)
+TURN_FALLBACKS = Counter(
+    'chatbot_turn_fallbacks_total',
+    'Respuestas degradadas por falta de tiempo (cached_history, cached_candidate, no_sheets, interim_reply, late_reply_failed)',
+    ['fallback']
+)
+
+
+class StageTimer:
+    """Permite marcar como error una etapa que no lanza excepción (ej. WAHA devuelve False)"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.failed = False
+
+    def mark_error(self) -> None:
+        self.failed = True
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    Mide la duración de una etapa y cuenta sus errores
+
+    Args:
+        stage (str): Nombre de la etapa (etiqueta `stage` en Prometheus)
+    """
+    timer = StageTimer(stage)
+    start = time.perf_counter()
+    # Cada etapa es también un tramo de la traza del turno
+    with span(stage) as stage_span:
+        try:
+            yield timer
+        except Exception:
+            timer.mark_error()
+            raise
+        finally:
+            STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+            if timer.failed:
+                STAGE_ERRORS.labels(stage=stage).inc()
+                stage_span.status = 'error'
+
+
+def register_gauge(name: str, documentation: str, func: Callable[[], float]) -> Gauge:
+    """Registra un gauge cuyo valor se calcula al momento del scrape"""
+    gauge = Gauge(name, documentation)
+    gauge.set_function(func)
+    return gauge
+
+
+def render_metrics():
+    """Devuelve el cuerpo y content-type para el endpoint /metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Callback de LangChain para cada llamada a OpenAI: latencia, tokens, costo y tramo
+    La etapa es el tramo activo al iniciar la llamada (agent.procesar_mensaje,
+    cv.extract_info, cv.evaluate_profile, rag.generate...)
+    """
+
+    def __init__(self):
+        self._starts: Dict[UUID, Any] = {}
+
+    def _start(self, run_id: UUID, serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> None:
+        params = kwargs.get('invocation_params') or {}
+        model = params.get('model') or params.get('model_name') or 'unknown'
+        parent = current_span()
+        stage = parent.name if parent else 'unknown'
+        llm_span = begin_span(f'openai.{model}', model=model, stage=stage)
+        self._starts[run_id] = (time.perf_counter(), model, llm_span, stage)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, serialized, kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if not start:
+            return
+        started_at, model, llm_span, stage = start
+        latency = time.perf_counter() - started_at
+        LLM_LATENCY.labels(model=model).observe(latency)
+        LLM_STAGE_LATENCY.labels(stage=stage).observe(latency)
+
+        try:
+            prompt_tokens, completion_tokens, cached_tokens = extract_token_usage(response)
+            cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+            LLM_TOKENS.labels(model=model, stage=stage, kind='prompt').inc(prompt_tokens)
+            LLM_TOKENS.labels(model=model, stage=stage, kind='completion').inc(completion_tokens)
+            LLM_TOKENS.labels(model=model, stage=stage, kind='cached').inc(cached_tokens)
+            LLM_COST.labels(model=model, stage=stage).inc(cost)
+            usage_rollup.record(model, stage, prompt_tokens, completion_tokens, cached_tokens, cost, latency)
+
+            llm_span.set_attribute('prompt_tokens', prompt_tokens)
+            llm_span.set_attribute('completion_tokens', completion_tokens)
+            llm_span.set_attribute('cached_tokens', cached_tokens)
+            llm_span.set_attribute('cost_usd', round(cost, 6))
+        except Exception as e:
+            # La contabilidad nunca debe romper la llamada al modelo
+            logger.warning(f"No se pudo registrar el uso de tokens: {e}")
+        llm_span.end()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        model = start[1] if start else 'unknown'
+        LLM_ERRORS.labels(model=model).inc()
+        if start:
+            start[2].record_error(error)
+            start[2].end()
+
+
+# Instancia compartida para adjuntar a los ChatOpenAI del proyecto
+llm_metrics_callback = LLMMetricsCallback()
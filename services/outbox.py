@@ -0,0 +1,346 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from services.metrics import OUTBOX_DELIVERIES, OUTBOX_DELIVERY_LATENCY
+from services.tracing import span
+from services.waha import SEND_OK, SEND_REJECTED, SEND_UNAVAILABLE, SEND_UNKNOWN
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limitador de tasa por sesión de WhatsApp
+    `rate` envíos por segundo sostenidos con ráfagas de hasta `burst`
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Consume un token, esperando si es necesario
+
+        Returns:
+            float: Segundos que se esperó
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated_at) * self.rate)
+                self.__updated_at = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return waited
+                delay = (1 - self.__tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class Outbox:
+    """
+    Cola persistente de mensajes salientes en SQLite (modo WAL)
+    Las respuestas se guardan antes de enviarse; un hilo de fondo las entrega
+    respetando el orden por chat, con límite de tasa por sesión y reintentos
+    con backoff. Un mensaje solo se descarta tras agotar OUTBOX_MAX_ATTEMPTS
+
+    Con WAHA inaccesible (circuito abierto, conexión rechazada) el mensaje se reprograma sin
+    gastar intentos. Si el resultado es desconocido (timeout de lectura, 5xx) no se reenvía a
+    ciegas: antes se busca en el historial del chat si WAHA ya lo envió, solo entre los mensajes
+    de la ventana de ese intento y sin contar los ya atribuidos a otra fila (textos repetidos)
+    """
+
+    # Un envío reclamado por un hilo que murió vuelve a la cola tras este tiempo
+    CLAIM_TIMEOUT = 120
+    BATCH_SIZE = 20
+
+    def __init__(self, path: Optional[str] = None, sender: Optional[Callable[[str, str, str], Union[str, Tuple[str, Optional[str]]]]] = None,
+                 rate_per_second: Optional[float] = None, burst: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 verifier: Optional[Callable[[str, str, str, float, float, Sequence[str]], Optional[Union[str, bool]]]] = None):
+        self.__path = path or os.getenv('OUTBOX_SQLITE_PATH', 'data/outbox.sqlite3')
+        self.__sender = sender or self.__send_with_waha
+        self.__verifier = verifier or self.__verify_with_waha
+        self.__rate = rate_per_second or float(os.getenv('OUTBOX_RATE_PER_SECOND', '1'))
+        self.__burst = burst or int(os.getenv('OUTBOX_BURST', '5'))
+        self.__max_attempts = max_attempts or int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+        self.__retry_base = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '2'))
+        self.__retry_max = float(os.getenv('OUTBOX_RETRY_MAX_SECONDS', '300'))
+        self.__retention = float(os.getenv('OUTBOX_RETENTION_SECONDS', '86400'))
+        self.__unavailable_retry = float(os.getenv('OUTBOX_UNAVAILABLE_RETRY_SECONDS', '15'))
+        # Margen de reloj entre el bot y WAHA al buscar un envío en el historial
+        self.__verify_skew = float(os.getenv('OUTBOX_VERIFY_SKEW_SECONDS', '5'))
+        self.__buckets: Dict[str, TokenBucket] = {}
+        self.__local = threading.local()
+        self.__wakeup = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+        self.__start_lock = threading.Lock()
+
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self.__connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'session TEXT NOT NULL, chat_id TEXT NOT NULL, body TEXT NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            'created_at REAL NOT NULL, next_attempt_at REAL NOT NULL, claimed_at REAL, '
+            'sent_at REAL, last_error TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, chat_id, id)')
+        # unconfirmed=1: el último envío tuvo resultado desconocido y hay que verificarlo antes de reenviar
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(outbox)')}
+        if 'unconfirmed' not in columns:
+            conn.execute('ALTER TABLE outbox ADD COLUMN unconfirmed INTEGER NOT NULL DEFAULT 0')
+        # attempt_from/attempt_until: ventana del envío sin confirmar; waha_id: mensaje de WAHA que lo confirmó
+        for column in ('attempt_from REAL', 'attempt_until REAL', 'waha_id TEXT'):
+            if column.split()[0] not in columns:
+                conn.execute(f'ALTER TABLE outbox ADD COLUMN {column}')
+
+    def __connection(self) -> sqlite3.Connection:
+        # Una conexión por hilo: sqlite3 no comparte conexiones entre hilos
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self.__local.conn = conn
+        return conn
+
+    @staticmethod
+    def __send_with_waha(session: str, chat_id: str, body: str) -> Tuple[str, Optional[str]]:
+        from services.waha import Waha
+        return Waha().send_text_with_id(chat_id=chat_id, message=body)
+
+    @staticmethod
+    def __verify_with_waha(session: str, chat_id: str, body: str, since: float, until: float,
+                           exclude_ids: Sequence[str]) -> Optional[Union[str, bool]]:
+        from services.waha import Waha
+        return Waha().find_sent_message(chat_id=chat_id, message=body, since=since, until=until, exclude_ids=exclude_ids)
+
+    def start(self) -> None:
+        """Inicia el hilo de envío (idempotente)"""
+        with self.__start_lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__run, name='outbox-sender', daemon=True)
+            self.__thread.start()
+            logger.info(f"Outbox iniciado ({self.__path}, {self.__rate}/s, ráfaga {self.__burst})")
+
+    def enqueue(self, chat_id: str, body: str, session: Optional[str] = None) -> int:
+        """
+        Guarda un mensaje para su envío
+
+        Args:
+            chat_id (str): ID del chat
+            body (str): Texto del mensaje
+            session (str): Sesión de WAHA (WAHA_SESSION por defecto)
+
+        Returns:
+            int: ID del mensaje en el outbox
+        """
+        now = time.time()
+        cursor = self.__connection().execute(
+            'INSERT INTO outbox (session, chat_id, body, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)',
+            (session or os.getenv('WAHA_SESSION', 'default'), chat_id, body, now, now)
+        )
+        self.start()
+        self.__wakeup.set()
+        return cursor.lastrowid
+
+    def __claim_batch(self) -> List[sqlite3.Row]:
+        # Solo el mensaje pendiente más antiguo de cada chat: preserva el orden por chat
+        now = time.time()
+        conn = self.__connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # El hilo pudo morir en pleno envío: se verifica en WAHA antes de reenviar
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', unconfirmed = 1, attempt_from = claimed_at, "
+                "attempt_until = ?, claimed_at = NULL WHERE status = 'sending' AND claimed_at < ?",
+                (now, now - self.CLAIM_TIMEOUT)
+            )
+            rows = conn.execute(
+                "SELECT * FROM outbox o WHERE status = 'pending' AND next_attempt_at <= ? "
+                "AND id = (SELECT MIN(id) FROM outbox WHERE chat_id = o.chat_id AND status IN ('pending', 'sending')) "
+                "ORDER BY id LIMIT ?",
+                (now, self.BATCH_SIZE)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row['id']) for row in rows]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def __next_wait(self) -> float:
+        row = self.__connection().execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        if row[0] is None:
+            return 30.0
+        return max(0.05, min(30.0, row[0] - time.time()))
+
+    def __prune(self) -> None:
+        # Los enviados solo sirven para métricas y auditoría reciente
+        self.__connection().execute(
+            "DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?",
+            (time.time() - self.__retention,)
+        )
+
+    def __run(self) -> None:
+        while True:
+            self.__wakeup.clear()
+            try:
+                rows = self.__claim_batch()
+                for row in rows:
+                    self.__deliver(row)
+                if rows:
+                    continue
+                self.__prune()
+                wait = self.__next_wait()
+            except Exception as e:
+                logger.error(f"Error en el hilo del outbox: {e}")
+                wait = 1.0
+            self.__wakeup.wait(wait)
+
+    def __bucket(self, session: str) -> TokenBucket:
+        bucket = self.__buckets.get(session)
+        if bucket is None:
+            bucket = self.__buckets.setdefault(session, TokenBucket(self.__rate, self.__burst))
+        return bucket
+
+    def __deliver(self, row: sqlite3.Row) -> None:
+        with span('outbox.deliver', chat_id=row['chat_id'], attempt=row['attempts'] + 1) as deliver_span:
+            if row['unconfirmed']:
+                # El envío anterior pudo haber llegado: confirmar en WAHA antes de reenviar
+                found = self.__verify(row)
+                if found is None:
+                    self.__reschedule(row, 'No se pudo confirmar el envío anterior')
+                    return
+                if found:
+                    self.__mark_sent(row, row['attempts'], found if isinstance(found, str) else None)
+                    return
+                if row['attempts'] >= self.__max_attempts:
+                    self.__mark_failed(row, row['attempts'], row['last_error'])
+                    return
+
+            self.__bucket(row['session']).acquire()
+            attempts = row['attempts'] + 1
+            error = None
+            attempt_from = time.time()
+            waha_id = None
+            try:
+                outcome = self.__sender(row['session'], row['chat_id'], row['body'])
+            except Exception as e:
+                outcome = SEND_UNKNOWN
+                error = str(e)
+            # El sender puede devolver (resultado, ID del mensaje en WAHA)
+            if isinstance(outcome, tuple):
+                outcome, waha_id = outcome
+            # Compatibilidad con senders que devuelven bool
+            if outcome is True:
+                outcome = SEND_OK
+            elif outcome is False:
+                outcome = SEND_REJECTED
+
+            if outcome == SEND_OK:
+                self.__mark_sent(row, attempts, waha_id)
+                return
+
+            error = error or f'Envío {outcome}'
+            deliver_span.record_error(error)
+            if outcome == SEND_UNAVAILABLE:
+                # No llegó a WAHA: no cuenta como intento
+                self.__reschedule(row, error)
+                return
+
+            unconfirmed = int(outcome == SEND_UNKNOWN)
+            if attempts >= self.__max_attempts and not unconfirmed:
+                self.__mark_failed(row, attempts, error)
+                return
+
+            delay = min(self.__retry_max, self.__retry_base * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+            now = time.time()
+            self.__connection().execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ?, "
+                "unconfirmed = ?, attempt_from = ?, attempt_until = ?, claimed_at = NULL WHERE id = ?",
+                (attempts, now + delay, error, unconfirmed, attempt_from, now, row['id'])
+            )
+            OUTBOX_DELIVERIES.labels(outcome='unknown' if unconfirmed else 'retry').inc()
+            logger.warning(f"Reintentando mensaje {row['id']} en {delay:.1f}s (intento {attempts}, {outcome})")
+
+    def __verify(self, row: sqlite3.Row) -> Optional[Union[str, bool]]:
+        # Solo cuentan los mensajes de la ventana del envío dudoso que no confirmaron ya otra fila del chat
+        since = (row['attempt_from'] or row['created_at']) - self.__verify_skew
+        until = (row['attempt_until'] or time.time()) + self.__verify_skew
+        claimed = [
+            waha_id for (waha_id,) in self.__connection().execute(
+                "SELECT waha_id FROM outbox WHERE status = 'sent' AND chat_id = ? AND waha_id IS NOT NULL AND id != ?",
+                (row['chat_id'], row['id'])
+            )
+        ]
+        return self.__verifier(row['session'], row['chat_id'], row['body'], since, until, claimed)
+
+    def __mark_sent(self, row: sqlite3.Row, attempts: int, waha_id: Optional[str] = None) -> None:
+        now = time.time()
+        self.__connection().execute(
+            "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, unconfirmed = 0, waha_id = ?, "
+            "claimed_at = NULL WHERE id = ?",
+            (attempts, now, waha_id, row['id'])
+        )
+        OUTBOX_DELIVERIES.labels(outcome='sent').inc()
+        OUTBOX_DELIVERY_LATENCY.observe(now - row['created_at'])
+
+    def __mark_failed(self, row: sqlite3.Row, attempts: int, error: Optional[str]) -> None:
+        self.__connection().execute(
+            "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, unconfirmed = 0, claimed_at = NULL WHERE id = ?",
+            (attempts, error, row['id'])
+        )
+        OUTBOX_DELIVERIES.labels(outcome='failed').inc()
+        logger.error(f"Mensaje {row['id']} descartado tras {attempts} intentos")
+
+    def __reschedule(self, row: sqlite3.Row, error: str) -> None:
+        # WAHA inaccesible: se vuelve a intentar más tarde sin gastar intentos
+        self.__connection().execute(
+            "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, claimed_at = NULL WHERE id = ?",
+            (time.time() + self.__unavailable_retry * random.uniform(0.8, 1.2), error, row['id'])
+        )
+        OUTBOX_DELIVERIES.labels(outcome='unavailable').inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas del outbox
+
+        Returns:
+            Dict: Mensajes por estado y antigüedad del pendiente más viejo
+        """
+        conn = self.__connection()
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0) + counts.get('sending', 0),
+            'sent': counts.get('sent', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_pending_seconds': round(time.time() - oldest, 2) if oldest else 0.0,
+            'rate_per_second': self.__rate,
+            'burst': self.__burst,
+        }
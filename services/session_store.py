@@ -0,0 +1,354 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Campos de Sheets que se guardan localmente; la evaluación interna (cumple_perfil, recomendado,
+# comentarios) se queda solo en la hoja
+CANDIDATE_FIELDS = ('id', 'fecha_contacto', 'nombre_completo', 'telefono', 'email', 'cv_recibido',
+                    'cv_link', 'puesto_solicitado', 'fuente', 'fase_proceso')
+
+# Resultado de reintentar una escritura pendiente (writer de start_sync)
+WRITE_OK = 'ok'
+WRITE_RETRY = 'retry'          # Error transitorio de Sheets: se reintenta en la siguiente pasada
+WRITE_REJECTED = 'rejected'    # Error permanente (ej. ID inexistente): no tiene sentido reintentar
+
+
+def cv_processed(candidate: Optional[Dict[str, Any]]) -> bool:
+    """Misma regla que el prompt del agente: cv_link no vacío O cv_recibido = "Sí" """
+    if not candidate or candidate.get('status') != 'found':
+        return False
+    return bool(candidate.get('cv_link')) or str(candidate.get('cv_recibido', '')).strip().lower() in ('sí', 'si')
+
+
+def phone_from_candidate_id(candidate_id: Optional[str]) -> Optional[str]:
+    """Los IDs tienen la forma CAND_{telefono}_{timestamp}"""
+    match = re.match(r'CAND_(\d+)_\d+$', candidate_id or '')
+    return match.group(1) if match else None
+
+
+class SessionStore:
+    """
+    Estado de conversación por candidato en SQLite (modo WAL), con el teléfono como clave
+    Guarda el registro de Sheets (sin evaluación), estado del CV, ID, nombre, última
+    intención y el resumen de la conversación (ver history_compactor). Las lecturas de Sheets se refrescan cada
+    SESSION_SHEETS_REFRESH_SECONDS; las escrituras que fallan quedan marcadas como
+    pendientes (dirty) y un hilo las reintenta contra Sheets. Las rechazadas de forma permanente
+    o que agotan SESSION_SYNC_MAX_ATTEMPTS pasan a dead_writes y la sesión se vuelve a leer de Sheets
+    """
+
+    def __init__(self, path: Optional[str] = None, refresh_seconds: Optional[float] = None):
+        self.__path = path or os.getenv('SESSION_SQLITE_PATH', 'data/sessions.sqlite3')
+        self.__refresh = refresh_seconds if refresh_seconds is not None else float(os.getenv('SESSION_SHEETS_REFRESH_SECONDS', '1800'))
+        self.__max_attempts = int(os.getenv('SESSION_SYNC_MAX_ATTEMPTS', '20'))
+        self.__local = threading.local()
+        self.__sync_thread: Optional[threading.Thread] = None
+        self.__start_lock = threading.Lock()
+        self.__stats_lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.__connection().execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'phone TEXT PRIMARY KEY, sheets_status TEXT, candidate_id TEXT, name TEXT, '
+            'cv_status TEXT, candidate_json TEXT, last_intent TEXT, summary TEXT, '
+            'sheets_read_at REAL, updated_at REAL NOT NULL, dirty INTEGER NOT NULL DEFAULT 0, '
+            'pending_writes TEXT, sync_error TEXT, summary_until REAL, dead_writes TEXT)'
+        )
+        columns = {row['name'] for row in self.__connection().execute('PRAGMA table_info(sessions)')}
+        if 'summary_until' not in columns:
+            # Bases creadas antes de que el resumen guardara hasta qué mensaje cubre
+            self.__connection().execute('ALTER TABLE sessions ADD COLUMN summary_until REAL')
+        if 'dead_writes' not in columns:
+            self.__connection().execute('ALTER TABLE sessions ADD COLUMN dead_writes TEXT')
+
+    def __connection(self) -> sqlite3.Connection:
+        # Una conexión por hilo: sqlite3 no comparte conexiones entre hilos
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self.__local.conn = conn
+        return conn
+
+    @contextmanager
+    def __transaction(self):
+        # BEGIN IMMEDIATE: lectura-modificación-escritura atómica entre hilos y procesos
+        conn = self.__connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def __upsert(self, phone: str, **fields) -> None:
+        fields['updated_at'] = time.time()
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in fields)
+        self.__connection().execute(
+            f'INSERT INTO sessions (phone, {columns}) VALUES (?, {placeholders}) '
+            f'ON CONFLICT(phone) DO UPDATE SET {updates}',
+            (phone, *fields.values())
+        )
+
+    def get(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Devuelve la sesión completa del teléfono o None"""
+        row = self.__connection().execute('SELECT * FROM sessions WHERE phone = ?', (phone,)).fetchone()
+        return dict(row) if row else None
+
+    def candidate(self, phone: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Registro del candidato en formato get_candidate, si la copia local está vigente
+
+        Args:
+            phone (str): Teléfono del candidato
+            allow_stale (bool): Devolver la copia local aunque haya vencido (Sheets no respondió a tiempo)
+
+        Returns:
+            Optional[Dict]: Registro (status found/not_found) o None si hay que leer Sheets
+        """
+        session = self.get(phone) if phone else None
+        known = session is not None and session['sheets_status'] in ('found', 'not_found')
+        if allow_stale:
+            fresh = known
+        else:
+            fresh = known and (session['dirty'] or time.time() - (session['sheets_read_at'] or 0) < self.__refresh)
+            with self.__stats_lock:
+                if fresh:
+                    self.__hits += 1
+                else:
+                    self.__misses += 1
+        if not fresh:
+            return None
+
+        if session['sheets_status'] == 'not_found':
+            return {'status': 'not_found', 'message': 'Candidato no encontrado'}
+        return {'status': 'found', **json.loads(session['candidate_json'] or '{}')}
+
+    def record_sheets_read(self, phone: str, candidate: Dict[str, Any]) -> None:
+        """Guarda el resultado de un get_candidate leído de Sheets (los errores no se guardan)"""
+        status = candidate.get('status')
+        if not phone or status not in ('found', 'not_found'):
+            return
+        record = {field: candidate.get(field, '') for field in CANDIDATE_FIELDS} if status == 'found' else {}
+        with self.__transaction():
+            session = self.get(phone)
+            if session and session['dirty']:
+                # Hay escrituras locales aún no sincronizadas: la hoja está desactualizada
+                return
+            self.__upsert(
+                phone,
+                sheets_status=status,
+                candidate_id=record.get('id') or None,
+                name=record.get('nombre_completo') or None,
+                cv_status='received' if cv_processed(candidate) else 'none',
+                candidate_json=json.dumps(record, ensure_ascii=False),
+                sheets_read_at=time.time()
+            )
+
+    def record_write(self, phone: Optional[str], action: str, candidate_data: Dict[str, Any],
+                     candidate_id: Optional[str], succeeded: bool) -> None:
+        """
+        Aplica localmente una escritura a Sheets (add/update)
+        Si falló, queda pendiente para que el sincronizador la reintente
+
+        Args:
+            phone (str): Teléfono del candidato
+            action (str): add_candidate o update_candidate
+            candidate_data (Dict): Datos enviados a Sheets
+            candidate_id (str): ID del candidato (update, o el asignado en add)
+            succeeded (bool): Si Sheets aceptó la escritura
+        """
+        if not phone:
+            return
+        with self.__transaction():
+            self.__apply_write(phone, action, candidate_data, candidate_id, succeeded)
+
+    def __apply_write(self, phone: str, action: str, candidate_data: Dict[str, Any],
+                      candidate_id: Optional[str], succeeded: bool) -> None:
+        session = self.get(phone) or {}
+        record = json.loads(session.get('candidate_json') or '{}')
+
+        if action == 'add_candidate':
+            record.update({
+                'id': candidate_id or record.get('id', ''),
+                'nombre_completo': candidate_data.get('nombre_completo', ''),
+                'telefono': phone,
+                'email': candidate_data.get('email', ''),
+                'cv_recibido': 'Sí' if candidate_data.get('cv_received', False) else 'No',
+                'cv_link': candidate_data.get('cv_link', ''),
+                'puesto_solicitado': candidate_data.get('puesto_solicitado', 'Asesor de Ventas Call Center Movistar'),
+                'fase_proceso': 'Inicial',
+            })
+        else:
+            if 'cv_link' in candidate_data:
+                record.update({'cv_link': candidate_data['cv_link'], 'cv_recibido': 'Sí'})
+            if 'fase_proceso' in candidate_data:
+                record['fase_proceso'] = candidate_data['fase_proceso']
+
+        fields = {
+            'sheets_status': 'found',
+            'candidate_id': record.get('id') or None,
+            'name': record.get('nombre_completo') or session.get('name'),
+            'cv_status': 'received' if cv_processed({'status': 'found', **record}) else 'none',
+            'candidate_json': json.dumps(record, ensure_ascii=False),
+        }
+        if not succeeded:
+            pending = json.loads(session.get('pending_writes') or '[]')
+            pending.append({'action': action, 'candidate_data': candidate_data, 'candidate_id': candidate_id})
+            fields.update(dirty=1, pending_writes=json.dumps(pending, ensure_ascii=False))
+        self.__upsert(phone, **fields)
+
+    def update(self, phone: str, last_intent: Optional[str] = None) -> None:
+        """
+        Actualiza el estado conversacional (solo local, no va a Sheets)
+
+        Args:
+            phone (str): Teléfono del candidato
+            last_intent (str): Última intención detectada
+        """
+        if phone and last_intent is not None:
+            self.__upsert(phone, last_intent=last_intent)
+
+    def set_summary(self, phone: str, summary: str, until: Optional[float] = None) -> None:
+        """
+        Reemplaza el resumen de la conversación
+
+        Args:
+            phone (str): Teléfono del candidato
+            summary (str): Resumen acumulado
+            until (float): Timestamp del último mensaje incluido en el resumen
+        """
+        if phone:
+            self.__upsert(phone, summary=summary, summary_until=until)
+
+    def dirty_sessions(self) -> List[Dict[str, Any]]:
+        rows = self.__connection().execute('SELECT * FROM sessions WHERE dirty = 1 ORDER BY updated_at').fetchall()
+        return [dict(row) for row in rows]
+
+    def start_sync(self, writer: Callable[[str, Dict[str, Any], Optional[str]], str], interval_seconds: Optional[float] = None) -> None:
+        """
+        Inicia el hilo que reintenta en Sheets las escrituras pendientes (idempotente)
+
+        Args:
+            writer (Callable): writer(action, candidate_data, candidate_id) -> WRITE_OK, WRITE_RETRY o WRITE_REJECTED
+            interval_seconds (float): Segundos entre pasadas (SESSION_SYNC_SECONDS, 30)
+        """
+        interval = interval_seconds or float(os.getenv('SESSION_SYNC_SECONDS', '30'))
+        with self.__start_lock:
+            if self.__sync_thread is not None:
+                return
+            self.__sync_thread = threading.Thread(target=self.__sync_loop, args=(writer, interval), name='session-sync', daemon=True)
+            self.__sync_thread.start()
+
+    def __sync_loop(self, writer: Callable[..., str], interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.sync_once(writer)
+            except Exception as e:
+                logger.error(f"Error sincronizando sesiones con Sheets: {e}")
+
+    def sync_once(self, writer: Callable[..., str]) -> int:
+        """
+        Reintenta las escrituras pendientes en orden
+
+        Returns:
+            int: Sesiones que quedaron sincronizadas
+        """
+        synced = 0
+        for session in self.dirty_sessions():
+            # Copia de las pendientes: Sheets se llama fuera de la transacción
+            pending = json.loads(session['pending_writes'] or '[]')
+            sent = 0                    # Escrituras del inicio de la lista ya resueltas (aceptadas o descartadas)
+            dead: List[Dict[str, Any]] = []
+            head = None                 # Escritura que falló y se reintenta en la siguiente pasada
+            while sent < len(pending):
+                write = pending[sent]
+                outcome = writer(write['action'], write['candidate_data'], write.get('candidate_id'))
+                # Compatibilidad con writers que devuelven bool
+                outcome = {True: WRITE_OK, False: WRITE_RETRY}.get(outcome, outcome)
+                if outcome == WRITE_OK:
+                    sent += 1
+                    continue
+
+                write['attempts'] = write.get('attempts', 0) + 1
+                if outcome == WRITE_REJECTED or write['attempts'] >= self.__max_attempts:
+                    # Sin arreglo reintentando: se aparta y se sigue con las siguientes
+                    write['error'] = 'rechazada por Sheets' if outcome == WRITE_REJECTED else f"{write['attempts']} intentos fallidos"
+                    dead.append(write)
+                    sent += 1
+                    logger.error(f"Escritura {write['action']} de {session['phone']} descartada: {write['error']}")
+                    continue
+                head = write
+                break
+
+            if self.__commit_sync(session['phone'], sent, head, dead):
+                synced += 1
+                logger.info(f"Sesión de {session['phone']} sincronizada con Sheets")
+        return synced
+
+    def __commit_sync(self, phone: str, sent: int, head: Optional[Dict[str, Any]], dead: List[Dict[str, Any]]) -> bool:
+        """
+        Guarda el resultado de una pasada releyendo la sesión: record_write solo agrega al final,
+        así que se quitan las primeras `sent` pendientes y se conservan las agregadas mientras tanto
+
+        Returns:
+            bool: Si la sesión quedó sincronizada
+        """
+        with self.__transaction():
+            session = self.get(phone) or {}
+            remaining = json.loads(session.get('pending_writes') or '[]')[sent:]
+            if head is not None and remaining:
+                remaining[0] = head  # Conserva el contador de intentos
+            dead_json = json.dumps(json.loads(session.get('dead_writes') or '[]') + dead, ensure_ascii=False) if dead else session.get('dead_writes')
+
+            if remaining:
+                self.__upsert(phone, dirty=1, pending_writes=json.dumps(remaining, ensure_ascii=False),
+                              sync_error='Sheets rechazó la escritura' if head is not None else None, dead_writes=dead_json)
+                return False
+            if dead:
+                # La copia local incluye cambios que Sheets no tiene: volver a leer la hoja
+                self.__upsert(phone, dirty=0, pending_writes=None, sync_error='Escrituras descartadas',
+                              dead_writes=dead_json, sheets_read_at=0)
+                return False
+            self.__upsert(phone, dirty=0, pending_writes=None, sync_error=None)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self.__connection()
+        total = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        dirty = conn.execute('SELECT COUNT(*) FROM sessions WHERE dirty = 1').fetchone()[0]
+        dead = conn.execute('SELECT COUNT(*) FROM sessions WHERE dead_writes IS NOT NULL').fetchone()[0]
+        with self.__stats_lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'sessions': total,
+                'dirty': dirty,
+                'with_dead_writes': dead,
+                'local_reads': self.__hits,
+                'sheets_reads': self.__misses,
+                'local_read_rate': round(self.__hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Instancia compartida por el webhook, el agente y las herramientas
+session_store = SessionStore()
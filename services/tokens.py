@@ -0,0 +1,37 @@
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # Sin tiktoken se estima por caracteres
+    tiktoken = None
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        logger.warning(f"tiktoken no disponible, se estiman tokens por caracteres: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de un texto (tiktoken o ~4 caracteres por token)"""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Recorta un texto a max_tokens tokens"""
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import requests
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Span activo en el contexto actual (se copia a los workers junto con el contexto)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """Tramo de una traza: nombre, duración, atributos y relación padre/hijo"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = 'ok'
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: Any) -> None:
+        self.status = 'error'
+        self.error = str(error)[:500]
+
+    def end(self) -> None:
+        """Cierra el tramo y lo envía al exportador configurado"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        _exporter.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+def begin_span(name: str, new_trace: bool = False, **attributes) -> Span:
+    """
+    Crea un tramo hijo del tramo activo sin activarlo en el contexto
+    Útil para callbacks con inicio y fin en llamadas separadas (ej. LLM)
+    """
+    parent = None if new_trace else _current_span.get()
+    if parent is None:
+        return Span(name, secrets.token_hex(16), None, attributes)
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+@contextmanager
+def _activate(current: Span):
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def span(name: str, **attributes):
+    """
+    Abre un tramo hijo del tramo activo (o una traza nueva si no hay ninguno)
+
+    Args:
+        name (str): Nombre del tramo (ej. 'waha.sendText', 'sheets.get_candidate')
+        **attributes: Atributos adicionales del tramo
+    """
+    return _activate(begin_span(name, **attributes))
+
+
+def start_trace(name: str, **attributes):
+    """Abre el tramo raíz de una traza nueva (ej. un webhook)"""
+    return _activate(begin_span(name, new_trace=True, **attributes))
+
+
+@contextmanager
+def use_span(parent: Optional[Span]):
+    """Activa un tramo existente sin cerrarlo (ej. al continuar una traza en otro hilo o event loop)"""
+    token = _current_span.set(parent)
+    try:
+        yield parent
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """Decorador que ejecuta la función dentro de un tramo"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current_span.get()
+    return active.trace_id if active else None
+
+
+def trace_headers() -> Dict[str, str]:
+    """Cabecera W3C traceparent para propagar la traza en llamadas HTTP salientes"""
+    active = _current_span.get()
+    if active is None:
+        return {}
+    return {'traceparent': f'00-{active.trace_id}-{active.span_id}-01'}
+
+
+class _SpanExporter:
+    """
+    Exporta tramos en un hilo de fondo para no bloquear el turno
+    TRACE_JSONL_PATH: archivo JSONL local; OTLP_TRACES_ENDPOINT: colector OTLP/HTTP (JSON)
+    """
+
+    BATCH_SIZE = 100
+    FLUSH_SECONDS = 2.0
+
+    def __init__(self):
+        self.jsonl_path = os.getenv('TRACE_JSONL_PATH', '')
+        self.otlp_endpoint = os.getenv('OTLP_TRACES_ENDPOINT', '')
+        self.service_name = os.getenv('TRACE_SERVICE_NAME', 'asistente-rrhh-bot')
+        self.enabled = bool(self.jsonl_path or self.otlp_endpoint)
+        self.__queue: 'queue.Queue[Span]' = queue.Queue(maxsize=10000)
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, finished: Span) -> None:
+        if not self.enabled:
+            return
+        self.__ensure_thread()
+        try:
+            self.__queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def __ensure_thread(self) -> None:
+        if self.__thread is not None:
+            return
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='trace-exporter', daemon=True)
+                self.__thread.start()
+
+    def __run(self) -> None:
+        while True:
+            batch: List[Span] = [self.__queue.get()]
+            deadline = time.monotonic() + self.FLUSH_SECONDS
+            while len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.__queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if self.jsonl_path:
+                    self.__write_jsonl(batch)
+                if self.otlp_endpoint:
+                    self.__send_otlp(batch)
+            except Exception as e:
+                logger.warning(f"Error exportando trazas: {e}")
+
+    def __write_jsonl(self, batch: List[Span]) -> None:
+        directory = os.path.dirname(self.jsonl_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.jsonl_path, 'a', encoding='utf-8') as file:
+            for finished in batch:
+                file.write(json.dumps(finished.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+    def __send_otlp(self, batch: List[Span]) -> None:
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {'key': key, 'value': {'boolValue': value}}
+            if isinstance(value, int):
+                return {'key': key, 'value': {'intValue': str(value)}}
+            if isinstance(value, float):
+                return {'key': key, 'value': {'doubleValue': value}}
+            return {'key': key, 'value': {'stringValue': str(value)}}
+
+        spans = []
+        for finished in batch:
+            item = {
+                'traceId': finished.trace_id,
+                'spanId': finished.span_id,
+                'name': finished.name,
+                'kind': 1,
+                'startTimeUnixNano': str(finished.start_ns),
+                'endTimeUnixNano': str(finished.end_ns),
+                'attributes': [attribute(k, v) for k, v in finished.attributes.items()],
+                'status': {'code': 2, 'message': finished.error or ''} if finished.status == 'error' else {'code': 1},
+            }
+            if finished.parent_id:
+                item['parentSpanId'] = finished.parent_id
+            spans.append(item)
+
+        body = {
+            'resourceSpans': [{
+                'resource': {'attributes': [attribute('service.name', self.service_name)]},
+                'scopeSpans': [{'scope': {'name': 'services.tracing'}, 'spans': spans}],
+            }]
+        }
+        endpoint = self.otlp_endpoint.rstrip('/')
+        if not endpoint.endswith('/v1/traces'):
+            endpoint += '/v1/traces'
+        response = requests.post(endpoint, json=body, timeout=5)
+        response.raise_for_status()
+
+
+_exporter = _SpanExporter()
+
+
+class TraceContextFilter(logging.Filter):
+    """Agrega trace_id a cada registro de log para unir las líneas de un mismo turno"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'trace_id'):
+            record.trace_id = current_trace_id() or '-'
+        return True
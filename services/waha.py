@@ -1,17 +1,100 @@
 import requests
 import os
+import random
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
 import time
 
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from services.history_store import history_store
+from services.waha_health import waha_breaker
+from services.tracing import span, trace_headers
+from services.deadline import DeadlineExceeded, stage_timeout
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# ✅ NUEVO: Sesión HTTP compartida por todo el proceso (keep-alive hacia WAHA)
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    """Devuelve la sesión compartida con pool de conexiones"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = int(os.getenv('WAHA_POOL_MAXSIZE', '20'))
+                # Los reintentos se manejan en Waha.__request (con backoff y jitter)
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+class WahaUnavailableError(requests.ConnectionError):
+    """WAHA marcado como caído por el circuit breaker"""
+
+
+class WahaDeadlineError(requests.Timeout):
+    """El turno ya no tiene tiempo para esta llamada (no cuenta como fallo de WAHA)"""
+
+
+# ✅ NUEVO: Resultado de un envío de texto (Waha.send_text), usado por el outbox para decidir si reintentar
+SEND_OK = 'sent'
+SEND_REJECTED = 'rejected'        # WAHA respondió con un error 4xx: no se envió
+SEND_UNAVAILABLE = 'unavailable'  # La petición no llegó a WAHA (circuito abierto, conexión rechazada)
+SEND_UNKNOWN = 'unknown'          # Timeout de lectura, 5xx o conexión cortada: pudo haberse enviado
+
+
+def _message_id(message: Dict[str, Any]) -> Optional[str]:
+    """ID de un mensaje de WAHA (según el engine es texto o un objeto con _serialized)"""
+    message_id = message.get('id')
+    if isinstance(message_id, dict):
+        message_id = message_id.get('_serialized')
+    return str(message_id) if message_id else None
+
+
+def _never_reached_waha(error: requests.RequestException) -> bool:
+    """La petición no salió del proceso o WAHA no aceptó la conexión"""
+    if isinstance(error, (WahaUnavailableError, WahaDeadlineError, requests.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
 class Waha:
     """
     Cliente para interactuar con WAHA (WhatsApp HTTP API)
     Maneja el envío de mensajes, obtención de historial y indicadores de escritura
+    Todas las instancias comparten un pool de conexiones y reintentan errores transitorios
     """
+
+    # Timeouts (conexión, lectura) por operación
+    CONNECT_TIMEOUT = float(os.getenv('WAHA_CONNECT_TIMEOUT', '3.05'))
+    READ_TIMEOUTS = {
+        'sendText': 15,
+        'sendFile': 60,
+        'getMessages': 10,
+        'startTyping': 5,
+        'stopTyping': 5,
+        'getChat': 10,
+        'getSession': 5,
+        'sendReaction': 5,
+    }
+
+    # Operaciones que no son seguras de repetir si WAHA ya las recibió
+    NON_IDEMPOTENT = {'sendText', 'sendFile'}
+    RETRY_STATUS = {500, 502, 503, 504}
+    MAX_RETRIES = int(os.getenv('WAHA_MAX_RETRIES', '2'))
+    RETRY_BACKOFF = float(os.getenv('WAHA_RETRY_BACKOFF', '0.3'))
+    # Lecturas acotadas por el deadline del turno; los envíos y stopTyping siempre se completan
+    DEADLINE_BOUND = {'getMessages', 'startTyping', 'getChat'}
     
     def __init__(self):
         # Configurar URL base desde variable de entorno o usar localhost
@@ -23,11 +106,90 @@ class Waha:
             'Content-Type': 'application/json',
         }
         
-        # Configurar timeout
-        self.__timeout = 30
-        
         logger.info(f"WAHA inicializado con URL: {self.__api_url}")
 
+    @classmethod
+    def read_timeout_for(cls, operation: str) -> float:
+        """Timeout de lectura de la operación, recortado al tiempo que le queda al turno"""
+        read_timeout = cls.READ_TIMEOUTS.get(operation, 10)
+        if operation not in cls.DEADLINE_BOUND:
+            return read_timeout
+        try:
+            return stage_timeout('waha', read_timeout)
+        except DeadlineExceeded as e:
+            raise WahaDeadlineError(str(e)) from e
+
+    def __timeout_for(self, operation: str) -> Tuple[float, float]:
+        read_timeout = self.read_timeout_for(operation)
+        return (min(self.CONNECT_TIMEOUT, read_timeout), read_timeout)
+
+    def __backoff(self, attempt: int) -> float:
+        # Backoff exponencial con jitter para no sincronizar reintentos entre workers
+        return min(5.0, self.RETRY_BACKOFF * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+    def __request(self, method: str, operation: str, url: str, **kwargs) -> requests.Response:
+        """
+        Ejecuta la llamada HTTP con la sesión compartida, reintentos y traza
+
+        Reintenta errores de conexión siempre; timeouts de lectura y 5xx solo en
+        operaciones idempotentes (enviar texto dos veces duplicaría el mensaje)
+        """
+        # Con el circuito abierto se falla de inmediato sin esperar timeouts
+        if not waha_breaker.allow():
+            raise WahaUnavailableError(f"Circuito de WAHA abierto, {operation} rechazado")
+
+        try:
+            response = self.__request_with_retries(method, operation, url, **kwargs)
+        except WahaDeadlineError:
+            # Sin tiempo para llamar no es un fallo de WAHA, pero la prueba de half_open debe liberarse
+            waha_breaker.release_probe()
+            raise
+        except Exception:
+            waha_breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            waha_breaker.record_failure()
+        else:
+            waha_breaker.record_success()
+        return response
+
+    def __request_with_retries(self, method: str, operation: str, url: str, **kwargs) -> requests.Response:
+        idempotent = operation not in self.NON_IDEMPOTENT
+        session = _get_session()
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            is_last = attempt == self.MAX_RETRIES
+            # Sin tiempo restante se corta aquí, sin reintentar
+            timeout = self.__timeout_for(operation)
+            with span(f'waha.{operation}', method=method, attempt=attempt) as http_span:
+                try:
+                    response = session.request(
+                        method,
+                        url,
+                        headers={**self.__headers, **trace_headers()},
+                        timeout=timeout,
+                        **kwargs
+                    )
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    # ReadTimeout no es ConnectionError: WAHA pudo haber recibido la petición
+                    retryable = idempotent or isinstance(e, requests.ConnectionError)
+                    http_span.record_error(e)
+                    if is_last or not retryable:
+                        raise
+                    logger.warning(f"Reintentando {operation} tras error de conexión ({attempt + 1}/{self.MAX_RETRIES}): {e}")
+                    time.sleep(self.__backoff(attempt))
+                    continue
+
+                http_span.set_attribute('status_code', response.status_code)
+                if response.status_code >= 400:
+                    http_span.record_error(f'HTTP {response.status_code}')
+                if response.status_code in self.RETRY_STATUS and idempotent and not is_last:
+                    logger.warning(f"Reintentando {operation} tras HTTP {response.status_code} ({attempt + 1}/{self.MAX_RETRIES})")
+                    time.sleep(self.__backoff(attempt))
+                    continue
+                return response
+
     def send_message(self, chat_id: str, message: str, parse_mode: str = None) -> bool:
         """
         Envía un mensaje de texto a un chat específico
@@ -40,6 +202,24 @@ class Waha:
         Returns:
             bool: True si el mensaje se envió correctamente
         """
+        return self.send_text(chat_id, message, parse_mode) == SEND_OK
+
+    def send_text(self, chat_id: str, message: str, parse_mode: str = None) -> str:
+        """
+        Envía un mensaje de texto distinguiendo por qué no se envió
+
+        Returns:
+            str: SEND_OK, SEND_REJECTED, SEND_UNAVAILABLE o SEND_UNKNOWN (puede que WAHA sí lo haya enviado)
+        """
+        return self.send_text_with_id(chat_id, message, parse_mode)[0]
+
+    def send_text_with_id(self, chat_id: str, message: str, parse_mode: str = None) -> Tuple[str, Optional[str]]:
+        """
+        Como send_text, pero devuelve también el ID que WAHA asignó al mensaje (None si no se envió)
+
+        Returns:
+            Tuple[str, Optional[str]]: (resultado SEND_*, ID del mensaje en WAHA)
+        """
         url = f'{self.__api_url}/api/sendText'
         
         payload = {
@@ -52,20 +232,71 @@ class Waha:
             payload['parseMode'] = parse_mode
         
         try:
-            response = requests.post(
+            response = self.__request(
+                'POST',
+                'sendText',
                 url=url,
-                json=payload,
-                headers=self.__headers,
-                timeout=self.__timeout
+                json=payload
             )
             
             response.raise_for_status()
             logger.info(f"Mensaje enviado exitosamente a {chat_id}")
-            return True
+            return SEND_OK, self.__record_sent(chat_id, message, response)
             
+        except requests.HTTPError as e:
+            logger.error(f"Error enviando mensaje a {chat_id}: {e}")
+            return SEND_UNKNOWN if e.response is not None and e.response.status_code >= 500 else SEND_REJECTED, None
         except requests.RequestException as e:
             logger.error(f"Error enviando mensaje a {chat_id}: {e}")
-            return False
+            return SEND_UNAVAILABLE if _never_reached_waha(e) else SEND_UNKNOWN, None
+
+    def find_sent_message(self, chat_id: str, message: str, since: float, until: float,
+                          exclude_ids: Sequence[str] = (), limit: int = 20) -> Optional[Union[str, bool]]:
+        """
+        Busca en el historial de WAHA un mensaje propio con este texto enviado entre `since` y `until`
+        Sirve para confirmar un envío cuyo resultado se desconoce antes de reenviarlo. Los textos fijos
+        se repiten: los mensajes de `exclude_ids` (ya atribuidos a otro envío) no cuentan
+
+        Returns:
+            Optional[Union[str, bool]]: ID del mensaje encontrado (True si WAHA no da ID), False si no está,
+            None si WAHA no respondió
+        """
+        url = f'{self.__api_url}/api/{self.__session}/chats/{chat_id}/messages'
+        try:
+            response = self.__request('GET', 'getMessages', url=url, params={'limit': limit, 'downloadMedia': False})
+            response.raise_for_status()
+            messages = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"No se pudo confirmar el envío a {chat_id}: {e}")
+            return None
+
+        excluded = set(exclude_ids)
+        for item in messages:
+            if not isinstance(item, dict) or not item.get('fromMe') or (item.get('body') or '') != message:
+                continue
+            if not since <= (item.get('timestamp') or 0) <= until:
+                continue
+            message_id = _message_id(item)
+            if message_id in excluded:
+                continue
+            return message_id or True
+        return False
+
+    @staticmethod
+    def __record_sent(chat_id: str, message: str, response: requests.Response) -> Optional[str]:
+        # Nuestros envíos alimentan el historial local (el id evita duplicarlo si WAHA lo reenvía por webhook)
+        try:
+            sent = response.json()
+        except ValueError:
+            sent = {}
+        message_id = _message_id(sent) if isinstance(sent, dict) else None
+        history_store.record(chat_id, {
+            'id': sent.get('id') if isinstance(sent, dict) else None,
+            'body': message,
+            'fromMe': True,
+            'timestamp': time.time(),
+        })
+        return message_id
 
     def send_file(self, chat_id: str, file_path: str, caption: str = None) -> bool:
         """
@@ -91,11 +322,11 @@ class Waha:
             payload['caption'] = caption
         
         try:
-            response = requests.post(
+            response = self.__request(
+                'POST',
+                'sendFile',
                 url=url,
-                json=payload,
-                headers=self.__headers,
-                timeout=self.__timeout
+                json=payload
             )
             
             response.raise_for_status()
@@ -125,11 +356,11 @@ class Waha:
         }
         
         try:
-            response = requests.get(
+            response = self.__request(
+                'GET',
+                'getMessages',
                 url=url,
-                params=params,
-                headers=self.__headers,
-                timeout=self.__timeout
+                params=params
             )
             
             response.raise_for_status()
@@ -160,11 +391,11 @@ class Waha:
         }
         
         try:
-            response = requests.post(
+            response = self.__request(
+                'POST',
+                'startTyping',
                 url=url,
-                json=payload,
-                headers=self.__headers,
-                timeout=self.__timeout
+                json=payload
             )
             
             response.raise_for_status()
@@ -193,11 +424,11 @@ class Waha:
         }
         
         try:
-            response = requests.post(
+            response = self.__request(
+                'POST',
+                'stopTyping',
                 url=url,
-                json=payload,
-                headers=self.__headers,
-                timeout=self.__timeout
+                json=payload
             )
             
             response.raise_for_status()
@@ -221,10 +452,10 @@ class Waha:
         url = f'{self.__api_url}/api/{self.__session}/chats/{chat_id}'
         
         try:
-            response = requests.get(
-                url=url,
-                headers=self.__headers,
-                timeout=self.__timeout
+            response = self.__request(
+                'GET',
+                'getChat',
+                url=url
             )
             
             response.raise_for_status()
@@ -247,10 +478,10 @@ class Waha:
         url = f'{self.__api_url}/api/sessions/{self.__session}'
         
         try:
-            response = requests.get(
-                url=url,
-                headers=self.__headers,
-                timeout=self.__timeout
+            response = self.__request(
+                'GET',
+                'getSession',
+                url=url
             )
             
             response.raise_for_status()
@@ -285,11 +516,11 @@ class Waha:
         }
         
         try:
-            response = requests.post(
+            response = self.__request(
+                'POST',
+                'sendReaction',
                 url=url,
-                json=payload,
-                headers=self.__headers,
-                timeout=self.__timeout
+                json=payload
             )
             
             response.raise_for_status()
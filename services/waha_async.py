@@ -0,0 +1,314 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Dict, List, Optional
+
+import httpx
+
+from services.deadline import current_deadline, use_deadline
+from services.history_store import history_store
+from services.tracing import current_span, span, trace_headers, use_span
+from services.waha import Waha, WahaDeadlineError
+from services.waha_health import waha_breaker
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncWahaDeadlineError(httpx.TimeoutException):
+    """El turno ya no tiene tiempo para esta llamada (no cuenta como fallo de WAHA)"""
+
+
+class AsyncWaha:
+    """
+    Cliente asíncrono para WAHA (WhatsApp HTTP API)
+    Mismos métodos que Waha sobre un httpx.AsyncClient con pool de conexiones:
+    permite lanzar en paralelo llamadas independientes (typing, historial, envío)
+    y atender muchos chats desde un solo event loop
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
+        self.__api_url = os.getenv('WAHA_API_URL', 'http://waha:3000')
+        self.__session = os.getenv('WAHA_SESSION', 'default')
+        self.__headers = {
+            'Content-Type': 'application/json',
+        }
+        self.__client = client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv('WAHA_POOL_MAXSIZE', '20')),
+                max_keepalive_connections=int(os.getenv('WAHA_POOL_MAXSIZE', '20'))
+            )
+        )
+
+    async def aclose(self) -> None:
+        await self.__client.aclose()
+
+    def __timeout_for(self, operation: str) -> httpx.Timeout:
+        try:
+            read_timeout = Waha.read_timeout_for(operation)
+        except WahaDeadlineError as e:
+            raise AsyncWahaDeadlineError(str(e)) from e
+        return httpx.Timeout(read_timeout, connect=min(Waha.CONNECT_TIMEOUT, read_timeout))
+
+    async def __request(self, method: str, operation: str, url: str, **kwargs) -> httpx.Response:
+        """Mismo circuit breaker que Waha"""
+        if not waha_breaker.allow():
+            raise httpx.ConnectError(f"Circuito de WAHA abierto, {operation} rechazado")
+
+        try:
+            response = await self.__request_with_retries(method, operation, url, **kwargs)
+        except AsyncWahaDeadlineError:
+            # Sin tiempo para llamar no es un fallo de WAHA, pero la prueba de half_open debe liberarse
+            waha_breaker.release_probe()
+            raise
+        except Exception:
+            waha_breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            waha_breaker.record_failure()
+        else:
+            waha_breaker.record_success()
+        return response
+
+    async def __request_with_retries(self, method: str, operation: str, url: str, **kwargs) -> httpx.Response:
+        """Misma política de reintentos que Waha: 5xx y timeouts de lectura solo en operaciones idempotentes"""
+        idempotent = operation not in Waha.NON_IDEMPOTENT
+
+        for attempt in range(Waha.MAX_RETRIES + 1):
+            is_last = attempt == Waha.MAX_RETRIES
+            timeout = self.__timeout_for(operation)
+            with span(f'waha.{operation}', method=method, attempt=attempt, client='async') as http_span:
+                try:
+                    response = await self.__client.request(
+                        method,
+                        url,
+                        headers={**self.__headers, **trace_headers()},
+                        timeout=timeout,
+                        **kwargs
+                    )
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
+                    retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                    http_span.record_error(e)
+                    if is_last or not retryable:
+                        raise
+                    logger.warning(f"Reintentando {operation} tras error de conexión ({attempt + 1}/{Waha.MAX_RETRIES}): {e}")
+                    await asyncio.sleep(self.__backoff(attempt))
+                    continue
+
+                http_span.set_attribute('status_code', response.status_code)
+                if response.status_code >= 400:
+                    http_span.record_error(f'HTTP {response.status_code}')
+                if response.status_code in Waha.RETRY_STATUS and idempotent and not is_last:
+                    logger.warning(f"Reintentando {operation} tras HTTP {response.status_code} ({attempt + 1}/{Waha.MAX_RETRIES})")
+                    await asyncio.sleep(self.__backoff(attempt))
+                    continue
+                return response
+
+    def __backoff(self, attempt: int) -> float:
+        return min(5.0, Waha.RETRY_BACKOFF * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+    async def send_message(self, chat_id: str, message: str, parse_mode: str = None) -> bool:
+        """
+        Envía un mensaje de texto a un chat específico
+
+        Returns:
+            bool: True si el mensaje se envió correctamente
+        """
+        payload = {
+            'session': self.__session,
+            'chatId': chat_id,
+            'text': message,
+        }
+        if parse_mode:
+            payload['parseMode'] = parse_mode
+
+        try:
+            response = await self.__request('POST', 'sendText', url=f'{self.__api_url}/api/sendText', json=payload)
+            response.raise_for_status()
+            logger.info(f"Mensaje enviado exitosamente a {chat_id}")
+            try:
+                sent = response.json()
+            except ValueError:
+                sent = {}
+            history_store.record(chat_id, {
+                'id': sent.get('id') if isinstance(sent, dict) else None,
+                'body': message,
+                'fromMe': True,
+                'timestamp': time.time(),
+            })
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error enviando mensaje a {chat_id}: {e}")
+            return False
+
+    async def send_file(self, chat_id: str, file_path: str, caption: str = None) -> bool:
+        """
+        Envía un archivo a un chat específico
+
+        Returns:
+            bool: True si el archivo se envió correctamente
+        """
+        payload = {
+            'session': self.__session,
+            'chatId': chat_id,
+            'file': file_path,
+        }
+        if caption:
+            payload['caption'] = caption
+
+        try:
+            response = await self.__request('POST', 'sendFile', url=f'{self.__api_url}/api/sendFile', json=payload)
+            response.raise_for_status()
+            logger.info(f"Archivo enviado exitosamente a {chat_id}")
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error enviando archivo a {chat_id}: {e}")
+            return False
+
+    async def get_history_messages(self, chat_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Obtiene el historial de mensajes de un chat
+
+        Returns:
+            List[Dict]: Lista de mensajes del historial
+        """
+        url = f'{self.__api_url}/api/{self.__session}/chats/{chat_id}/messages'
+        params = {
+            'limit': limit,
+            'downloadMedia': 'false'
+        }
+
+        try:
+            response = await self.__request('GET', 'getMessages', url=url, params=params)
+            response.raise_for_status()
+            messages = response.json()
+            logger.info(f"Obtenidos {len(messages)} mensajes del historial de {chat_id}")
+            return messages
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error obteniendo historial de {chat_id}: {e}")
+            return []
+
+    async def start_typing(self, chat_id: str) -> bool:
+        """Inicia el indicador de 'escribiendo...' en un chat"""
+        return await self.__typing('startTyping', chat_id)
+
+    async def stop_typing(self, chat_id: str) -> bool:
+        """Detiene el indicador de 'escribiendo...' en un chat"""
+        return await self.__typing('stopTyping', chat_id)
+
+    async def __typing(self, operation: str, chat_id: str) -> bool:
+        payload = {
+            'session': self.__session,
+            'chatId': chat_id,
+        }
+        try:
+            response = await self.__request('POST', operation, url=f'{self.__api_url}/api/{operation}', json=payload)
+            response.raise_for_status()
+            logger.debug(f"{operation} ejecutado para {chat_id}")
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error en {operation} para {chat_id}: {e}")
+            return False
+
+    async def get_chat_info(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """Obtiene información de un chat específico"""
+        try:
+            response = await self.__request('GET', 'getChat', url=f'{self.__api_url}/api/{self.__session}/chats/{chat_id}')
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error obteniendo info del chat {chat_id}: {e}")
+            return None
+
+    async def get_session_status(self) -> Optional[Dict[str, Any]]:
+        """Obtiene el estado de la sesión de WhatsApp"""
+        try:
+            response = await self.__request('GET', 'getSession', url=f'{self.__api_url}/api/sessions/{self.__session}')
+            response.raise_for_status()
+            status = response.json()
+            logger.info(f"Estado de sesión: {status.get('status', 'unknown')}")
+            return status
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error obteniendo estado de sesión: {e}")
+            return None
+
+    async def send_reaction(self, chat_id: str, message_id: str, emoji: str) -> bool:
+        """Envía una reacción a un mensaje específico"""
+        payload = {
+            'session': self.__session,
+            'chatId': chat_id,
+            'messageId': message_id,
+            'reaction': emoji
+        }
+        try:
+            response = await self.__request('POST', 'sendReaction', url=f'{self.__api_url}/api/sendReaction', json=payload)
+            response.raise_for_status()
+            logger.info(f"Reacción {emoji} enviada al mensaje {message_id}")
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error enviando reacción: {e}")
+            return False
+
+    async def check_connection(self) -> bool:
+        """Verifica si la sesión de WAHA está conectada"""
+        status = await self.get_session_status()
+        return bool(status and status.get('status') in ['WORKING', 'CONNECTED'])
+
+
+class AsyncLoopThread:
+    """
+    Event loop en un hilo de fondo para usar AsyncWaha desde código síncrono
+    (workers del pool, Flask). Un único loop atiende las llamadas de todos los chats
+    """
+
+    def __init__(self):
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__lock = threading.Lock()
+        self.__waha: Optional[AsyncWaha] = None
+
+    def __ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self.__loop is None:
+            with self.__lock:
+                if self.__loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name='waha-async-loop', daemon=True)
+                    thread.start()
+                    self.__loop = loop
+        return self.__loop
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """
+        Ejecuta una corrutina en el loop de fondo y espera su resultado
+
+        Args:
+            coro (Awaitable): Corrutina a ejecutar
+            timeout (float): Segundos máximos de espera
+        """
+        loop = self.__ensure_loop()
+        parent = current_span()
+        deadline = current_deadline()
+
+        async def with_trace():
+            # El loop corre en otro hilo: continuar la traza y el deadline del llamador
+            with use_span(parent), use_deadline(deadline):
+                return await coro
+
+        future = asyncio.run_coroutine_threadsafe(with_trace(), loop)
+        return future.result(timeout=timeout)
+
+    def waha(self) -> AsyncWaha:
+        """AsyncWaha compartido, creado dentro del loop de fondo"""
+        if self.__waha is None:
+            async def create():
+                return AsyncWaha()
+            with self.__lock:
+                if self.__waha is None:
+                    self.__waha = asyncio.run_coroutine_threadsafe(create(), self.__ensure_loop()).result()
+        return self.__waha
+
+
+async_runner = AsyncLoopThread()
@@ -0,0 +1,167 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+HEALTHY_SESSION_STATES = {'WORKING', 'CONNECTED'}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker compartido por todas las llamadas a WAHA (cliente síncrono y asíncrono)
+    closed: todo pasa; tras `failure_threshold` fallos seguidos pasa a open
+    open: se rechaza sin llamar a WAHA durante `reset_timeout` segundos
+    half_open: se deja pasar una sola llamada de prueba; su resultado cierra o reabre
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.failure_threshold = failure_threshold or int(os.getenv('WAHA_BREAKER_THRESHOLD', '5'))
+        self.reset_timeout = reset_timeout or float(os.getenv('WAHA_BREAKER_RESET_SECONDS', '30'))
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__probe_in_flight = False
+        self.__rejected = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.__lock:
+            return self.__current_state()
+
+    def __current_state(self) -> str:
+        # Debe llamarse con el lock tomado
+        if self.__state == self.OPEN and time.monotonic() - self.__opened_at >= self.reset_timeout:
+            self.__state = self.HALF_OPEN
+            self.__probe_in_flight = False
+        return self.__state
+
+    def allow(self) -> bool:
+        """
+        Indica si una llamada puede ir a WAHA
+
+        Returns:
+            bool: False si el circuito está abierto (o ya hay una prueba en curso)
+        """
+        with self.__lock:
+            state = self.__current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.__probe_in_flight:
+                self.__probe_in_flight = True
+                return True
+            self.__rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self.__lock:
+            if self.__state != self.CLOSED:
+                logger.info("Circuito de WAHA cerrado: servicio recuperado")
+            self.__state = self.CLOSED
+            self.__failures = 0
+            self.__probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """
+        Libera la llamada de prueba sin resultado (ej. el turno se quedó sin tiempo antes de llamar a WAHA)
+        Sin esto, en half_open la prueba quedaría en curso para siempre y allow() rechazaría todo
+        """
+        with self.__lock:
+            self.__probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == self.HALF_OPEN or self.__failures >= self.failure_threshold:
+                if self.__state != self.OPEN:
+                    logger.warning(f"Circuito de WAHA abierto tras {self.__failures} fallos seguidos")
+                self.__state = self.OPEN
+                self.__opened_at = time.monotonic()
+                self.__probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            state = self.__current_state()
+            return {
+                'state': state,
+                'consecutive_failures': self.__failures,
+                'rejected': self.__rejected,
+                'open_for_seconds': round(time.monotonic() - self.__opened_at, 1) if state != self.CLOSED else 0.0,
+            }
+
+
+class SessionHealthPoller:
+    """
+    Consulta en segundo plano el estado de la sesión de WAHA y lo cachea
+    El camino del webhook lee el último estado sin hacer llamadas bloqueantes
+    """
+
+    def __init__(self, breaker: CircuitBreaker, interval_seconds: Optional[float] = None):
+        self.__breaker = breaker
+        self.__interval = interval_seconds or float(os.getenv('WAHA_HEALTH_INTERVAL', '15'))
+        self.__status: Optional[str] = None
+        self.__checked_at: Optional[float] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__start_lock = threading.Lock()
+        self.__lock = threading.Lock()
+
+    def start(self) -> None:
+        """Inicia el hilo de consulta (idempotente)"""
+        with self.__start_lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__run, name='waha-health', daemon=True)
+            self.__thread.start()
+
+    def __run(self) -> None:
+        # Importación diferida: services.waha depende de este módulo
+        from services.waha import Waha
+        waha = Waha()
+        while True:
+            try:
+                status = waha.get_session_status()
+                session_status = status.get('status', 'UNKNOWN') if status else 'UNREACHABLE'
+            except Exception as e:
+                logger.error(f"Error consultando salud de WAHA: {e}")
+                session_status = 'UNREACHABLE'
+
+            with self.__lock:
+                if session_status != self.__status:
+                    logger.info(f"Estado de la sesión de WAHA: {self.__status} -> {session_status}")
+                self.__status = session_status
+                self.__checked_at = time.time()
+            time.sleep(self.__interval)
+
+    def is_available(self) -> bool:
+        """
+        Indica si vale la pena procesar un turno (WAHA podrá entregar la respuesta)
+        Sin datos todavía se asume disponible para no bloquear el arranque
+        """
+        if self.__breaker.state == CircuitBreaker.OPEN:
+            return False
+        with self.__lock:
+            return self.__status is None or self.__status in HEALTHY_SESSION_STATES
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            status = self.__status
+            checked_at = self.__checked_at
+        return {
+            'available': self.is_available(),
+            'session_status': status or 'UNKNOWN',
+            'checked_seconds_ago': round(time.time() - checked_at, 1) if checked_at else None,
+            'circuit_breaker': self.__breaker.stats(),
+        }
+
+
+# Instancias compartidas por Waha, AsyncWaha y el webhook
+waha_breaker = CircuitBreaker()
+waha_health = SessionHealthPoller(waha_breaker)
@@ -0,0 +1,127 @@
+import os
+import queue
+import contextvars
+import logging
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Pool acotado de hilos para ejecutar turnos del agente fuera del request HTTP
+    Permite que el webhook responda en milisegundos mientras los workers
+    procesan el mensaje y envían la respuesta por WAHA
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None, name: str = 'turn-worker'):
+        self.__workers = workers or int(os.getenv('WEBHOOK_WORKERS', '4'))
+        self.__queue_size = queue_size or int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+        self.__name = name
+        self.__queue = queue.Queue(maxsize=self.__queue_size)
+        self.__threads = []
+        self.__start_lock = threading.Lock()
+
+        # Métricas básicas del pool
+        self.__stats_lock = threading.Lock()
+        self.__in_flight = 0
+        self.__submitted = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__rejected = 0
+        self.__wait_total = 0.0
+        self.__wait_max = 0.0
+        self.__last_wait = 0.0
+
+    def start(self) -> None:
+        """Inicia los hilos del pool (idempotente)"""
+        with self.__start_lock:
+            if self.__threads:
+                return
+            for index in range(self.__workers):
+                thread = threading.Thread(
+                    target=self.__run,
+                    name=f'{self.__name}-{index}',
+                    daemon=True
+                )
+                thread.start()
+                self.__threads.append(thread)
+            logger.info(f"Pool iniciado con {self.__workers} workers (cola máxima: {self.__queue_size})")
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> bool:
+        """
+        Encola una tarea sin bloquear
+
+        Args:
+            func (Callable): Función a ejecutar en un worker
+            *args, **kwargs: Argumentos de la función
+
+        Returns:
+            bool: True si la tarea fue encolada, False si la cola está llena
+        """
+        self.start()
+        try:
+            # Copiar el contexto (traza activa) para que el worker continúe la misma traza
+            context = contextvars.copy_context()
+            self.__queue.put_nowait((time.monotonic(), context, func, args, kwargs))
+        except queue.Full:
+            with self.__stats_lock:
+                self.__rejected += 1
+            logger.warning(f"Cola de trabajo llena ({self.__queue_size}), tarea rechazada")
+            return False
+
+        with self.__stats_lock:
+            self.__submitted += 1
+        return True
+
+    def __run(self) -> None:
+        while True:
+            enqueued_at, context, func, args, kwargs = self.__queue.get()
+            wait = time.monotonic() - enqueued_at
+
+            with self.__stats_lock:
+                self.__in_flight += 1
+                self.__wait_total += wait
+                self.__wait_max = max(self.__wait_max, wait)
+                self.__last_wait = wait
+
+            try:
+                context.run(func, *args, **kwargs)
+                with self.__stats_lock:
+                    self.__completed += 1
+            except Exception as e:
+                with self.__stats_lock:
+                    self.__failed += 1
+                logger.error(f"Error ejecutando tarea en el pool: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+            finally:
+                with self.__stats_lock:
+                    self.__in_flight -= 1
+                self.__queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Devuelve métricas del pool
+
+        Returns:
+            Dict: Profundidad de cola, tareas en curso y tiempos de espera
+        """
+        with self.__stats_lock:
+            started = self.__completed + self.__failed + self.__in_flight
+            return {
+                'workers': self.__workers,
+                'queue_size': self.__queue_size,
+                'queue_depth': self.__queue.qsize(),
+                'in_flight': self.__in_flight,
+                'submitted': self.__submitted,
+                'completed': self.__completed,
+                'failed': self.__failed,
+                'rejected': self.__rejected,
+                'wait_avg_seconds': round(self.__wait_total / started, 4) if started else 0.0,
+                'wait_max_seconds': round(self.__wait_max, 4),
+                'wait_last_seconds': round(self.__last_wait, 4),
+            }
@@ -5,14 +5,57 @@ from langchain.agents.agent_types import AgentType
 from typing import Dict, List, Optional, Any, Union
 import json
 import logging
+from threading import Lock
 
-from utils.candidatos import SpreadsheetManager
+from utils.candidatos import PERMANENT_ERRORS, SpreadsheetManager
 from utils.cv_analyser import CVProcessor
 from utils.info_perfil import AIBotTool
+from services.deadline import DeadlineExceeded, run_bounded
+from services.logging_config import log_ref
+from services.metrics import TURN_FALLBACKS, track_stage
+from services.session_store import WRITE_OK, WRITE_REJECTED, WRITE_RETRY, session_store, phone_from_candidate_id
 
 logger = logging.getLogger(__name__)
 
+# ✅ NUEVO: Instancias compartidas de los backends (Sheets, CV, RAG) por proceso
+_shared_instances: Dict[str, Any] = {}
+_shared_lock = Lock()
+
+def _get_shared(name: str, factory, is_ready=None):
+    """Devuelve una instancia compartida, creándola en el primer uso"""
+    instance = _shared_instances.get(name)
+    if instance is not None:
+        return instance
+
+    with _shared_lock:
+        instance = _shared_instances.get(name)
+        if instance is None:
+            instance = factory()
+            # No cachear instancias que no pudieron inicializarse (ej. Sheets sin conexión)
+            if is_ready is None or is_ready(instance):
+                _shared_instances[name] = instance
+                logger.info(f"♻️ Instancia compartida creada: {name}")
+    return instance
+
+def _spreadsheet_manager() -> SpreadsheetManager:
+    return _get_shared('spreadsheet', SpreadsheetManager, lambda manager: manager.worksheet is not None)
+
+def _cv_processor() -> CVProcessor:
+    return _get_shared('cv_processor', CVProcessor)
+
+def _retriever() -> AIBotTool:
+    return _get_shared('retriever', AIBotTool)
+
 class PathTools:
+    @staticmethod
+    def warm_up() -> None:
+        """Construye por adelantado los backends de las herramientas"""
+        for name, factory in [('spreadsheet', _spreadsheet_manager), ('cv_processor', _cv_processor), ('retriever', _retriever)]:
+            try:
+                factory()
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo precargar {name}: {e}")
+
     @staticmethod
     def run_def_spreadsheet(action: str, phone: Optional[str] = None, candidate_data: Optional[Dict[str, Any]] = None, candidate_id: Optional[str] = None) -> str:
         """
@@ -24,11 +67,73 @@ class PathTools:
             candidate_data (Dict, optional): Datos del candidato para agregar/actualizar
             candidate_id (str, optional): ID del candidato para actualizaciones
         """
+        with track_stage('tool_ejecutar_spreadsheet_manager') as stage:
+            result = PathTools._run_spreadsheet(action, phone, candidate_data, candidate_id)
+            if '"status": "error"' in result:
+                stage.mark_error()
+            return result
+
+    @staticmethod
+    def get_candidate_state(phone: str) -> Optional[Dict[str, Any]]:
+        """
+        Estado del candidato como diccionario (caché o Sheets)
+
+        Returns:
+            Optional[Dict]: Registro con status found/not_found, o None si Sheets falló
+        """
+        result = json.loads(PathTools.run_def_spreadsheet(action="get_candidate", phone=phone))
+        return result if result.get("status") in ("found", "not_found") else None
+
+    @staticmethod
+    def _write_outcome(parsed: Dict[str, Any]):
+        """
+        (resultado, ID asignado) de un add/update según status y error_code de SpreadsheetManager
+        WRITE_REJECTED cuando reintentar no cambiaría nada (ID inexistente, datos o acción inválidos)
+        """
+        if parsed.get("status") == "exists":
+            return WRITE_OK, (parsed.get("candidate_info") or {}).get("id")
+        if parsed.get("status") == "success":
+            return WRITE_OK, parsed.get("candidate_id")
+        if parsed.get("error_code") in PERMANENT_ERRORS:
+            return WRITE_REJECTED, None
+        return WRITE_RETRY, None
+
+    @staticmethod
+    def sync_write(action: str, candidate_data: Dict[str, Any], candidate_id: Optional[str]) -> str:
+        """Reintenta en Sheets una escritura pendiente del store de sesiones (WRITE_OK, WRITE_RETRY o WRITE_REJECTED)"""
+        registro = _spreadsheet_manager()
+        if registro.worksheet is None:
+            return WRITE_RETRY
+        result = registro.run_spreadsheet_manager(action, candidate_data, candidate_id)
+        try:
+            outcome, _ = PathTools._write_outcome(json.loads(result))
+        except ValueError:
+            return WRITE_RETRY
+        return outcome
+
+    @staticmethod
+    def _candidate_fallback(phone: str) -> str:
+        """Sheets no respondió a tiempo: copia local vencida si existe, si no se sigue sin el registro"""
+        stale = session_store.candidate(phone, allow_stale=True)
+        if stale is not None:
+            TURN_FALLBACKS.labels(fallback='cached_candidate').inc()
+            logger.warning("⏱️ Sheets sin respuesta a tiempo, se usa la copia local del candidato")
+            return json.dumps(stale, ensure_ascii=False, indent=2)
+
+        TURN_FALLBACKS.labels(fallback='no_sheets').inc()
+        logger.warning("⏱️ Sheets sin respuesta a tiempo y sin copia local del candidato")
+        return json.dumps({
+            "status": "error",
+            "message": "Google Sheets no respondió a tiempo. Responde la consulta sin el registro del candidato."
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _run_spreadsheet(action: str, phone: Optional[str], candidate_data: Optional[Dict[str, Any]], candidate_id: Optional[str]) -> str:
         try:
             logger.info(f"🔧 Ejecutando spreadsheet - Acción: {action}")
-            logger.info(f"📞 Teléfono: {phone}")
-            logger.info(f"📋 Datos del candidato: {candidate_data}")
-            logger.info(f"🆔 ID del candidato: {candidate_id}")
+            logger.debug("📞 Teléfono: %s", phone)
+            logger.debug("📋 Datos del candidato: %s", candidate_data)
+            logger.debug("🆔 ID del candidato: %s", candidate_id)
             
             # Preparar candidate_data según la acción
             if action == "get_candidate":
@@ -53,11 +158,48 @@ class PathTools:
                     "message": f"Acción no válida: {action}"
                 })
             
+            # ✅ NUEVO: El estado del candidato se lee del store local de sesiones mientras esté vigente
+            if action == "get_candidate":
+                local = session_store.candidate(prepared_data.get("phone", ""))
+                if local is not None:
+                    logger.info("♻️ Candidato obtenido del store de sesiones")
+                    return json.dumps(local, ensure_ascii=False, indent=2)
+
             # Ejecutar con SpreadsheetManager
-            registro = SpreadsheetManager()
-            result = registro.run_spreadsheet_manager(action, prepared_data, candidate_id)
+            registro = _spreadsheet_manager()
+            if action == "get_candidate":
+                # ✅ NUEVO: La lectura se acota al tiempo del turno; las escrituras siempre se completan
+                try:
+                    result = run_bounded('sheets', registro.run_spreadsheet_manager, action, prepared_data, candidate_id)
+                except DeadlineExceeded:
+                    return PathTools._candidate_fallback(prepared_data.get("phone", ""))
+            else:
+                result = registro.run_spreadsheet_manager(action, prepared_data, candidate_id)
+
+            try:
+                parsed = json.loads(result)
+            except ValueError:
+                parsed = {}
+
+            if action == "get_candidate":
+                session_store.record_sheets_read(prepared_data.get("phone", ""), parsed)
+            else:
+                # Las escrituras se aplican al store local; si Sheets falló quedan pendientes de sincronizar
+                outcome, assigned_id = PathTools._write_outcome(parsed)
+                if outcome == WRITE_REJECTED:
+                    # Reintentar no lo arreglaría: no se aplica localmente ni queda pendiente
+                    logger.warning(f"⚠️ Sheets rechazó {action}: {parsed.get('message', '')}")
+                    return result
+                succeeded = outcome == WRITE_OK
+                session_store.record_write(
+                    prepared_data.get("phone") or phone_from_candidate_id(candidate_id),
+                    action,
+                    prepared_data,
+                    candidate_id or assigned_id,
+                    succeeded
+                )
             
-            logger.info(f"✅ Resultado del spreadsheet: {result[:200]}...")
+            logger.debug("✅ Resultado del spreadsheet: %s", result)
             return result
             
         except Exception as e:
@@ -88,9 +230,17 @@ class PathTools:
     @staticmethod
     def run_def_analyzer_cv(file_path: str, user_phone: str, user_name: Optional[str] = None) -> str:
         """Ejecuta el procesamiento de CV"""
+        with track_stage('tool_ejecutar_analyzer_cv') as stage:
+            result = PathTools._run_analyzer_cv(file_path, user_phone, user_name)
+            if not result.lstrip().startswith('{') or '"status": "error"' in result:
+                stage.mark_error()
+            return result
+
+    @staticmethod
+    def _run_analyzer_cv(file_path: str, user_phone: str, user_name: Optional[str]) -> str:
         try:
-            logger.info(f"📄 Procesando CV: {file_path} para {user_phone}")
-            procesamiento = CVProcessor()
+            logger.info(f"📄 Procesando CV (archivo {log_ref(file_path)}) para {user_phone}")
+            procesamiento = _cv_processor()
             return procesamiento.run_analizer_cv(file_path, user_phone, user_name)
         except Exception as e:
             logger.error(f"❌ Error en run_def_analyzer_cv: {e}")
@@ -109,9 +259,17 @@ class PathTools:
     @staticmethod
     def run_def_retriever(history_messages: List, question: str) -> str:
         """Ejecuta el retriever cuando el usuario requiere información del perfil del puesto o condiciones del trabajo"""
+        with track_stage('tool_ejecutar_retriever') as stage:
+            result = PathTools._run_retriever(history_messages, question)
+            if '"status": "error"' in result:
+                stage.mark_error()
+            return result
+
+    @staticmethod
+    def _run_retriever(history_messages: List, question: str) -> str:
         try:
             logger.info(f"🔍 Ejecutando retriever para pregunta: {question}")
-            retriever = AIBotTool()
+            retriever = _retriever()
             return retriever.run_retriever(history_messages, question)
         except Exception as e:
             logger.error(f"❌ Error en run_def_retriever: {e}")
@@ -11,6 +11,15 @@ from oauth2client.service_account import ServiceAccountCredentials
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from services.tracing import traced
+
+# ✅ NUEVO: Código de error de las escrituras (error_code en el JSON de respuesta)
+ERROR_NOT_FOUND = 'not_found'       # El ID a actualizar no existe en la hoja
+ERROR_INVALID = 'invalid_request'   # Faltan datos o la acción no existe
+ERROR_SHEETS = 'sheets_error'       # Falló la llamada a Google Sheets (transitorio)
+# Errores que no se arreglan reintentando la misma escritura
+PERMANENT_ERRORS = (ERROR_NOT_FOUND, ERROR_INVALID)
+
 # ✅ CAMBIO DRÁSTICO - Hacer TODOS los campos opcionales
 class SpreadsheetInput(BaseModel):
     action: str = Field(description="Acción a realizar")
@@ -34,6 +43,7 @@ class SpreadsheetManager(BaseTool):
         self.worksheet = None
         self._initialize_client()
     
+    @traced('sheets.initialize_client')
     def _initialize_client(self):
         """Inicializa el cliente de Google Sheets"""
         try:
@@ -46,6 +56,8 @@ class SpreadsheetManager(BaseTool):
                 self.credentials_file, scope
             )
             self.client = gspread.authorize(credentials)
+            # gspread no tiene timeout por defecto: una petición colgada bloqueaba el turno
+            self.client.set_timeout(float(os.getenv('SHEETS_REQUEST_TIMEOUT', '20')))
 
             # Abrir la hoja de cálculos
             spreadsheet = self.client.open_by_key(self.spreadsheet_id)
@@ -97,51 +109,59 @@ class SpreadsheetManager(BaseTool):
         return f'CAND_{phone}_{timestamp}'
     
     def _find_candidate_row(self, phone: str) -> Optional[int]:
-        """Busca la fila de un candidato por número de teléfono"""
-        try:
-            phone_column = self.worksheet.col_values(4) # Columna D (número Whatsapp)
-            for i, cell_value in enumerate(phone_column[1:], start=2): # Empezar desde la fila 2
-                if cell_value == phone:
-                    return i
-            return None
-        except Exception:
-            return None
-
-    def _add_candidate(self, candidate_data: Dict[str, Any]) -> str:
-        """Añade un nuevo candidato a la hoja"""
+        """
+        Busca la fila de un candidato por número de teléfono
+        None solo si la hoja respondió y no está; los errores de Sheets se propagan
+        (un error tomado por "no encontrado" haría registrar de nuevo a un candidato existente)
+        """
+        phone_column = self.worksheet.col_values(4) # Columna D (número Whatsapp)
+        for i, cell_value in enumerate(phone_column[1:], start=2): # Empezar desde la fila 2
+            if cell_value == phone:
+                return i
+        return None
+
+    @traced('sheets.add_candidate')
+    def _add_candidate(self, candidate_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Añade un nuevo candidato a la hoja (status success con candidate_id, o error con error_code)"""
         try:
             # Generar ID
             candidate_id = self._generate_candidate_id(candidate_data.get('phone', ''))
 
-            # Preparar datos de la fila
-            row_data = [
-                candidate_id,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                candidate_data.get('nombre_completo', ''),
-                candidate_data.get('phone', ''),
-                candidate_data.get('email', ''),
-                'Sí' if candidate_data.get('cv_received', False) else 'No',
-                candidate_data.get('cv_link', ''),
-                candidate_data.get('puesto_solicitado', 'Asesor de Ventas Call Center Movistar'),
-                candidate_data.get('fuente', 'Orgánico'),
-                candidate_data.get('comentarios', ''),
-                candidate_data.get('cumple_perfil', ''),
-                candidate_data.get('recomendado', ''),
-                'Inicial',
-                '',
-                'Clara (IA)'
-            ]
-
             # Añadir fila
-            self.worksheet.append_row(row_data)
+            self.worksheet.append_row(self._candidate_row(candidate_id, candidate_data))
 
-            return f'Candidato añadido exitosamente con ID: {candidate_id}'
+            return {
+                'status': 'success',
+                'message': f'Candidato añadido exitosamente con ID: {candidate_id}',
+                'candidate_id': candidate_id
+            }
 
         except Exception as e:
-            return f'Error añadiendo candidato: {str(e)}'
+            return {'status': 'error', 'message': f'Error añadiendo candidato: {str(e)}', 'error_code': ERROR_SHEETS}
+
+    def _candidate_row(self, candidate_id: str, candidate_data: Dict[str, Any]) -> List[Any]:
+        """Fila completa (columnas A-O) de un candidato nuevo"""
+        return [
+            candidate_id,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            candidate_data.get('nombre_completo', ''),
+            candidate_data.get('phone', ''),
+            candidate_data.get('email', ''),
+            'Sí' if candidate_data.get('cv_received', False) else 'No',
+            candidate_data.get('cv_link', ''),
+            candidate_data.get('puesto_solicitado', 'Asesor de Ventas Call Center Movistar'),
+            candidate_data.get('fuente', 'Orgánico'),
+            candidate_data.get('comentarios', ''),
+            candidate_data.get('cumple_perfil', ''),
+            candidate_data.get('recomendado', ''),
+            'Inicial',
+            '',
+            'Clara (IA)'
+        ]
 
-    def _update_candidate(self, candidate_id: str, candidate_data: Dict[str, Any]) -> str:
-        """Actualiza información de un candidato existente"""
+    @traced('sheets.update_candidate')
+    def _update_candidate(self, candidate_id: str, candidate_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Actualiza información de un candidato existente (status success, o error con error_code)"""
         try:
             # Buscar la fila del candidato por ID
             id_column = self.worksheet.col_values(1) # Columna ID
@@ -153,68 +173,129 @@ class SpreadsheetManager(BaseTool):
                     break
             
             if not row_number:
-                return f'Candidato con ID {candidate_id} no encontrado'
-            
-            # Actualizar campos específicos
-            updates = []
+                return {'status': 'error', 'message': f'Candidato con ID {candidate_id} no encontrado', 'error_code': ERROR_NOT_FOUND}
             
-            if 'cv_link' in candidate_data:
-                updates.append({
-                    'range': f'G{row_number}',
-                    'values': [[candidate_data['cv_link']]]
-                })
-                # ✅ CORRECCIÓN: Si se actualiza cv_link, cambiar cv_recibido a "Sí"
-                updates.append({
-                    'range': f'F{row_number}',  # Columna F es cv_recibido
-                    'values': [['Sí']]
-                })
-            
-            if 'comentarios' in candidate_data:
-                updates.append({
-                    'range': f'J{row_number}',
-                    'values': [[candidate_data['comentarios']]]
-                })
-            
-            if 'cumple_perfil' in candidate_data:
-                valor_cumple = 'Sí' if candidate_data['cumple_perfil'] else 'No'
-                updates.append({
-                    'range': f'K{row_number}',
-                    'values': [[valor_cumple]]
-                })
-
-            if 'recomendado' in candidate_data:
-                updates.append({
-                    'range': f'L{row_number}',
-                    'values': [['Sí' if candidate_data['recomendado'] else 'No']]
-                })
-            
-            if 'fase_proceso' in candidate_data:
-                updates.append({
-                    'range': f'M{row_number}',
-                    'values': [[candidate_data['fase_proceso']]]
-                })
-            
-            if 'evaluador' in candidate_data:
-                updates.append({
-                    'range': f'O{row_number}',
-                    'values': [[candidate_data['evaluador']]]
-                })
-                
-                # También actualizar fecha de evaluación
-                updates.append({
-                    'range': f'N{row_number}',
-                    'values': [[datetime.now().strftime("%Y-%m-%d %H:%M:%S")]]
-                })
+            updates = self._candidate_updates(row_number, candidate_data)
             
             # Ejecutar actualizaciones
             for update in updates:
                 self.worksheet.update(update['range'], update['values'])
             
-            return f"Candidato {candidate_id} actualizado exitosamente"
+            return {'status': 'success', 'message': f"Candidato {candidate_id} actualizado exitosamente", 'candidate_id': candidate_id}
+            
+        except Exception as e:
+            return {'status': 'error', 'message': f"Error actualizando candidato: {str(e)}", 'error_code': ERROR_SHEETS}
+
+    def _candidate_updates(self, row_number: int, candidate_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Celdas a actualizar de una fila existente según los campos presentes"""
+        updates = []
+        
+        if 'cv_link' in candidate_data:
+            updates.append({
+                'range': f'G{row_number}',
+                'values': [[candidate_data['cv_link']]]
+            })
+            # ✅ CORRECCIÓN: Si se actualiza cv_link, cambiar cv_recibido a "Sí"
+            updates.append({
+                'range': f'F{row_number}',  # Columna F es cv_recibido
+                'values': [['Sí']]
+            })
+        
+        if 'comentarios' in candidate_data:
+            updates.append({
+                'range': f'J{row_number}',
+                'values': [[candidate_data['comentarios']]]
+            })
+        
+        if 'cumple_perfil' in candidate_data:
+            valor_cumple = 'Sí' if candidate_data['cumple_perfil'] else 'No'
+            updates.append({
+                'range': f'K{row_number}',
+                'values': [[valor_cumple]]
+            })
+
+        if 'recomendado' in candidate_data:
+            updates.append({
+                'range': f'L{row_number}',
+                'values': [['Sí' if candidate_data['recomendado'] else 'No']]
+            })
+        
+        if 'fase_proceso' in candidate_data:
+            updates.append({
+                'range': f'M{row_number}',
+                'values': [[candidate_data['fase_proceso']]]
+            })
+        
+        if 'evaluador' in candidate_data:
+            updates.append({
+                'range': f'O{row_number}',
+                'values': [[candidate_data['evaluador']]]
+            })
             
+            # También actualizar fecha de evaluación
+            updates.append({
+                'range': f'N{row_number}',
+                'values': [[datetime.now().strftime("%Y-%m-%d %H:%M:%S")]]
+            })
+
+        return updates
+
+    # ✅ NUEVO: Escritura masiva (ingesta por lotes): una lectura de la hoja y dos llamadas de escritura
+    @traced('sheets.bulk_upsert_candidates')
+    def bulk_upsert_candidates(self, candidates: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Añade o actualiza varios candidatos a la vez
+
+        Los teléfonos que ya están en la hoja se actualizan (mismos campos que update_candidate) con un
+        solo batch_update; los nuevos se agregan con un solo append_rows. Si un teléfono se repite en
+        el lote, gana el último
+
+        Args:
+            candidates (List[Dict]): Datos con el mismo formato que add_candidate (phone obligatorio)
+
+        Returns:
+            Dict: teléfono -> {'status': 'added'|'updated'|'error', 'candidate_id', 'message'}
+        """
+        by_phone = {candidate['phone']: candidate for candidate in candidates if candidate.get('phone')}
+        if not by_phone:
+            return {}
+
+        try:
+            columns = self.worksheet.batch_get(['A2:A', 'D2:D'])
+            id_column = [row[0] if row else '' for row in columns[0]]
+            phone_column = [row[0] if row else '' for row in columns[1]]
+            existing = {}
+            for offset, phone in enumerate(phone_column):
+                if phone and phone not in existing:
+                    existing[phone] = (offset + 2, id_column[offset] if offset < len(id_column) else '')
+
+            results = {}
+            new_rows = []
+            updates = []
+            for phone, candidate_data in by_phone.items():
+                if phone in existing:
+                    row_number, candidate_id = existing[phone]
+                    updates.extend(self._candidate_updates(row_number, candidate_data))
+                    results[phone] = {'status': 'updated', 'candidate_id': candidate_id}
+                else:
+                    candidate_id = self._generate_candidate_id(phone)
+                    row_data = dict(candidate_data)
+                    if isinstance(row_data.get('cumple_perfil'), bool):
+                        row_data['cumple_perfil'] = 'Sí' if row_data['cumple_perfil'] else 'No'
+                    new_rows.append(self._candidate_row(candidate_id, row_data))
+                    results[phone] = {'status': 'added', 'candidate_id': candidate_id}
+
+            if updates:
+                self.worksheet.batch_update(updates)
+            if new_rows:
+                self.worksheet.append_rows(new_rows)
+            return results
+
         except Exception as e:
-            return f"Error actualizando candidato: {str(e)}"
+            message = f'Error en escritura masiva: {str(e)}'
+            return {phone: {'status': 'error', 'candidate_id': None, 'message': message} for phone in by_phone}
 
+    @traced('sheets.get_candidate')
     def _get_candidate(self, phone: str) -> Dict[str, Any]:
         """Obtiene información de un candidato por teléfono"""
         try:
@@ -248,7 +329,7 @@ class SpreadsheetManager(BaseTool):
             return candidate_info
         
         except Exception as e:
-            return {'status': 'error', 'message': f'Error obteniendo candidato: {str(e)}'}
+            return {'status': 'error', 'message': f'Error obteniendo candidato: {str(e)}', 'error_code': ERROR_SHEETS}
 
     def _run(self, action: str, candidate_data: Optional[Dict[str, Any]] = None, candidate_id: Optional[str] = None) -> str:
         """Método requerido por BaseTool - FORZANDO DEFAULTS"""
@@ -267,6 +348,9 @@ class SpreadsheetManager(BaseTool):
                 phone = candidate_data.get('phone', '')
                 existing = self._get_candidate(phone)
 
+                if existing.get('status') == 'error':
+                    # Sin saber si ya existe no se agrega (evita filas duplicadas)
+                    return json.dumps(existing, ensure_ascii=False, indent=2)
                 if existing.get('status') == 'found':
                     return json.dumps({
                         'status': 'exists',
@@ -275,30 +359,26 @@ class SpreadsheetManager(BaseTool):
                     }, ensure_ascii=False, indent=2)
                 else:
                     result = self._add_candidate(candidate_data)
-                    return json.dumps({
-                        'status': 'success',
-                        'message': result
-                    }, ensure_ascii=False, indent=2)
+                    return json.dumps(result, ensure_ascii=False, indent=2)
             
             elif action == 'update_candidate':
                 if not candidate_id:
                     return json.dumps({
                         'status': 'error',
-                        'message': 'ID de candidato requerido para actualización'
+                        'message': 'ID de candidato requerido para actualización',
+                        'error_code': ERROR_INVALID
                     }, ensure_ascii=False, indent=2)
                 
                 result = self._update_candidate(candidate_id, candidate_data)
-                return json.dumps({
-                    'status': 'success',
-                    'message': result
-                }, ensure_ascii=False, indent=2)
+                return json.dumps(result, ensure_ascii=False, indent=2)
             
             elif action == 'get_candidate':
                 phone = candidate_data.get('phone', '')
                 if not phone:
                     return json.dumps({
                         'status': 'error',
-                        'message': 'Número de teléfono requerido para búsqueda'
+                        'message': 'Número de teléfono requerido para búsqueda',
+                        'error_code': ERROR_INVALID
                     }, ensure_ascii=False, indent=2)
                 
                 result = self._get_candidate(phone)
@@ -307,12 +387,14 @@ class SpreadsheetManager(BaseTool):
             else:
                 return json.dumps({
                     'status': 'error',
-                    'message': f'Acción no válida: {action}'
+                    'message': f'Acción no válida: {action}',
+                    'error_code': ERROR_INVALID
                 }, ensure_ascii=False, indent=2)
         
         except Exception as e:
             error_result = {
                 'status': 'error',
-                'message': f'Error en SpreadsheetManager: {str(e)}'
+                'message': f'Error en SpreadsheetManager: {str(e)}',
+                'error_code': ERROR_SHEETS
             }
             return json.dumps(error_result, ensure_ascii=False, indent=2)
\ No newline at end of file
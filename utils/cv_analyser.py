@@ -1,17 +1,175 @@
 # Imports
 import os
 import json
-from typing import Optional, Dict, Any
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 from pathlib import Path
 
-import PyPDF2
-from docx import Document
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
 import shutil
 
+from utils.cv_cache import CVResultCache, file_sha256
+from utils.cv_sections import (CV_EVALUATION_TOKEN_BUDGET, CV_PROMPT_TOKEN_BUDGET, CV_SECTIONS_VERSION,
+                               EVALUATION_SECTIONS, EXTRACTION_SECTIONS, extract_contact, select_sections,
+                               split_sections)
+from utils.cv_text import TEXT_EXTRACTION_VERSION, extract_docx_text, extract_pdf_text
+from services.tracing import current_span, traced
+
+
+# Prompts del análisis de CV
+CV_EXTRACTION_MODEL = 'gpt-4o'
+PROFILE_EVALUATION_MODEL = 'gpt-4o-mini'
+
+CV_EXTRACTION_PROMPT = """
+        Analiza el siguiente CV y extrae la información en formato JSON:
+
+        CV Text:
+        {cv_text}
+
+        Extrae la siguiente información y devuelve solo el JSON:
+        {{
+            "nombre_completo": "nombre completo del candidato",
+            "email": "correo electrónico",
+            "telefono": "número de teléfono",
+            "experiencia_años": "años de experiencia aproximados",
+            "puesto_actual": "puesto o título actual",
+            "habilidades": ["lista", "de", "habilidades"],
+            "educacion": "nivel educativo más alto",
+            "idiomas": ["lista", "de", "idiomas"],
+            "ubicacion": "ciudad/país de residencia",
+            "resumen_profesional": "breve resumen en 2-3 líneas"
+        }}
+            """
+
+# ✅ NUEVO: Con pre-extracción local solo se piden al LLM los campos que las reglas no resolvieron
+CV_FIELDS = {
+    'nombre_completo': 'nombre completo del candidato',
+    'email': 'correo electrónico',
+    'telefono': 'número de teléfono',
+    'experiencia_años': 'años de experiencia aproximados',
+    'puesto_actual': 'puesto o título actual',
+    'habilidades': ['lista', 'de', 'habilidades'],
+    'educacion': 'nivel educativo más alto',
+    'idiomas': ['lista', 'de', 'idiomas'],
+    'ubicacion': 'ciudad/país de residencia',
+    'resumen_profesional': 'breve resumen en 2-3 líneas',
+}
+
+CV_SECTIONS_EXTRACTION_PROMPT = """
+        Analiza las secciones del siguiente CV y extrae la información en formato JSON.
+
+        Secciones del CV:
+        {cv_text}
+
+        Extrae la siguiente información y devuelve solo el JSON:
+        {fields}
+            """
+
+PROFILE_REQUIREMENTS = """
+        - Educación mínima: Secundaria completa
+        - Experiencia previa en ventas por call center o atención al cliente (deseable)
+        - Facilidad de comunicación, persuasión y orientación a resultados
+        - Manejo básico de computadoras y sistemas
+        - Disponibilidad para laborar presencial en Comas, Lima"""
+
+PROFILE_EVALUATION_PROMPT = """
+        Evalúa si este candidato cumple con el perfil para el puesto de "Asesor de Ventas Call Center Movistar".
+
+        REQUISITOS DEL PUESTO:""" + PROFILE_REQUIREMENTS + """
+
+        INFORMACIÓN DEL CANDIDATO:
+        Datos estructurados: {cv_info}
+        
+        Texto completo del CV: {cv_text}
+
+        Evalúa y responde SOLO con un JSON en este formato:
+        {{
+            "cumple_perfil": true o false,
+            "comentarios": "Justificación detallada de por qué cumple o no cumple el perfil, mencionando aspectos específicos como experiencia, educación, habilidades relevantes, etc."
+        }}
+        """
+
+# ✅ NUEVO: Extracción y evaluación en una sola llamada con salida estructurada (CV_ANALYSIS_MODE=fused)
+CV_FUSED_PROMPT = """
+        Analiza el siguiente CV de un postulante al puesto de "Asesor de Ventas Call Center Movistar".
+
+        REQUISITOS DEL PUESTO:""" + PROFILE_REQUIREMENTS + """
+
+        1. Extrae los datos del candidato tal como aparecen en el CV (usa "No especificado" si un dato no aparece).
+        2. Evalúa si cumple el perfil y justifica en "comentarios" mencionando aspectos específicos como experiencia, educación y habilidades relevantes.
+
+        CV Text:
+        {cv_text}
+        """
+
+# sequential: extracción y luego evaluación (2 latencias) | parallel: ambas a la vez | fused: una sola llamada
+CV_ANALYSIS_MODES = ('sequential', 'parallel', 'fused')
+CV_ANALYSIS_MODE = os.getenv('CV_ANALYSIS_MODE', 'sequential').lower()
+CV_FUSED_MODEL = os.getenv('CV_FUSED_MODEL', CV_EXTRACTION_MODEL)
+
+# ✅ NUEVO: Pre-extracción local (email, teléfono, nombre) y envío al LLM solo de las secciones necesarias
+CV_PREEXTRACTION = os.getenv('CV_PREEXTRACTION', 'true').lower() == 'true'
+# Sin pre-extracción la evaluación recibe los primeros caracteres del CV junto al JSON extraído
+EVALUATION_TEXT_CHARS = 2000
+
+# ✅ Versión del análisis: cambia si cambian prompts, modelos o CV_PROFILE_VERSION (invalida la caché)
+CV_ANALYSIS_VERSION = hashlib.sha1('|'.join([
+    os.getenv('CV_PROFILE_VERSION', '1'),
+    CV_EXTRACTION_MODEL,
+    PROFILE_EVALUATION_MODEL,
+    CV_EXTRACTION_PROMPT,
+    PROFILE_EVALUATION_PROMPT,
+    CV_ANALYSIS_MODE,
+    CV_FUSED_MODEL,
+    CV_FUSED_PROMPT,
+    CV_SECTIONS_EXTRACTION_PROMPT,
+    f'{CV_PREEXTRACTION}|{CV_SECTIONS_VERSION}|{CV_PROMPT_TOKEN_BUDGET}|{CV_EVALUATION_TOKEN_BUDGET}',
+]).encode('utf-8')).hexdigest()[:12]
+
+# Respuestas de respaldo: no deben guardarse en caché
+EXTRACTION_FALLBACK_SUMMARY = 'Error en extracción automática'
+
+# Clientes LLM compartidos por proceso (conservan el pool HTTP hacia OpenAI)
+@lru_cache(maxsize=None)
+def _get_chat_model(model: str):
+    from langchain_openai import ChatOpenAI
+    from services.deadline import LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT
+    from services.metrics import llm_metrics_callback
+    return ChatOpenAI(model=model, temperature=0, timeout=LLM_REQUEST_TIMEOUT, max_retries=LLM_MAX_RETRIES, callbacks=[llm_metrics_callback])
+
+@lru_cache(maxsize=None)
+def _get_structured_model(model: str):
+    return _get_chat_model(model).with_structured_output(CVAnalysis)
+
+# Hilos para lanzar extracción y evaluación a la vez (CV_ANALYSIS_MODE=parallel)
+_analysis_executor = ThreadPoolExecutor(max_workers=int(os.getenv('CV_ANALYSIS_WORKERS', '4')), thread_name_prefix='cv-analysis')
+
+def _submit(func, *args):
+    # Copiar el contexto para que las llamadas sigan la traza del turno
+    return _analysis_executor.submit(contextvars.copy_context().run, func, *args)
+
+@lru_cache(maxsize=None)
+def _get_result_cache() -> CVResultCache:
+    return CVResultCache()
+
+def _merge_contact(cv_info: Dict[str, Any], contact: Optional[Dict[str, Optional[str]]]) -> Dict[str, Any]:
+    """Los datos de contacto encontrados por reglas prevalecen sobre los del LLM"""
+    for field, value in (contact or {}).items():
+        if value:
+            cv_info[field] = value
+    return cv_info
+
+# Carpeta de entrada dentro del storage: mismo sistema de archivos, permite mover sin copiar
+def get_incoming_path() -> Path:
+    incoming_path = Path(os.getenv('CV_STORAGE_PATH', './cv_storage/')) / 'incoming'
+    incoming_path.mkdir(parents=True, exist_ok=True)
+    return incoming_path
 
 # Class (basemodel)
 
@@ -20,6 +178,21 @@ class CVProcessorInput(BaseModel):
     user_phone: str = Field(description = 'Número de teléfono del usuario')
     user_name: Optional[str] = Field(default = None, description = 'Nombre del usuario')
 
+class CVAnalysis(BaseModel):
+    """Salida estructurada del modo fused: datos del CV + evaluación del perfil"""
+    nombre_completo: str = Field(description='nombre completo del candidato')
+    email: str = Field(description='correo electrónico')
+    telefono: str = Field(description='número de teléfono')
+    experiencia_años: str = Field(description='años de experiencia aproximados')
+    puesto_actual: str = Field(description='puesto o título actual')
+    habilidades: List[str] = Field(description='lista de habilidades')
+    educacion: str = Field(description='nivel educativo más alto')
+    idiomas: List[str] = Field(description='lista de idiomas')
+    ubicacion: str = Field(description='ciudad/país de residencia')
+    resumen_profesional: str = Field(description='breve resumen en 2-3 líneas')
+    cumple_perfil: bool = Field(description='si cumple con el perfil del puesto')
+    comentarios: str = Field(description='justificación de por qué cumple o no cumple el perfil')
+
 # Class (basetool)
 
 class CVProcessor(BaseTool):
@@ -35,32 +208,46 @@ class CVProcessor(BaseTool):
         self.storage_path.mkdir(exist_ok=True) # Ese exist_ok=True: En caso exista, siga la ejecución normalmente
 
 # Función extract text from pdf
-# estoy usando el PyPDF2
+# ✅ Backend configurable (pypdf por defecto), límite de páginas y pool de procesos para PDFs largos
+    @traced('cv.extract_text_pdf')
     def _extract_text_from_pdf(self, file_path: str) -> str:
         """Extrae texto de un archivo PDF"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ''
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + '\n'
-                return text.strip()
+            return extract_pdf_text(file_path)
         except Exception as e:
             raise Exception(f'Error al leer PDF: {str(e)}')
 
 # Función extract text from docx
+    @traced('cv.extract_text_docx')
     def _extract_text_from_docx(self, file_path: str) -> str:
         """Extrae texto de un archivo Word"""
         try:
-            doc = Document(file_path)
-            text = ''
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + '\n'
-            return text.strip()
+            return extract_docx_text(file_path)
         except Exception as e:
             raise Exception(f'Error al leer Word: {str(e)}')
 
+    # ✅ NUEVO: Texto extraído en caché por hash del archivo (sobrevive a cambios de prompt o modelo)
+    def _extract_text(self, file_path: str, file_extension: str, file_hash: str) -> str:
+        """Devuelve el texto del CV desde la caché o extrayéndolo del archivo"""
+        cache = _get_result_cache()
+        cached = cache.get('text', file_hash, TEXT_EXTRACTION_VERSION)
+        if cached:
+            return cached['cv_text']
+
+        if file_extension == '.pdf':
+            cv_text = self._extract_text_from_pdf(file_path)
+        else:
+            cv_text = self._extract_text_from_docx(file_path)
+
+        if cv_text:
+            cache.set('text', file_hash, TEXT_EXTRACTION_VERSION, {
+                'cv_text': cv_text,
+                'created_at': datetime.now().isoformat()
+            })
+        return cv_text
+
 # Función save cv file - MODIFICADA para generar URL
+    @traced('cv.save_file')
     def _save_cv_file(self, original_path: str, user_phone: str) -> Dict[str, str]:
         """Guarda el CV en el directorio de almacenamiento y genera la URL"""
         original_file = Path(original_path)
@@ -69,8 +256,16 @@ class CVProcessor(BaseTool):
         new_filename = f'CV_{user_phone}_{timestamp}{file_extension}'
         new_path = self.storage_path / new_filename
 
-        # Copiar archivo
-        shutil.copy2(original_path, new_path)
+        # Archivos que ya están en el storage (ej. ingesta por lotes de cv_storage) se dejan donde están
+        if original_file.resolve().parent == self.storage_path.resolve():
+            new_filename = original_file.name
+            new_path = original_file
+        # ✅ Archivos descargados a la carpeta de entrada se mueven (rename atómico, sin segunda copia)
+        elif original_file.resolve().parent == get_incoming_path().resolve():
+            os.replace(original_path, new_path)
+        else:
+            # Archivos externos (ej. carga manual) se copian para no alterar el original
+            shutil.copy2(original_path, new_path)
 
         # ✅ NUEVO: Generar URL para descarga
         # En un entorno real, esto podría ser una URL del servidor web
@@ -86,49 +281,41 @@ class CVProcessor(BaseTool):
         }
 
 # Función  extract cv info
-    def _extract_cv_info(self, cv_text: str) -> Dict[str, Any]:
-        """Extrae información estructurada del CV usando Langchain/OpenAI"""
-        from langchain_openai import ChatOpenAI
+    @traced('cv.extract_info')
+    def _extract_cv_info(self, cv_text: str, contact: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, Any]:
+        """
+        Extrae información estructurada del CV usando Langchain/OpenAI
+
+        Args:
+            cv_text (str): Texto del CV (completo, o las secciones elegidas si hay contact)
+            contact (Dict): Datos de la pre-extracción local; los encontrados no se piden al LLM
+        """
         from langchain.prompts import ChatPromptTemplate
 
-        llm = ChatOpenAI(model= 'gpt-4o', temperature = 0)
-
-        prompt = ChatPromptTemplate.from_template("""
-        Analiza el siguiente CV y extrae la información en formato JSON:
-
-        CV Text:
-        {cv_text}
+        llm = _get_chat_model(CV_EXTRACTION_MODEL)
 
-        Extrae la siguiente información y devuelve solo el JSON:
-        {{
-            "nombre_completo": "nombre completo del candidato",
-            "email": "correo electrónico",
-            "telefono": "número de teléfono",
-            "experiencia_años": "años de experiencia aproximados",
-            "puesto_actual": "puesto o título actual",
-            "habilidades": ["lista", "de", "habilidades"],
-            "educacion": "nivel educativo más alto",
-            "idiomas": ["lista", "de", "idiomas"],
-            "ubicacion": "ciudad/país de residencia",
-            "resumen_profesional": "breve resumen en 2-3 líneas"
-        }}
-            """
-        )
+        if contact is None:
+            prompt = ChatPromptTemplate.from_template(CV_EXTRACTION_PROMPT)
+            inputs = {'cv_text': cv_text}
+        else:
+            fields = {field: description for field, description in CV_FIELDS.items() if not contact.get(field)}
+            prompt = ChatPromptTemplate.from_template(CV_SECTIONS_EXTRACTION_PROMPT)
+            inputs = {'cv_text': cv_text, 'fields': json.dumps(fields, ensure_ascii=False)}
 
         chain = prompt | llm
-        response = chain.invoke({'cv_text': cv_text})
+        response = chain.invoke(inputs)
 
         try:
             # Intentar parsear JSON de la respuesta
             import re
             json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
             if json_match:
-                return json.loads(json_match.group())
+                return _merge_contact(json.loads(json_match.group()), contact)
             else:
                 raise ValueError('No se encontró JSON válido en la respuesta')
         except Exception as e:
-            # Si falla el parsing, devolver estructura básica
-            return {
+            # Si falla el parsing, devolver estructura básica (con los datos de contacto ya conocidos)
+            return _merge_contact({
                 "nombre_completo": "No extraído",
                 "email": "No extraído",
                 "telefono": "No extraído",
@@ -138,45 +325,32 @@ class CVProcessor(BaseTool):
                 "educacion": "No especificado",
                 "idiomas": [],
                 "ubicacion": "No especificado",
-                "resumen_profesional": "Error en extracción automática"
-            }
+                "resumen_profesional": EXTRACTION_FALLBACK_SUMMARY
+            }, contact)
 
     # ✅ NUEVA FUNCIÓN: Evaluar si cumple el perfil
-    def _evaluate_profile_match(self, cv_info: Dict[str, Any], cv_text: str) -> Dict[str, Any]:
+    @traced('cv.evaluate_profile')
+    def _evaluate_profile_match(self, cv_info: Optional[Dict[str, Any]], cv_text: str) -> Dict[str, Any]:
         """Evalúa si el candidato cumple con el perfil del puesto"""
-        from langchain_openai import ChatOpenAI
         from langchain.prompts import ChatPromptTemplate
 
-        llm = ChatOpenAI(model='gpt-4o-mini', temperature=0)
-
-        prompt = ChatPromptTemplate.from_template("""
-        Evalúa si este candidato cumple con el perfil para el puesto de "Asesor de Ventas Call Center Movistar".
-
-        REQUISITOS DEL PUESTO:
-        - Educación mínima: Secundaria completa
-        - Experiencia previa en ventas por call center o atención al cliente (deseable)
-        - Facilidad de comunicación, persuasión y orientación a resultados
-        - Manejo básico de computadoras y sistemas
-        - Disponibilidad para laborar presencial en Comas, Lima
+        llm = _get_chat_model(PROFILE_EVALUATION_MODEL)
 
-        INFORMACIÓN DEL CANDIDATO:
-        Datos estructurados: {cv_info}
-        
-        Texto completo del CV: {cv_text}
-
-        Evalúa y responde SOLO con un JSON en este formato:
-        {{
-            "cumple_perfil": true o false,
-            "comentarios": "Justificación detallada de por qué cumple o no cumple el perfil, mencionando aspectos específicos como experiencia, educación, habilidades relevantes, etc."
-        }}
-        """)
+        prompt = ChatPromptTemplate.from_template(PROFILE_EVALUATION_PROMPT)
 
         try:
             chain = prompt | llm
-            response = chain.invoke({
-                'cv_info': json.dumps(cv_info, ensure_ascii=False),
-                'cv_text': cv_text[:2000]  # Limitar texto para evitar tokens excesivos
-            })
+            if cv_info is None:
+                # Modo parallel: aún no hay datos estructurados, se evalúa con el texto completo
+                response = chain.invoke({
+                    'cv_info': 'No disponibles, evalúa con el texto completo del CV',
+                    'cv_text': cv_text
+                })
+            else:
+                response = chain.invoke({
+                    'cv_info': json.dumps(cv_info, ensure_ascii=False),
+                    'cv_text': cv_text  # Ya limitado por _prepare_cv_text para evitar tokens excesivos
+                })
 
             # Parsear respuesta JSON
             import re
@@ -198,11 +372,112 @@ class CVProcessor(BaseTool):
                 'comentarios': f'Error evaluando perfil: {str(e)}'
             }
         
+    # ✅ NUEVO: Extracción y evaluación en una sola llamada con salida estructurada
+    @traced('cv.analyze_fused')
+    def _analyze_cv_fused(self, cv_text: str, contact: Optional[Dict[str, Optional[str]]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Una llamada devuelve datos y evaluación: el texto del CV se envía (y se paga) una sola vez"""
+        from langchain.prompts import ChatPromptTemplate
+
+        chain = ChatPromptTemplate.from_template(CV_FUSED_PROMPT) | _get_structured_model(CV_FUSED_MODEL)
+        cv_info = _merge_contact(chain.invoke({'cv_text': cv_text}).model_dump(), contact)
+        evaluation = {
+            'cumple_perfil': cv_info.pop('cumple_perfil'),
+            'comentarios': cv_info.pop('comentarios')
+        }
+        return cv_info, evaluation
+
+    # ✅ NUEVO: Pre-extracción local y selección de secciones bajo presupuesto de tokens
+    @traced('cv.prepare_text')
+    def _prepare_cv_text(self, cv_text: str, preextraction: Optional[bool] = None) -> Tuple[Optional[Dict[str, Optional[str]]], str, str]:
+        """
+        Prepara el texto que recibe cada llamada al LLM
+
+        Returns:
+            Tuple: (datos de contacto o None, texto para la extracción, texto para la evaluación)
+        """
+        preextraction = CV_PREEXTRACTION if preextraction is None else preextraction
+        if not preextraction:
+            return None, cv_text, cv_text[:EVALUATION_TEXT_CHARS]
+
+        contact = extract_contact(cv_text)
+        sections = split_sections(cv_text)
+        extraction_text = select_sections(cv_text, EXTRACTION_SECTIONS, CV_PROMPT_TOKEN_BUDGET, sections, contact)
+        evaluation_text = select_sections(cv_text, EVALUATION_SECTIONS, CV_EVALUATION_TOKEN_BUDGET, sections)
+
+        active = current_span()
+        if active is not None:
+            active.set_attribute('sections', ','.join(sections))
+            active.set_attribute('contact_found', ','.join(field for field, value in contact.items() if value))
+            active.set_attribute('chars_in', len(cv_text))
+            active.set_attribute('chars_out', len(extraction_text))
+        return contact, extraction_text, evaluation_text
+
+    def _analyze_cv(self, cv_text: str, mode: Optional[str] = None,
+                    preextraction: Optional[bool] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Extrae la información del CV y evalúa el perfil según CV_ANALYSIS_MODE
+
+        Returns:
+            Tuple: (cv_info, evaluación del perfil)
+        """
+        mode = mode or CV_ANALYSIS_MODE
+        contact, extraction_text, evaluation_text = self._prepare_cv_text(cv_text, preextraction)
+        if mode == 'fused':
+            try:
+                return self._analyze_cv_fused(extraction_text, contact)
+            except Exception:
+                # Salida estructurada inválida o rechazada: se usa el flujo de dos llamadas
+                mode = 'sequential'
+
+        if mode == 'parallel':
+            # Sin JSON previo la evaluación recibe el mismo texto que la extracción
+            extraction = _submit(self._extract_cv_info, extraction_text, contact)
+            evaluation = _submit(self._evaluate_profile_match, None, extraction_text)
+            return extraction.result(), evaluation.result()
+
+        cv_info = self._extract_cv_info(extraction_text, contact)
+        return cv_info, self._evaluate_profile_match(cv_info, evaluation_text)
+
+    def analyze_file(self, file_path: str, file_extension: str, file_hash: str,
+                     cv_text: Optional[str] = None) -> Tuple[str, Dict[str, Any], Dict[str, Any], bool]:
+        """
+        Análisis del CV con la caché de resultados por hash del archivo
+
+        Args:
+            cv_text (str): Texto ya extraído (ej. en el pool de la ingesta por lotes); si falta se extrae
+
+        Returns:
+            Tuple: (texto del CV, cv_info, evaluación del perfil, si vino de la caché)
+        """
+        cache = _get_result_cache()
+        cached = cache.get('analysis', file_hash, CV_ANALYSIS_VERSION)
+        if cached:
+            return cached['cv_text'], dict(cached['cv_info']), cached['evaluation'], True
+
+        if cv_text is None:
+            cv_text = self._extract_text(file_path, file_extension, file_hash)
+
+        # Extraer información del CV y evaluar si cumple el perfil (CV_ANALYSIS_MODE)
+        cv_info, profile_evaluation = self._analyze_cv(cv_text)
+
+        # Guardar solo resultados completos (no las respuestas de respaldo por error)
+        extraction_ok = cv_info.get('resumen_profesional') != EXTRACTION_FALLBACK_SUMMARY
+        evaluation_ok = not profile_evaluation['comentarios'].startswith('Error ')
+        if extraction_ok and evaluation_ok:
+            cache.set('analysis', file_hash, CV_ANALYSIS_VERSION, {
+                'cv_text': cv_text,
+                'cv_info': cv_info,
+                'evaluation': profile_evaluation,
+                'created_at': datetime.now().isoformat()
+            })
+        return cv_text, cv_info, profile_evaluation, False
+
     def _run(self, file_path: str, user_phone: str, user_name: Optional[str] = None) -> str:
         """Método requerido por BaseTool"""
         return self.run_analizer_cv(file_path, user_phone, user_name)
 
 # Función run - MODIFICADA
+    @traced('cv.run_analyzer')
     def run_analizer_cv(self, file_path: str, user_phone: str, user_name: Optional[str] = None) -> str:
         """Ejecuta el procesamiento del CV"""
         try:
@@ -213,21 +488,15 @@ class CVProcessor(BaseTool):
             # Determinar el tipo de archivo
             file_extension = Path(file_path).suffix.lower()
 
-            if file_extension == '.pdf':
-                cv_text = self._extract_text_from_pdf(file_path)
-            elif file_extension in ['.docx', '.doc']:
-                cv_text = self._extract_text_from_docx(file_path)
-            else:
+            if file_extension not in ['.pdf', '.docx', '.doc']:
                 return f'Error: Formato de archivo no soportado ({file_extension}). Solo PDF y Word'
+
+            # ✅ NUEVO: Buscar análisis previo del mismo archivo (CV reenviado)
+            file_hash = file_sha256(file_path)
+            cv_text, cv_info, profile_evaluation, cached = self.analyze_file(file_path, file_extension, file_hash)
             
             # ✅ MODIFICADO: Guardar archivo CV y obtener URL
             save_result = self._save_cv_file(file_path, user_phone)
-
-            # Extraer información del CV
-            cv_info = self._extract_cv_info(cv_text)
-            
-            # ✅ NUEVO: Evaluar si cumple el perfil
-            profile_evaluation = self._evaluate_profile_match(cv_info, cv_text)
             
             # Completar información del CV
             cv_info['cv_file_path'] = save_result['file_path']
@@ -246,6 +515,7 @@ class CVProcessor(BaseTool):
                 'status': 'success',
                 'message': 'CV procesado exitosamente',
                 'cv_info': cv_info,
+                'cached': bool(cached),
                 'cv_text_preview': cv_text[:500] + "..." if len(cv_text) > 500 else cv_text
             }
 
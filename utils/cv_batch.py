@@ -0,0 +1,395 @@
+# cv_batch.py - Ingesta por lotes de CVs desde una carpeta (línea de comandos)
+#
+# Uso (desde la raíz del proyecto):
+#   python -m utils.cv_batch ./cvs_recibidos
+#   python -m utils.cv_batch ./cv_storage --llm-concurrency 8 --recursive
+#   python -m utils.cv_batch ./cvs_recibidos --dry-run
+#
+# Extrae el texto en un pool de procesos, analiza cada CV con CVProcessor (mismas cachés y
+# CV_ANALYSIS_MODE que el bot) con un número acotado de CVs en análisis a la vez y escribe los
+# candidatos en Google Sheets por lotes. El manifiesto (JSONL) registra cada archivo terminado:
+# al volver a ejecutar sobre la misma carpeta se saltan los ya procesados.
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.cv_cache import CVResultCache, file_sha256
+from utils.cv_text import TEXT_EXTRACTION_VERSION, extract_docx_text, extract_pdf_text
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.doc')
+# CVs en análisis a la vez (cada uno hace 1 o 2 llamadas según CV_ANALYSIS_MODE)
+BATCH_LLM_CONCURRENCY = int(os.getenv('CV_BATCH_LLM_CONCURRENCY', '4'))
+BATCH_EXTRACT_WORKERS = int(os.getenv('CV_BATCH_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# Candidatos por escritura masiva en Sheets
+BATCH_WRITE_SIZE = int(os.getenv('CV_BATCH_WRITE_SIZE', '25'))
+MANIFEST_NAME = '.cv_batch_manifest.jsonl'
+
+STORAGE_FILENAME_PATTERN = re.compile(r'^CV_\+?(\d{9,15})_\d{8}_\d{6}$')
+
+
+class BatchManifest:
+    """
+    Registro append-only (JSONL) de los archivos ya procesados
+    Cada línea es un archivo terminado; si un archivo aparece varias veces gana la última línea
+    Con persist=False (--dry-run) se lee pero las entradas nuevas quedan solo en memoria
+    """
+
+    def __init__(self, path: Path, persist: bool = True):
+        self.path = path
+        self.persist = persist
+        self._lock = threading.Lock()
+        self.by_hash: Dict[str, Dict[str, Any]] = {}
+        self.by_path: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # línea cortada por una interrupción
+                    self.by_hash[entry['sha256']] = entry
+                    self.by_path[entry['path']] = entry
+
+    def finished(self, file_path: Path) -> bool:
+        """El archivo (misma ruta, tamaño y fecha de modificación) ya terminó en una ejecución anterior"""
+        entry = self.by_path.get(str(file_path))
+        if entry is None or entry['status'] == 'error':
+            return False
+        stat = file_path.stat()
+        return entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime
+
+    def duplicate_of(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Entrada terminada con el mismo contenido (CV repetido con otro nombre)"""
+        entry = self.by_hash.get(file_hash)
+        return entry if entry is not None and entry['status'] != 'error' else None
+
+    def record(self, file_path: Path, file_hash: str, status: str, **fields) -> None:
+        stat = file_path.stat() if file_path.exists() else None
+        entry = {
+            'path': str(file_path),
+            'sha256': file_hash,
+            'size': stat.st_size if stat else None,
+            'mtime': stat.st_mtime if stat else None,
+            'status': status,
+            'at': datetime.now().isoformat(),
+            **fields,
+        }
+        with self._lock:
+            if self.persist:
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.by_hash[file_hash] = entry
+            self.by_path[entry['path']] = entry
+
+
+def scan_directory(directory: Path, recursive: bool = False) -> List[Path]:
+    """CVs de la carpeta, sin la carpeta de entrada del bot ni directorios ocultos (caché)"""
+    pattern = '**/*' if recursive else '*'
+    files = []
+    for path in directory.glob(pattern):
+        relative = path.relative_to(directory).parts
+        if any(part.startswith('.') or part == 'incoming' for part in relative[:-1]):
+            continue
+        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS and not path.name.startswith('.'):
+            files.append(path)
+    return sorted(files)
+
+
+@lru_cache(maxsize=1)
+def _worker_cache() -> CVResultCache:
+    return CVResultCache()
+
+
+def _extract_worker(file_path: str) -> Tuple[str, str, str, float]:
+    """
+    Hash y texto de un CV (se ejecuta en el pool de procesos)
+    Usa la misma caché de texto que CVProcessor, así el bot no vuelve a leer estos archivos
+    """
+    start = time.perf_counter()
+    file_hash = file_sha256(file_path)
+    cache = _worker_cache()
+    cached = cache.get('text', file_hash, TEXT_EXTRACTION_VERSION)
+    if cached:
+        return file_path, file_hash, cached['cv_text'], time.perf_counter() - start
+
+    if file_path.lower().endswith('.pdf'):
+        # Sin pool anidado: el lote ya reparte los archivos entre procesos
+        cv_text = extract_pdf_text(file_path, parallel_min_pages=0)
+    else:
+        cv_text = extract_docx_text(file_path)
+    if cv_text:
+        cache.set('text', file_hash, TEXT_EXTRACTION_VERSION, {
+            'cv_text': cv_text,
+            'created_at': datetime.now().isoformat()
+        })
+    return file_path, file_hash, cv_text, time.perf_counter() - start
+
+
+def candidate_phone(file_path: Path, cv_info: Dict[str, Any]) -> Optional[str]:
+    """
+    Teléfono del candidato en el formato de WhatsApp del bot (51987654321)
+    Primero el del nombre de archivo del storage (CV_{telefono}_{fecha}), luego el del CV
+    """
+    match = STORAGE_FILENAME_PATTERN.match(file_path.stem)
+    if match:
+        return match.group(1)
+    digits = re.sub(r'\D', '', str(cv_info.get('telefono') or ''))
+    if len(digits) == 9 and digits.startswith('9'):
+        return '51' + digits
+    if len(digits) == 11 and digits.startswith('519'):
+        return digits
+    return None
+
+
+class BatchIngestion:
+    """Orquesta extracción (procesos), análisis (hilos acotados) y escrituras por lotes"""
+
+    def __init__(self, directory: Path, manifest_path: Optional[Path] = None, llm_concurrency: int = BATCH_LLM_CONCURRENCY,
+                 extract_workers: int = BATCH_EXTRACT_WORKERS, write_size: int = BATCH_WRITE_SIZE,
+                 fuente: str = 'Orgánico', dry_run: bool = False, recursive: bool = False):
+        from utils.cv_analyser import CVProcessor
+
+        self.directory = directory
+        self.manifest = BatchManifest(manifest_path or directory / MANIFEST_NAME, persist=not dry_run)
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.extract_workers = max(1, extract_workers)
+        self.write_size = max(1, write_size)
+        self.fuente = fuente
+        self.dry_run = dry_run
+        self.recursive = recursive
+        self.processor = CVProcessor()
+        self.sheets = None
+        self.pending_writes: List[Dict[str, Any]] = []
+        self.counts = {status: 0 for status in ('added', 'updated', 'pending', 'analyzed', 'duplicate', 'no_phone', 'error', 'skipped')}
+        self.cached_analyses = 0
+        self.extract_seconds: List[float] = []
+        self.analysis_seconds: List[float] = []
+        self.done = 0
+        self.total = 0
+
+    def _progress(self, file_path: Path, message: str) -> None:
+        self.done += 1
+        print(f"[{self.done}/{self.total}] {file_path.name}: {message}", flush=True)
+
+    def _analyze(self, file_path: Path, file_hash: str, cv_text: str) -> Dict[str, Any]:
+        """Análisis de un CV (en el pool de hilos acotado por llm_concurrency)"""
+        start = time.perf_counter()
+        _, cv_info, evaluation, cached = self.processor.analyze_file(str(file_path), file_path.suffix.lower(), file_hash, cv_text)
+        phone = candidate_phone(file_path, cv_info)
+        result = {'cv_info': cv_info, 'evaluation': evaluation, 'cached': cached, 'phone': phone}
+        if phone and not self.dry_run:
+            result['saved'] = self.processor._save_cv_file(str(file_path), phone)
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def _candidate_data(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        cv_info, evaluation = result['cv_info'], result['evaluation']
+        return {
+            'phone': result['phone'],
+            'nombre_completo': cv_info.get('nombre_completo', ''),
+            'email': cv_info.get('email', ''),
+            'cv_received': True,
+            'cv_link': result['saved']['cv_url'],
+            'fuente': self.fuente,
+            'comentarios': evaluation['comentarios'],
+            'cumple_perfil': evaluation['cumple_perfil'],
+        }
+
+    def _flush(self) -> None:
+        """Escritura masiva en Sheets; lo que no se pudo escribir queda pendiente en el store de sesiones"""
+        if not self.pending_writes:
+            return
+        from services.session_store import session_store
+
+        batch, self.pending_writes = self.pending_writes, []
+        candidates = [item['candidate_data'] for item in batch]
+        results = self.sheets.bulk_upsert_candidates(candidates) if self.sheets is not None else {}
+
+        for item in batch:
+            phone = item['candidate_data']['phone']
+            outcome = results.get(phone, {'status': 'error', 'candidate_id': None,
+                                          'message': 'Google Sheets no disponible'})
+            succeeded = outcome['status'] in ('added', 'updated')
+            action = 'update_candidate' if outcome['status'] == 'updated' else 'add_candidate'
+            # El sincronizador del bot reintenta las escrituras pendientes (ver session_store)
+            session_store.record_write(phone, action, item['candidate_data'], outcome.get('candidate_id'), succeeded)
+            status = outcome['status'] if succeeded else 'pending'
+            self.counts[status] += 1
+            self.manifest.record(item['file_path'], item['file_hash'], 'done', phone=phone, sheets=status,
+                                 candidate_id=outcome.get('candidate_id'), cumple_perfil=item['candidate_data']['cumple_perfil'])
+        print(f"  ↳ Sheets: {len(batch)} candidatos escritos por lote "
+              f"({sum(1 for item in batch if results.get(item['candidate_data']['phone'], {}).get('status') in ('added', 'updated'))} confirmados)",
+              flush=True)
+
+    def _handle_analysis(self, file_path: Path, file_hash: str, result: Dict[str, Any]) -> None:
+        self.analysis_seconds.append(result['seconds'])
+        self.cached_analyses += result['cached']
+        verdict = 'cumple' if result['evaluation']['cumple_perfil'] else 'no cumple'
+        source = 'caché' if result['cached'] else f"{result['seconds']:.1f}s"
+
+        if result['phone'] is None:
+            self.counts['no_phone'] += 1
+            self.manifest.record(file_path, file_hash, 'no_phone', nombre=result['cv_info'].get('nombre_completo'),
+                                 email=result['cv_info'].get('email'))
+            self._progress(file_path, f"⚠️ sin teléfono en el CV, no se registra ({verdict}, {source})")
+            return
+        if self.dry_run:
+            self.counts['analyzed'] += 1
+            self.manifest.record(file_path, file_hash, 'analyzed', phone=result['phone'],
+                                 cumple_perfil=result['evaluation']['cumple_perfil'])
+            self._progress(file_path, f"✅ {result['phone']} ({verdict}, {source}, sin escribir)")
+            return
+
+        self.pending_writes.append({'file_path': file_path, 'file_hash': file_hash,
+                                    'candidate_data': self._candidate_data(result)})
+        self._progress(file_path, f"✅ {result['phone']} ({verdict}, {source})")
+        if len(self.pending_writes) >= self.write_size:
+            self._flush()
+
+    def _handle_error(self, file_path: Path, file_hash: Optional[str], stage: str, error: Exception) -> None:
+        self.counts['error'] += 1
+        self.manifest.record(file_path, file_hash or '', 'error', stage=stage, error=str(error))
+        self._progress(file_path, f"❌ error en {stage}: {error}")
+
+    def run(self) -> Dict[str, Any]:
+        files = scan_directory(self.directory, self.recursive)
+        pending_files = [path for path in files if not self.manifest.finished(path)]
+        self.counts['skipped'] = len(files) - len(pending_files)
+        self.total = len(pending_files)
+        print(f"{len(files)} CVs en {self.directory} ({self.counts['skipped']} ya procesados según el manifiesto)", flush=True)
+
+        if not self.dry_run and pending_files:
+            from tools_completo import _spreadsheet_manager
+            manager = _spreadsheet_manager()
+            self.sheets = manager if manager.worksheet is not None else None
+            if self.sheets is None:
+                print("⚠️ Google Sheets no disponible: los candidatos quedan pendientes en el store de sesiones", flush=True)
+
+        from langchain_core.callbacks import get_usage_metadata_callback
+
+        start = time.perf_counter()
+        with get_usage_metadata_callback() as usage, \
+                ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=multiprocessing.get_context('spawn')) as extractors, \
+                ThreadPoolExecutor(max_workers=self.llm_concurrency, thread_name_prefix='cv-batch') as analyzers:
+            futures = {extractors.submit(_extract_worker, str(path)): ('extract', path, None) for path in pending_files}
+            while futures:
+                completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    stage, file_path, file_hash = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self._handle_error(file_path, file_hash, 'extracción' if stage == 'extract' else 'análisis', e)
+                        continue
+
+                    if stage == 'analyze':
+                        self._handle_analysis(file_path, file_hash, result)
+                        continue
+
+                    _, file_hash, cv_text, seconds = result
+                    self.extract_seconds.append(seconds)
+                    duplicate = self.manifest.duplicate_of(file_hash)
+                    if duplicate is not None:
+                        self.counts['duplicate'] += 1
+                        self.manifest.record(file_path, file_hash, 'duplicate', original=duplicate['path'])
+                        self._progress(file_path, f"↩️ mismo contenido que {Path(duplicate['path']).name}")
+                        continue
+                    if not cv_text:
+                        self._handle_error(file_path, file_hash, 'extracción', ValueError('el archivo no tiene texto extraíble'))
+                        continue
+                    # Copiar el contexto para que el callback de uso cuente los tokens de los hilos
+                    analysis = analyzers.submit(contextvars.copy_context().run, self._analyze, file_path, file_hash, cv_text)
+                    futures[analysis] = ('analyze', file_path, file_hash)
+            self._flush()
+            elapsed = time.perf_counter() - start
+            usage_by_model = dict(usage.usage_metadata)
+
+        return self._summary(elapsed, usage_by_model)
+
+    def _summary(self, elapsed: float, usage_by_model: Dict[str, Any]) -> Dict[str, Any]:
+        from services.llm_usage import estimate_cost
+
+        prompt_tokens = sum(usage.get('input_tokens', 0) for usage in usage_by_model.values())
+        completion_tokens = sum(usage.get('output_tokens', 0) for usage in usage_by_model.values())
+        cost = sum(estimate_cost(model, usage.get('input_tokens', 0), usage.get('output_tokens', 0),
+                                 (usage.get('input_token_details') or {}).get('cache_read') or 0)
+                   for model, usage in usage_by_model.items())
+        processed = self.total
+        summary = {
+            **self.counts,
+            'processed': processed,
+            'cached_analyses': self.cached_analyses,
+            'elapsed_seconds': round(elapsed, 2),
+            'cvs_per_minute': round(processed / elapsed * 60, 1) if elapsed and processed else 0.0,
+            'mean_extract_seconds': round(sum(self.extract_seconds) / len(self.extract_seconds), 3) if self.extract_seconds else 0.0,
+            'mean_analysis_seconds': round(sum(self.analysis_seconds) / len(self.analysis_seconds), 2) if self.analysis_seconds else 0.0,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost_usd': round(cost, 4),
+        }
+
+        print("\nResumen de la ingesta")
+        print(f"  Procesados: {processed} en {elapsed:.1f}s ({summary['cvs_per_minute']} CVs/min), "
+              f"{summary['skipped']} saltados por el manifiesto")
+        print(f"  Sheets: {summary['added']} añadidos, {summary['updated']} actualizados, {summary['pending']} pendientes de sincronizar"
+              + (f", {summary['analyzed']} analizados sin escribir (--dry-run)" if self.dry_run else ''))
+        print(f"  Sin teléfono: {summary['no_phone']} | Duplicados: {summary['duplicate']} | Errores: {summary['error']}")
+        print(f"  Extracción media: {summary['mean_extract_seconds'] * 1000:.0f} ms | Análisis medio: {summary['mean_analysis_seconds']:.1f}s "
+              f"({summary['cached_analyses']} desde caché, {self.llm_concurrency} en paralelo)")
+        print(f"  Tokens: {prompt_tokens} prompt + {completion_tokens} completion | Costo estimado: USD {cost:.4f}")
+        return summary
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Ingesta por lotes de CVs (PDF/Word) desde una carpeta')
+    parser.add_argument('directory', help='Carpeta con los CVs (ej. adjuntos descargados del correo o cv_storage)')
+    parser.add_argument('--llm-concurrency', type=int, default=BATCH_LLM_CONCURRENCY, help='CVs en análisis a la vez')
+    parser.add_argument('--extract-workers', type=int, default=BATCH_EXTRACT_WORKERS, help='Procesos de extracción de texto')
+    parser.add_argument('--write-size', type=int, default=BATCH_WRITE_SIZE, help='Candidatos por escritura masiva en Sheets')
+    parser.add_argument('--manifest', default=None, help=f'Ruta del manifiesto (por defecto <carpeta>/{MANIFEST_NAME})')
+    parser.add_argument('--fuente', default='Orgánico', help='Valor de la columna Fuente para estos candidatos')
+    parser.add_argument('--recursive', action='store_true', help='Incluir subcarpetas')
+    parser.add_argument('--dry-run', action='store_true', help='Analizar sin guardar archivos ni escribir candidatos')
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from services.logging_config import setup_logging
+
+    load_dotenv()
+    setup_logging()
+
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        print(f"Error: {directory} no es una carpeta", file=sys.stderr)
+        return 2
+
+    ingestion = BatchIngestion(
+        directory,
+        manifest_path=Path(args.manifest) if args.manifest else None,
+        llm_concurrency=args.llm_concurrency,
+        extract_workers=args.extract_workers,
+        write_size=args.write_size,
+        fuente=args.fuente,
+        dry_run=args.dry_run,
+        recursive=args.recursive,
+    )
+    summary = ingestion.run()
+    return 1 if summary['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# cv_cache.py - Caché de resultados de CV por hash de contenido
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def file_sha256(file_path: str, chunk_size: int = 64 * 1024) -> str:
+    """Calcula el SHA-256 de un archivo leyendo por bloques"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class CVResultCache:
+    """
+    Caché en disco de resultados de análisis de CV
+    Cada entrada es un JSON identificado por el hash del archivo y la versión del
+    análisis (prompts, modelos y perfil), así un cambio de prompt invalida la caché
+    """
+
+    def __init__(self, cache_path: Optional[str] = None):
+        default_path = Path(os.getenv('CV_STORAGE_PATH', './cv_storage/')) / '.cache'
+        self.cache_path = Path(cache_path or os.getenv('CV_CACHE_PATH', str(default_path)))
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.enabled = os.getenv('CV_CACHE_ENABLED', 'True').lower() == 'true'
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, namespace: str, file_hash: str, version: str) -> Path:
+        return self.cache_path / f'{namespace}_{file_hash}_{version}.json'
+
+    def get(self, namespace: str, file_hash: str, version: str) -> Optional[Dict[str, Any]]:
+        """Devuelve la entrada cacheada o None"""
+        if not self.enabled:
+            return None
+        entry_path = self._entry_path(namespace, file_hash, version)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def set(self, namespace: str, file_hash: str, version: str, entry: Dict[str, Any]) -> None:
+        """Guarda la entrada de forma atómica (archivo temporal + rename)"""
+        if not self.enabled:
+            return
+        entry_path = self._entry_path(namespace, file_hash, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(entry, file, ensure_ascii=False)
+            os.replace(tmp_path, entry_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,280 @@
+# cv_sections.py - Pre-extracción local de datos de contacto y selección de secciones del CV
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+from services.tokens import count_tokens, truncate_tokens
+
+# Presupuesto de tokens del texto del CV que se envía a cada llamada al LLM
+CV_PROMPT_TOKEN_BUDGET = int(os.getenv('CV_PROMPT_TOKEN_BUDGET', '1200'))
+CV_EVALUATION_TOKEN_BUDGET = int(os.getenv('CV_EVALUATION_TOKEN_BUDGET', '400'))
+
+# Cambia si cambian las reglas de este módulo (forma parte de la versión del análisis)
+CV_SECTIONS_VERSION = '2'
+
+# Títulos de sección habituales en CVs peruanos, comparados sin tildes y en minúsculas
+SECTION_HEADINGS = {
+    'perfil': ('perfil', 'resumen', 'objetivo', 'sobre mi', 'acerca de mi', 'presentacion'),
+    'experiencia': ('experiencia', 'trayectoria', 'historial laboral', 'antecedentes laborales', 'empleos'),
+    'educacion': ('educacion', 'formacion academica', 'formacion profesional', 'estudios', 'grado academico'),
+    'complementaria': ('cursos', 'capacitacion', 'certificaciones', 'certificados', 'formacion complementaria',
+                       'seminarios', 'diplomados'),
+    'habilidades': ('habilidades', 'competencias', 'conocimientos', 'aptitudes', 'skills', 'informatica',
+                    'herramientas'),
+    'idiomas': ('idiomas', 'idioma', 'lenguas'),
+    'datos': ('datos personales', 'informacion personal', 'datos generales', 'contacto'),
+    'referencias': ('referencias', 'referencias laborales', 'referencias personales'),
+    # Secciones que no aportan a la extracción ni a la evaluación; se reconocen para cerrar la anterior
+    'otros': ('voluntariado', 'intereses', 'pasatiempos', 'hobbies', 'actividades extracurriculares',
+              'premios', 'publicaciones'),
+}
+HEADING_KEYWORDS = frozenset(keyword for keywords in SECTION_HEADINGS.values() for keyword in keywords)
+HEADING_MAX_WORDS = 5
+# Palabras que acompañan a la clave en un título ("Experiencia laboral", "Cursos y certificaciones")
+HEADING_QUALIFIERS = frozenset({'laboral', 'laborales', 'profesional', 'profesionales', 'academica', 'academicos',
+                                'personal', 'personales', 'tecnicas', 'tecnicos', 'blandas', 'complementaria',
+                                'relevante', 'y', 'de', 'e', 'otros', 'otras', 'certificaciones', 'capacitaciones',
+                                'cursos', 'idiomas', 'conocimientos', 'habilidades', 'competencias'})
+
+# Secciones que necesita cada llamada, por prioridad (el presupuesto se reparte en este orden):
+# primero las cortas y decisivas, la experiencia (la más larga) se recorta si no cabe
+EXTRACTION_SECTIONS = ('encabezado', 'datos', 'educacion', 'idiomas', 'habilidades', 'perfil', 'experiencia',
+                       'complementaria')
+EVALUATION_SECTIONS = ('educacion', 'perfil', 'experiencia', 'habilidades', 'datos', 'complementaria')
+
+SECTION_LABELS = {
+    'encabezado': 'ENCABEZADO',
+    'perfil': 'PERFIL',
+    'experiencia': 'EXPERIENCIA',
+    'educacion': 'EDUCACIÓN',
+    'complementaria': 'CURSOS Y CERTIFICACIONES',
+    'habilidades': 'HABILIDADES',
+    'idiomas': 'IDIOMAS',
+    'datos': 'DATOS PERSONALES',
+    'referencias': 'REFERENCIAS',
+    'otros': 'OTROS',
+}
+
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+# Celulares peruanos (9 dígitos que empiezan en 9, con o sin +51) y fijos de Lima (01) xxx-xxxx
+PHONE_PATTERN = re.compile(r'(?<![\d\w])(?:\+?\s?51[\s.-]?)?(?:9\d{2}[\s.-]?\d{3}[\s.-]?\d{3}|\(?01\)?[\s.-]?\d{3}[\s.-]?\d{4})(?!\d)')
+NAME_LABEL_PATTERN = re.compile(r'^(?:nombres?(?: y apellidos| completo)?|apellidos y nombres)(?:\s*[:.\-]\s*|\s{2,})(.+)$', re.IGNORECASE)
+# Etiquetas que quedan solas en una línea de contacto al quitar el dato ya extraído
+CONTACT_LABEL_PATTERN = re.compile(r'\b(?:e-?mail|correo(?: electr[oó]nico)?|cel(?:ular)?|m[oó]vil|tel[eé]fono(?: de contacto| m[oó]vil)?|'
+                                   r'telf|nombres?(?: y apellidos| completo)?|apellidos y nombres)\b\.?', re.IGNORECASE)
+NAME_WORD_PATTERN = re.compile(r"^[A-Za-zÁÉÍÓÚÜÑáéíóúüñ'.-]+$")
+# Líneas del encabezado que no son el nombre aunque lo parezcan
+NOT_NAME_WORDS = {'curriculum', 'vitae', 'cv', 'hoja', 'vida', 'datos', 'personales', 'perfil', 'profesional',
+                  # cargos que suelen ir como subtítulo junto al nombre
+                  'asesor', 'asesora', 'ejecutivo', 'ejecutiva', 'vendedor', 'vendedora', 'supervisor', 'supervisora',
+                  'tecnico', 'tecnica', 'practicante', 'bachiller', 'licenciado', 'licenciada', 'ingeniero',
+                  'ingeniera', 'administrador', 'administradora', 'operador', 'operadora', 'ventas', 'comercial',
+                  'atencion', 'cliente', 'teleoperador', 'teleoperadora', 'promotor', 'promotora'}
+# Ubicaciones frecuentes en el encabezado ("Lima, Perú", "Comas - Lima"): sin acentos, ver _normalize
+PLACE_WORDS = {'lima', 'peru', 'callao', 'arequipa', 'trujillo', 'cusco', 'cuzco', 'chiclayo', 'piura', 'huancayo',
+               'iquitos', 'tacna', 'ica', 'puno', 'comas', 'ate', 'surco', 'miraflores', 'lurigancho', 'carabayllo',
+               'chorrillos', 'independencia', 'brena', 'rimac', 'olivos', 'ventanilla', 'distrito', 'provincia',
+               'departamento', 'direccion', 'domicilio', 'av', 'jr', 'calle', 'urb'}
+NAME_CONNECTORS = {'de', 'del', 'la', 'las', 'los', 'y'}
+NAME_SEARCH_LINES = 8
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def section_of(line: str) -> Optional[str]:
+    """Sección que abre la línea si es un título (corto y con una palabra clave al inicio), o None"""
+    candidate = _normalize(line).strip(' \t:•-–—|*#').strip()
+    if not candidate or len(candidate.split()) > HEADING_MAX_WORDS or len(candidate) > 45:
+        return None
+    for section, keywords in SECTION_HEADINGS.items():
+        for keyword in keywords:
+            if candidate == keyword or candidate.startswith(keyword + ' ') or candidate.startswith(keyword + ':'):
+                return section
+    return None
+
+
+def _is_plain_heading(line: str) -> bool:
+    # Un título puro va en mayúsculas o es una palabra clave seguida solo de calificadores
+    stripped = line.strip(' \t•-–—|*#')
+    if stripped.isupper():
+        return True
+    candidate = _normalize(stripped)
+    for keyword in HEADING_KEYWORDS:
+        if candidate == keyword or (candidate.startswith(keyword + ' ')
+                                    and set(candidate[len(keyword):].split()) <= HEADING_QUALIFIERS):
+            return True
+    return False
+
+
+def split_sections(cv_text: str) -> Dict[str, str]:
+    """
+    Divide el CV en secciones por sus títulos
+
+    Returns:
+        Dict: sección -> texto (sin el título); lo anterior al primer título queda en 'encabezado'.
+        Si una sección aparece varias veces (ej. dos bloques de cursos) se concatenan
+    """
+    sections: Dict[str, List[str]] = {'encabezado': []}
+    current = 'encabezado'
+    for line in cv_text.splitlines():
+        if not line.strip():
+            continue
+        section = section_of(line)
+        if section is not None:
+            current = section
+            sections.setdefault(current, [])
+            heading, separator, rest = line.partition(':')
+            if separator:
+                # "EXPERIENCIA: Asesor en ..." trae contenido en la misma línea del título
+                if rest.strip():
+                    sections[current].append(rest.strip())
+                continue
+            if not _is_plain_heading(heading):
+                # "Estudios de secundaria completa": abre la sección pero también es contenido
+                sections[current].append(line.strip())
+            continue
+        sections[current].append(line.strip())
+    return {section: '\n'.join(lines) for section, lines in sections.items() if lines}
+
+
+def _normalize_phone(raw: str) -> str:
+    digits = re.sub(r'\D', '', raw)
+    if digits.startswith('51') and len(digits) in (11, 10):
+        digits = digits[2:]
+    if len(digits) == 9 and digits.startswith('9'):
+        return f'+51 {digits[:3]} {digits[3:6]} {digits[6:]}'
+    return raw.strip()
+
+
+def _is_name_line(line: str, labelled: bool = False) -> bool:
+    # Sin etiqueta, una coma indica ubicación ("Lima, Perú"); con etiqueta puede ser "Apellidos, Nombres"
+    if ',' in line and not labelled:
+        return False
+    words = line.replace(',', ' ').split()
+    if not 2 <= len(words) <= 6:
+        return False
+    if any(not NAME_WORD_PATTERN.match(word) for word in words):
+        return False
+    if any(_normalize(word).strip('.') in NOT_NAME_WORDS | PLACE_WORDS for word in words):
+        return False
+    significant = [word for word in words if word.lower() not in NAME_CONNECTORS]
+    # Nombres en mayúsculas o con cada palabra capitalizada
+    return len(significant) >= 2 and all(word[0].isupper() for word in significant)
+
+
+def _title_case(name: str) -> str:
+    words = name.replace(',', ' ').split()
+    return ' '.join(word.lower() if word.lower() in NAME_CONNECTORS and index else word.capitalize()
+                    for index, word in enumerate(words))
+
+
+def extract_contact(cv_text: str) -> Dict[str, Optional[str]]:
+    """
+    Extrae email, teléfono y nombre con reglas locales (sin LLM)
+
+    El nombre solo se acepta si es evidente: una línea "Nombre: ..." o una de las primeras líneas
+    formada por 2 a 6 palabras capitalizadas, sin dígitos, títulos de sección ni ubicaciones
+
+    Returns:
+        Dict: email, telefono y nombre_completo; None en los que no se encontraron
+    """
+    email = EMAIL_PATTERN.search(cv_text)
+    phone = PHONE_PATTERN.search(cv_text)
+
+    name = None
+    lines = [line.strip() for line in cv_text.splitlines() if line.strip()]
+    for line in lines:
+        labelled = NAME_LABEL_PATTERN.match(line)
+        if labelled and _is_name_line(labelled.group(1).strip(), labelled=True):
+            name = labelled.group(1).strip()
+            break
+    if name is None:
+        for line in lines[:NAME_SEARCH_LINES]:
+            if section_of(line) is not None:
+                break
+            # Encabezados tipo "María Pérez | Asesora comercial": se mira el primer segmento
+            first = re.split(r'\s[|–—-]\s', line)[0].strip()
+            if _is_name_line(first):
+                name = first
+                break
+
+    return {
+        'email': email.group().rstrip('.').lower() if email else None,
+        'telefono': _normalize_phone(phone.group()) if phone else None,
+        'nombre_completo': _title_case(name) if name else None,
+    }
+
+
+def strip_contact(text: str, contact: Dict[str, Optional[str]]) -> str:
+    """Quita del texto las líneas que solo contienen datos de contacto ya extraídos"""
+    values = [value for value in (contact.get('email'), contact.get('nombre_completo')) if value]
+    kept = []
+    for line in text.splitlines():
+        rest = PHONE_PATTERN.sub(' ', EMAIL_PATTERN.sub(' ', line)) if contact.get('email') or contact.get('telefono') else line
+        for value in values:
+            rest = re.sub(re.escape(value), ' ', rest, flags=re.IGNORECASE)
+        rest = CONTACT_LABEL_PATTERN.sub(' ', rest)
+        # Queda algo más que separadores (ej. la ciudad en "Comas, Lima | 987 654 321")
+        if len(re.sub(r'[\W_]', '', rest)) >= 3:
+            kept.append(line if rest == line else ' '.join(re.sub(r'\s*[|·/,;:]\s*(?=[|·/,;:]|$)', '', rest).split()).strip(' |·/,;:-'))
+    return '\n'.join(kept)
+
+
+def _fit_lines(text: str, budget: int) -> str:
+    """Líneas completas desde el inicio hasta agotar el presupuesto (la última se recorta)"""
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            if budget - used > 20:
+                kept.append(truncate_tokens(line, budget - used - 1))
+            break
+        kept.append(line)
+        used += tokens
+    return '\n'.join(kept)
+
+
+def select_sections(cv_text: str, wanted: Iterable[str], budget: int,
+                    sections: Optional[Dict[str, str]] = None,
+                    contact: Optional[Dict[str, Optional[str]]] = None) -> str:
+    """
+    Texto para el LLM con solo las secciones pedidas, dentro de `budget` tokens
+
+    Las secciones se agregan en el orden de `wanted`; la que no cabe completa se recorta por líneas
+    y las siguientes se omiten. Si el CV no tiene títulos reconocibles se envía el inicio del texto
+    completo recortado al presupuesto
+
+    Args:
+        cv_text (str): Texto completo del CV
+        wanted (Iterable[str]): Secciones por prioridad (ver EXTRACTION_SECTIONS)
+        budget (int): Tokens máximos
+        sections (Dict): Resultado de split_sections si ya se calculó
+        contact (Dict): Resultado de extract_contact; esos datos se quitan del encabezado y los datos personales
+    """
+    sections = sections if sections is not None else split_sections(cv_text)
+    if len(sections) < 3:
+        return _fit_lines(strip_contact(cv_text, contact) if contact else cv_text, budget)
+
+    blocks = []
+    remaining = budget
+    for section in wanted:
+        text = sections.get(section)
+        if text and contact and section in ('encabezado', 'datos'):
+            text = strip_contact(text, contact)
+        if not text:
+            continue
+        label = f'[{SECTION_LABELS[section]}]'
+        cost = count_tokens(label) + count_tokens(text) + 2
+        if cost > remaining:
+            fitted = _fit_lines(text, remaining - count_tokens(label) - 2)
+            if fitted:
+                blocks.append(f'{label}\n{fitted}')
+            break
+        blocks.append(f'{label}\n{text}')
+        remaining -= cost
+    return '\n\n'.join(blocks)
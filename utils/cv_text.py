@@ -0,0 +1,267 @@
+# cv_text.py - Extracción de texto de CVs (PDF y Word) con backends intercambiables
+import os
+import math
+import hashlib
+import logging
+import importlib
+import zipfile
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import chain
+from typing import Iterable, List, Optional
+
+from services.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# Backends de PDF: módulos con la API PdfReader(path).pages[i].extract_text()
+# pypdf separa mejor las líneas (útil para el LLM); PyPDF2 es más rápido por página pero ya no se mantiene
+PDF_BACKENDS = {
+    'pypdf': 'pypdf',
+    'pypdf2': 'PyPDF2',
+}
+PDF_BACKEND = os.getenv('CV_PDF_BACKEND', 'pypdf').lower()
+# Un CV rara vez pasa de unas pocas páginas: el resto se descarta (anexos, certificados escaneados)
+PDF_MAX_PAGES = int(os.getenv('CV_PDF_MAX_PAGES', '30'))
+# Desde cuántas páginas se reparte la extracción en el pool de procesos (0 lo desactiva)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('CV_PDF_PARALLEL_MIN_PAGES', '12'))
+PDF_WORKERS = int(os.getenv('CV_PDF_WORKERS', str(min(2, os.cpu_count() or 1))))
+
+# Word: stream lee el XML con iterparse (cuerpo, tablas, cuadros de texto, encabezados y pies);
+# python-docx solo recorre los párrafos del cuerpo
+DOCX_BACKENDS = ('stream', 'python-docx')
+DOCX_BACKEND = os.getenv('CV_DOCX_BACKEND', 'stream').lower()
+
+# Forma parte de la clave de la caché de texto: otro backend o límite extrae otro texto
+TEXT_EXTRACTION_VERSION = hashlib.sha1(f'{PDF_BACKEND}|{PDF_MAX_PAGES}|{DOCX_BACKEND}|2'.encode('utf-8')).hexdigest()[:12]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _open_reader(backend: str, file_path: str):
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f'Backend de PDF no soportado: {backend}')
+    return importlib.import_module(PDF_BACKENDS[backend]).PdfReader(file_path)
+
+
+def _pages_text(reader, start: int, stop: int) -> List[str]:
+    return [reader.pages[index].extract_text() or '' for index in range(start, stop)]
+
+
+def _extract_page_range(backend: str, file_path: str, start: int, stop: int) -> List[str]:
+    """Extrae un rango de páginas en un proceso del pool (cada proceso abre su propio lector)"""
+    return _pages_text(_open_reader(backend, file_path), start, stop)
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: el proceso web tiene hilos y fork podría heredar locks tomados
+                _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _discard_pool(broken: ProcessPoolExecutor) -> None:
+    """Descarta un pool roto (un proceso murió); el siguiente PDF grande crea uno nuevo"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_pdf_text(file_path: str, backend: Optional[str] = None, max_pages: Optional[int] = None,
+                     parallel_min_pages: Optional[int] = None) -> str:
+    """
+    Extrae el texto de un PDF hasta max_pages páginas
+
+    Args:
+        file_path (str): Ruta al PDF
+        backend (str): pypdf (por defecto) o pypdf2
+        max_pages (int): Límite de páginas (CV_PDF_MAX_PAGES)
+        parallel_min_pages (int): Páginas a partir de las cuales se usa el pool de procesos
+
+    Returns:
+        str: Texto de las páginas unido por saltos de línea
+    """
+    backend = (backend or PDF_BACKEND).lower()
+    max_pages = max_pages if max_pages is not None else PDF_MAX_PAGES
+    parallel_min_pages = parallel_min_pages if parallel_min_pages is not None else PDF_PARALLEL_MIN_PAGES
+
+    reader = _open_reader(backend, file_path)
+    total_pages = len(reader.pages)
+    page_count = min(total_pages, max_pages)
+    parallel = PDF_WORKERS > 1 and 0 < parallel_min_pages <= page_count
+
+    pages = None
+    if parallel:
+        chunk = math.ceil(page_count / PDF_WORKERS)
+        starts = list(range(0, page_count, chunk))
+        stops = [min(start + chunk, page_count) for start in starts]
+        pool = None
+        try:
+            pool = _process_pool()
+            ranges = pool.map(_extract_page_range, [backend] * len(starts), [file_path] * len(starts), starts, stops)
+            pages = list(chain.from_iterable(ranges))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool) and pool is not None:
+                _discard_pool(pool)
+            # Sin procesos disponibles (contenedor limitado, pool roto) se extrae en el hilo actual
+            logger.warning(f"Pool de extracción de PDF no disponible, se extrae en proceso: {e}")
+            parallel = False
+    if pages is None:
+        pages = _pages_text(reader, 0, page_count)
+
+    active = current_span()
+    if active is not None:
+        active.set_attribute('backend', backend)
+        active.set_attribute('pages', page_count)
+        active.set_attribute('pages_total', total_pages)
+        active.set_attribute('parallel', parallel)
+    if total_pages > page_count:
+        logger.info(f"PDF de {total_pages} páginas: se extraen las primeras {page_count}")
+
+    # join en lugar de concatenar página por página (evita el costo cuadrático)
+    return '\n'.join(pages).strip()
+
+
+# Únicos elementos que cambian el texto extraído; el resto (formato, propiedades) se salta sin procesar
+_DOCX_TAGS = frozenset({'p', 't', 'tab', 'br', 'cr', 'tr', 'tc', 'pPr', 'Fallback', 'body', 'hdr', 'ftr'})
+
+
+@lru_cache(maxsize=512)
+def _docx_tag(tag: str) -> Optional[str]:
+    # Nombre local: sirve igual para OOXML transicional y estricto (distinto namespace, mismos nombres)
+    name = tag.rsplit('}', 1)[-1]
+    return name if name in _DOCX_TAGS else None
+
+
+def _iter_docx_part_lines(stream) -> Iterable[str]:
+    """
+    Recorre una parte de Word (document.xml, header*.xml, footer*.xml) con iterparse
+
+    Cada párrafo es una línea; cada fila de tabla es una línea con las celdas separadas por ' | '.
+    Los cuadros de texto salen como párrafos propios. El contenido de mc:Fallback (copia VML de
+    los cuadros de texto) se omite para no duplicarlo. Cada bloque del cuerpo se libera al
+    terminar de leerlo, así la memoria no crece con el tamaño del documento
+    """
+    paragraphs: List[List[str]] = []      # párrafos abiertos (un cuadro de texto anida párrafos)
+    containers: List[List[str]] = [[]]    # destino de las líneas: el documento o la celda abierta
+    rows: List[List[str]] = []            # filas de tabla abiertas (tablas anidadas)
+    fallback_depth = 0
+    properties_depth = 0                  # dentro de w:pPr las w:tab son tabulaciones definidas, no texto
+    body = None
+
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        name = _docx_tag(elem.tag)
+        if name is None:
+            continue
+
+        if event == 'start':
+            if name == 'Fallback':
+                fallback_depth += 1
+            elif fallback_depth:
+                pass
+            elif name == 'p':
+                paragraphs.append([])
+            elif name == 'pPr':
+                properties_depth += 1
+            elif name == 'tr':
+                rows.append([])
+            elif name == 'tc':
+                containers.append([])
+            elif name in ('body', 'hdr', 'ftr'):
+                body = elem
+            continue
+
+        if name == 'Fallback':
+            fallback_depth -= 1
+            continue
+        if fallback_depth:
+            continue
+        if name == 't':
+            if paragraphs and not properties_depth:
+                paragraphs[-1].append(elem.text or '')
+            continue
+        if name == 'pPr':
+            properties_depth -= 1
+        elif properties_depth:
+            pass
+        elif name == 'tab' and paragraphs:
+            paragraphs[-1].append('\t')
+        elif name in ('br', 'cr') and paragraphs:
+            paragraphs[-1].append('\n')
+        elif name == 'p' and paragraphs:
+            text = ''.join(paragraphs.pop()).strip()
+            if text:
+                containers[-1].append(text)
+        elif name == 'tc' and len(containers) > 1:
+            rows[-1].append(' '.join(containers.pop()))
+        elif name == 'tr' and rows:
+            cells = [cell for cell in rows.pop() if cell]
+            if cells:
+                containers[-1].append(' | '.join(cells))
+
+        # Sin párrafos ni filas abiertos terminó un bloque del cuerpo: se entregan sus líneas y se libera
+        if body is not None and not paragraphs and not rows and name in ('p', 'tr'):
+            yield from containers[0]
+            containers[0].clear()
+            body.clear()
+
+    yield from containers[0]
+
+
+def _extract_docx_stream(file_path: str) -> str:
+    with zipfile.ZipFile(file_path) as archive:
+        names = archive.namelist()
+        headers = sorted(name for name in names if name.startswith('word/header') and name.endswith('.xml'))
+        footers = sorted(name for name in names if name.startswith('word/footer') and name.endswith('.xml'))
+
+        def part_lines(part_names):
+            # Encabezados y pies se repiten (primera página, pares, impares): cada línea una vez
+            seen = {}
+            for part_name in part_names:
+                with archive.open(part_name) as stream:
+                    for line in _iter_docx_part_lines(stream):
+                        seen.setdefault(line, None)
+            return list(seen)
+
+        # Los datos de contacto suelen ir en el encabezado: se ponen antes del cuerpo
+        lines = part_lines(headers)
+        with archive.open('word/document.xml') as stream:
+            lines.extend(_iter_docx_part_lines(stream))
+        lines.extend(part_lines(footers))
+    return '\n'.join(lines).strip()
+
+
+def _extract_docx_python_docx(file_path: str) -> str:
+    from docx import Document
+
+    document = Document(file_path)
+    return '\n'.join(paragraph.text for paragraph in document.paragraphs).strip()
+
+
+def extract_docx_text(file_path: str, backend: Optional[str] = None) -> str:
+    """
+    Extrae el texto de un documento Word
+
+    Args:
+        file_path (str): Ruta al .docx
+        backend (str): stream (por defecto) o python-docx
+
+    Returns:
+        str: Una línea por párrafo o fila de tabla
+    """
+    backend = (backend or DOCX_BACKEND).lower()
+    if backend not in DOCX_BACKENDS:
+        raise ValueError(f'Backend de Word no soportado: {backend}')
+    if backend == 'python-docx':
+        return _extract_docx_python_docx(file_path)
+    return _extract_docx_stream(file_path)
@@ -9,11 +9,15 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_chroma import Chroma
 
+from services.deadline import LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT, run_bounded
+from services.metrics import llm_metrics_callback
+from services.tracing import span
+
 load_dotenv()
 
 class AIBotTool:
     def __init__(self):
-        self.chat_model = ChatOpenAI(model='gpt-4o-mini')
+        self.chat_model = ChatOpenAI(model='gpt-4o-mini', timeout=LLM_REQUEST_TIMEOUT, max_retries=LLM_MAX_RETRIES, callbacks=[llm_metrics_callback])
         self.retriever = self._build_retriever()
 
         # Prompt system para el agente RAG
@@ -39,7 +43,7 @@ class AIBotTool:
     def _build_retriever(self):
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         persist_directory = os.path.join(base_dir, 'RAG', 'chroma_vectorstore_RAG')
-        embedding_model = OpenAIEmbeddings(model='text-embedding-ada-002')
+        embedding_model = OpenAIEmbeddings(model='text-embedding-ada-002', timeout=LLM_REQUEST_TIMEOUT, max_retries=LLM_MAX_RETRIES)
 
         vector_store = Chroma(
             persist_directory = persist_directory,
@@ -56,13 +60,17 @@ class AIBotTool:
         return messages
     
     def run_retriever(self, history_messages, question):
-        context_docs = self.retriever.invoke(question)
+        with span('rag.retrieve') as retrieve_span:
+            # Acotado al tiempo del turno (embedding de la pregunta + búsqueda en Chroma)
+            context_docs = run_bounded('rag', self.retriever.invoke, question)
+            retrieve_span.set_attribute('documents', len(context_docs))
         messages = self._build_messages(history_messages, question)
 
-        response = self.doc_chain.invoke({
-            'context': context_docs,
-            'messages': messages
-        })
+        with span('rag.generate'):
+            response = self.doc_chain.invoke({
+                'context': context_docs,
+                'messages': messages
+            })
 
         return response
 